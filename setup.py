@@ -42,7 +42,9 @@ setup(
         "tqdm",
         "pyyaml",
         "sqlalchemy",
-        "appdirs"
+        "appdirs",
+        "numpy",
+        "msgpack"
     ],
     include_package_data=True,
 )
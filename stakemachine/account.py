@@ -0,0 +1,101 @@
+from bitshares.account import Account
+from bitshares.amount import Amount
+from bitshares.price import Order
+
+
+def open_order(o, bitshares_instance=None):
+    """ Return a limit order object of the chain as
+        :class:`bitshares.price.Order`
+
+        Orders built from ``sell_price`` carry the amounts the order
+        was placed with. The amount that is still for sale is added as
+        ``for_sale`` (:class:`bitshares.amount.Amount`).
+
+        :param dict o: Limit order object (``1.7.x``)
+    """
+    order = Order(o, bitshares_instance=bitshares_instance)
+    order["for_sale"] = Amount(
+        {"amount": o["for_sale"], "asset_id": o["sell_price"]["base"]["asset_id"]},
+        bitshares_instance=bitshares_instance)
+    return order
+
+
+class LightAccount(Account):
+    """ Minimal view of an account
+
+        Only the account object itself is loaded (like
+        ``Account(name, full=False)``). The data that is part of the
+        *full* account (statistics, votes, orders, positions, ...) is
+        loaded on first access to one of :attr:`full_fields` and
+        dropped again by :meth:`refresh`.
+
+        :meth:`orders` fetches orders by id with a single
+        ``get_objects``. :attr:`openorders` fetches all open orders
+        from the full account whenever it is accessed, but does not
+        keep the rest of the full account around. :attr:`balances`
+        queries just the balances anyway. None of them needs a
+        :meth:`refresh`.
+
+        :param str account: Name or id of the account
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares instance
+    """
+    #: Keys that are only available in full accounts
+    full_fields = [
+        "statistics",
+        "registrar_name",
+        "referrer_name",
+        "lifetime_referrer_name",
+        "votes",
+        "balances",
+        "vesting_balances",
+        "limit_orders",
+        "call_orders",
+        "settle_orders",
+        "proposals",
+        "assets",
+        "withdraws",
+    ]
+
+    def __init__(self, account, bitshares_instance=None):
+        super().__init__(account, full=False, bitshares_instance=bitshares_instance)
+
+    def _full_account(self):
+        return self.bitshares.rpc.get_full_accounts([self["id"]], False)[0][1]
+
+    def __missing__(self, key):
+        if key not in self.full_fields:
+            raise KeyError(key)
+        for k, v in self._full_account().items():
+            if k != "account":
+                dict.__setitem__(self, k, v)
+        return dict.__getitem__(self, key)
+
+    def refresh(self):
+        """ Reload the account object and forget the full data
+        """
+        for k in self.full_fields:
+            self.pop(k, None)
+        super().refresh()
+
+    def orders(self, ids):
+        """ Return those of the orders ``ids`` that are still open
+            (fetched from the chain)
+
+            :param list ids: Order ids (``1.7.x``)
+        """
+        if not ids:
+            return []
+        return [
+            open_order(o, bitshares_instance=self.bitshares)
+            for o in self.bitshares.rpc.get_objects(list(ids))
+            if o and o.get("seller") == self["id"]
+        ]
+
+    @property
+    def openorders(self):
+        """ Returns all open orders (always fetched from the chain)
+        """
+        return [
+            open_order(o, bitshares_instance=self.bitshares)
+            for o in self._full_account()["limit_orders"]
+        ]
@@ -0,0 +1,229 @@
+import time
+import logging
+from bitshares.account import AccountUpdate
+from bitshares.price import Order, FilledOrder
+from bitshares.instance import shared_bitshares_instance
+from .operations import decode as decode_operation
+log = logging.getLogger(__name__)
+
+# Operation ids, see bitsharesbase.operationids
+LIMIT_ORDER_CREATE = 1
+FILL_ORDER = 4
+
+
+def block_num(block_hash):
+    """ Return the block number encoded in the first four bytes of a
+        block id
+    """
+    return int(block_hash[:8], 16)
+
+
+class Backfill():
+    """ Detects gaps in the sequence of blocks received by
+        :class:`stakemachine.bot.BotInfrastructure` (e.g. because the
+        websocket connection dropped) and replays the missed events.
+
+        After a gap, the missed blocks are fetched and the operations
+        that concern the subscribed markets (new orders) and accounts
+        (all operations including fills, from the account history) are
+        replayed to the bots in chain order and without any delay.
+        Replayed market events are also handed to the paper trading
+        engine (if any), so that paper orders fill against the missed
+        orders as well. Replayed events carry ``replayed = True`` so that strategies can
+        skip expensive side effects:
+
+        .. code-block:: python
+
+            def onMarketUpdate(self, d):
+                if d.get("replayed"):
+                    return
+
+        Blocks are only fetched if bots are subscribed to markets. They
+        are fetched ``batch`` at a time with ``get_blocks`` of the
+        node's block API, or one by one with ``get_block`` if the node
+        does not offer it, the most recent ones first. Once fetching
+        has taken ``max_seconds``, the older blocks are skipped.
+
+        :param stakemachine.bot.BotInfrastructure infrastructure: The bots
+        :param int max_blocks: Maximum number of blocks to backfill.
+            Larger gaps are only backfilled for their most recent blocks.
+        :param float max_seconds: Time after which no more blocks are
+            fetched
+        :param int batch: Blocks per ``get_blocks`` call (at most 100)
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares instance
+    """
+    def __init__(
+        self,
+        infrastructure,
+        max_blocks=1000,
+        max_seconds=30,
+        batch=100,
+        bitshares_instance=None
+    ):
+        self.bitshares = bitshares_instance or shared_bitshares_instance()
+        self.infrastructure = infrastructure
+        self.max_blocks = max_blocks
+        self.max_seconds = max_seconds
+        self.batch = batch
+        self.last_block = None
+        self.block_api = True
+
+    def on_block(self, block_hash):
+        """ To be called with every block id received
+        """
+        num = block_num(block_hash)
+        if self.last_block and num > self.last_block + 1:
+            start, stop = self.last_block + 1, num - 1
+            if stop - start + 1 > self.max_blocks:
+                log.warning(
+                    "Missed {} blocks, only backfilling the last {}".format(
+                        stop - start + 1, self.max_blocks))
+                start = stop - self.max_blocks + 1
+            log.info("Backfilling blocks {} to {}".format(start, stop))
+            try:
+                self.replay(start, stop)
+            except Exception:
+                log.exception("Backfilling blocks {} to {} failed".format(start, stop))
+        if not self.last_block or num > self.last_block:
+            self.last_block = num
+
+    def replay(self, start, stop):
+        """ Replay the events of blocks ``start`` to ``stop`` (inclusive)
+        """
+        events = self.market_events(start, stop) + self.account_events(start, stop)
+        events.sort(key=lambda e: e[0])
+        paper = getattr(self.infrastructure, "paper", None)
+        for _, event, botnames, data in events:
+            data["replayed"] = True
+            if paper and event == "onMarketUpdate":
+                # Like live market notifications, see
+                # :meth:`stakemachine.bot.BotInfrastructure._on_market`
+                paper.on_market(data)
+            operation = None
+            if event == "onAccount":
+                operation = decode_operation(
+                    data["operation"], bitshares_instance=self.bitshares)
+                if operation:
+                    operation[1]["replayed"] = True
+            for botname in botnames:
+                if self.infrastructure.bots[botname].disabled:
+                    continue
+                self.infrastructure.dispatch(botname, event, data)
+                if operation:
+                    self.infrastructure.dispatch(
+                        botname, operation[0], operation[1],
+                        error="error_onAccount")
+        return len(events)
+
+    def get_blocks(self, start, stop):
+        """ Return the blocks ``start`` to ``stop`` (inclusive) as
+            ``(num, block)`` tuples
+        """
+        rpc = self.bitshares.rpc
+        if self.block_api:
+            try:
+                return list(zip(
+                    range(start, stop + 1),
+                    rpc.get_blocks(start, stop, api="block")))
+            except Exception as e:
+                log.info("Node does not offer get_blocks ({}), fetching blocks one by one".format(e))
+                self.block_api = False
+        return [(num, rpc.get_block(num)) for num in range(start, stop + 1)]
+
+    def market_events(self, start, stop):
+        """ New orders placed in the subscribed markets
+        """
+        subscriptions = self.infrastructure.subscriptions
+        events = []
+        if not subscriptions.market_index:
+            return events
+        deadline = time.time() + self.max_seconds
+        last = stop
+        while last >= start:
+            if time.time() > deadline:
+                log.warning(
+                    "Fetching blocks took more than {}s, skipping blocks {} to {}".format(
+                        self.max_seconds, start, last))
+                break
+            first = max(start, last - self.batch + 1)
+            blocks = self.get_blocks(first, last)
+            last = first - 1
+            for num, block in blocks:
+                if not block:
+                    continue
+                for trx_in_block, tx in enumerate(block["transactions"]):
+                    for op_in_trx, (op_id, op) in enumerate(tx["operations"]):
+                        if op_id != LIMIT_ORDER_CREATE:
+                            continue
+                        key = frozenset([
+                            op["amount_to_sell"]["asset_id"],
+                            op["min_to_receive"]["asset_id"]
+                        ])
+                        botnames = subscriptions.market_index.get(key)
+                        if not botnames:
+                            continue
+                        order = Order(op, bitshares_instance=self.bitshares)
+                        position = (num, trx_in_block, op_in_trx, 0)
+                        events.append((position, "onMarketUpdate", botnames, order))
+        return events
+
+    def account_events(self, start, stop):
+        """ Operations of the subscribed accounts taken from their
+            history. Fills are also replayed to the bots of the market
+            they happened in.
+        """
+        subscriptions = self.infrastructure.subscriptions
+        events = []
+        for account, botnames in subscriptions.account_index.items():
+            account_id = self.infrastructure.bots[botnames[0]].account["id"]
+            update = None
+            for entry in self.history(account_id, start, stop):
+                position = (
+                    entry["block_num"],
+                    entry["trx_in_block"],
+                    entry["op_in_trx"],
+                    entry["virtual_op"]
+                )
+                if update is None:
+                    update = AccountUpdate(account, bitshares_instance=self.bitshares)
+                    # Live updates should not deliver these operations again
+                    self.infrastructure._total_ops[update["owner"]] = int(update["total_ops"])
+                accountupdate = AccountUpdate(dict(update), bitshares_instance=self.bitshares)
+                accountupdate["operation"] = entry
+                events.append((position, "onAccount", botnames, accountupdate))
+
+                op_id, op = entry["op"]
+                if op_id == FILL_ORDER:
+                    key = frozenset([
+                        op["pays"]["asset_id"],
+                        op["receives"]["asset_id"]
+                    ])
+                    market_bots = subscriptions.market_index.get(key)
+                    if market_bots:
+                        fill = FilledOrder(op, bitshares_instance=self.bitshares)
+                        events.append((position, "onMarketUpdate", market_bots, fill))
+        return events
+
+    def history(self, account_id, start, stop, limit=100):
+        """ Return the account history entries within blocks ``start``
+            to ``stop``
+        """
+        entries = []
+        first = "1.11.0"
+        last = None
+        while True:
+            txs = self.bitshares.rpc.get_account_history(
+                account_id,
+                first,
+                limit,
+                last or "1.11.{}".format(2 ** 53),
+                api="history"
+            )
+            for tx in txs:
+                if tx["block_num"] < start:
+                    return entries
+                if tx["block_num"] <= stop:
+                    entries.append(tx)
+            if len(txs) < limit:
+                return entries
+            last = "1.11.{}".format(int(txs[-1]["id"].split(".")[2]) - 1)
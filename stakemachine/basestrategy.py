@@ -1,13 +1,47 @@
+import time
 import logging
+from contextlib import contextmanager
 from events import Events
 from bitshares.market import Market
 from bitshares.account import Account
 from bitshares.price import FilledOrder, Order, UpdateCallOrder
 from bitshares.instance import shared_bitshares_instance
-from .storage import Storage
+from .storage import Storage, get_backend, metaCategory
 from .statemachine import StateMachine
+from .timeseries import TimeSeries
+from .paper import PaperMarket
+from .account import LightAccount, open_order
+from .registry import OrderRegistry
+from .ledger import Ledger
 log = logging.getLogger(__name__)
 
+#: Events that require a subscription to new blocks
+BLOCK_EVENTS = frozenset([
+    'ontick',
+])
+#: Events that require a subscription to the bot's market
+MARKET_EVENTS = frozenset([
+    'onMarketUpdate',
+    'onOrderMatched',
+    'onOrderPlaced',
+    'onUpdateCallOrder',
+])
+#: Events that require a subscription to the bot's account
+ACCOUNT_EVENTS = frozenset([
+    'onAccount',
+    'onFill',
+    'onOrderCreated',
+    'onOrderCancelled',
+    'onTransfer',
+    'onCallOrderUpdated',
+])
+#: Events the order registry is updated from
+REGISTRY_EVENTS = frozenset([
+    'onFill',
+    'onOrderCreated',
+    'onOrderCancelled',
+])
+
 
 class BaseStrategy(Storage, StateMachine, Events):
     """ Base Strategy and methods available in all Sub Classes that
@@ -27,8 +61,12 @@ class BaseStrategy(Storage, StateMachine, Events):
          * ``basestrategy.get_state``: Change state of state machine
          * ``basestrategy.account``: The Account object of this bot
          * ``basestrategy.market``: The market used by this bot
+         * ``basestrategy.markets``: All markets of the bot
          * ``basestrategy.orders``: List of open orders of the bot's account in the bot's market
          * ``basestrategy.balance``: List of assets and amounts available in the bot's account
+         * ``basestrategy.registry``: The :class:`stakemachine.registry.OrderRegistry` of the bot's own orders
+         * ``basestrategy.paper``: The :class:`stakemachine.paper.PaperEngine` if paper trading
+         * ``basestrategy.head_block()``: Number of the latest block
 
         Also, Base Strategy inherits :class:`stakemachine.storage.Storage`
         which allows to permanently store data in a sqlite database
@@ -36,9 +74,35 @@ class BaseStrategy(Storage, StateMachine, Events):
 
         ``basestrategy["key"] = "value"``
 
-        .. note:: This applies a ``json.loads(json.dumps(value))``!
+        .. note:: Values are serialized with
+                  :class:`stakemachine.codec.Codec`. Amounts, prices
+                  and orders can be stored as they are.
+
+        Numerical histories should go into a
+        :class:`stakemachine.timeseries.TimeSeries` instead:
+
+        ``basestrategy.timeseries("feed", ["price"]).append(block, price=p)``
+
+        Strategies may declare the events they consume in ``interests``
+        (or bots in the ``events`` key of their configuration). If
+        neither is given, the events that have handlers registered once
+        the bot has been constructed are used. The infrastructure only
+        subscribes to blocks, markets and accounts some bot is
+        interested in.
     """
 
+    #: Set of events the strategy consumes (``None``: derive from the
+    #: registered handlers)
+    interests = None
+
+    #: Events market updates are routed to, by type (every strategy
+    #: class works on its own copy, see :meth:`__init_subclass__`)
+    _routes = {
+        FilledOrder: 'onOrderMatched',
+        Order: 'onOrderPlaced',
+        UpdateCallOrder: 'onUpdateCallOrder',
+    }
+
     __events__ = [
         'ontick',
         'onMarketUpdate',
@@ -49,6 +113,12 @@ class BaseStrategy(Storage, StateMachine, Events):
         'onOrderMatched',
         'onOrderPlaced',
         'onUpdateCallOrder',
+        'onDisabledChange',
+        'onFill',
+        'onOrderCreated',
+        'onOrderCancelled',
+        'onTransfer',
+        'onCallOrderUpdated',
     ]
 
     def __init__(
@@ -62,6 +132,8 @@ class BaseStrategy(Storage, StateMachine, Events):
         onUpdateCallOrder=None,
         ontick=None,
         bitshares_instance=None,
+        paper=None,
+        head=None,
         *args,
         **kwargs
     ):
@@ -69,7 +141,11 @@ class BaseStrategy(Storage, StateMachine, Events):
         self.bitshares = bitshares_instance or shared_bitshares_instance()
 
         # Storage
-        Storage.__init__(self, name)
+        Storage.__init__(
+            self,
+            name,
+            backend=get_backend(config["bots"][name].get("storage"))
+        )
 
         # Statemachine
         StateMachine.__init__(self, name)
@@ -77,6 +153,18 @@ class BaseStrategy(Storage, StateMachine, Events):
         # Events
         Events.__init__(self)
 
+        # disabled flag - see ``disabled``
+        self._disabled = False
+        self._dispatch_table = None
+
+        # The bot's own bookkeeping, listed by ``stakemachine status``
+        # (see :meth:`store_meta`)
+        self.meta = Storage(metaCategory, backend=self.backend)
+
+        # Time and name of the latest event, stored by :meth:`flush`
+        self.last_event = None
+        self._last_event_name = None
+
         if ontick:
             self.ontick += ontick
         if onMarketUpdate:
@@ -92,32 +180,155 @@ class BaseStrategy(Storage, StateMachine, Events):
 
         # Redirect this event to also call order placed and order matched
         self.onMarketUpdate += self._callbackPlaceFillOrders
+        self._interests = frozenset(BLOCK_EVENTS | MARKET_EVENTS | ACCOUNT_EVENTS)
 
         self.config = config
+        self.name = name
         self.bot = config["bots"][name]
-        self._account = Account(
-            self.bot["account"],
-            full=True,
-            bitshares_instance=self.bitshares
-        )
-        self._market = Market(
-            config["bots"][name]["market"],
+        self._timeseries = dict()
+        if self.bot.get("account_mode", "full") == "light":
+            self._account = LightAccount(
+                self.bot["account"],
+                bitshares_instance=self.bitshares
+            )
+        else:
+            self._account = Account(
+                self.bot["account"],
+                full=True,
+                bitshares_instance=self.bitshares
+            )
+
+        # Paper trading - see :class:`stakemachine.paper.PaperEngine`
+        self.paper = paper
+
+        # Number of the latest block the infrastructure has handled,
+        # see :meth:`head_block`
+        self._head = head
+
+        # Bots may trade in several markets (``markets``), the first
+        # one is the bot's ``market``
+        self._markets = [
+            PaperMarket(m, paper=paper, bitshares_instance=self.bitshares)
+            if paper else
+            Market(m, bitshares_instance=self.bitshares)
+            for m in self.bot.get("markets") or [self.bot["market"]]
+        ]
+        self._market = self._markets[0]
+
+        # Own orders, see :class:`stakemachine.registry.OrderRegistry`
+        self.registry = OrderRegistry(
+            self,
+            self._account["id"],
+            [[m["base"]["id"], m["quote"]["id"]] for m in self._markets],
             bitshares_instance=self.bitshares
         )
+        self.onOrderCreated += self.registry.onOrderCreated
+        self.onFill += self.registry.onFill
+        self.onOrderCancelled += self.registry.onOrderCancelled
+        self.reconcile_blocks = int(self.bot.get("reconcile_blocks", 0))
 
-        # Settings for bitshares instance
-        self.bitshares.bundle = bool(self.bot.get("bundle", False))
+        # Fills of the bot's orders if enabled, see
+        # :class:`stakemachine.ledger.Ledger` (paper fills are reported
+        # by the paper engine)
+        if self.bot.get("ledger", False) and not paper:
+            self.ledger = Ledger(
+                self,
+                [[m["base"]["id"], m["quote"]["id"]] for m in self._markets]
+            )
+            self.onFill += self.ledger.onFill
+        else:
+            self.ledger = None
 
-        # disabled flag - this flag can be flipped to True by a bot and
-        # will be reset to False after reset only
-        self.disabled = False
+        # Handlers that do not make the bot interested in their events
+        self._internal_handlers = [
+            self._callbackPlaceFillOrders,
+            self.registry.onOrderCreated,
+            self.registry.onFill,
+            self.registry.onOrderCancelled,
+        ]
+
+        # Settings for bitshares instance, applied to the shared
+        # instance while the bot handles an event (see :meth:`bundling`)
+        self.bundle = bool(self.bot.get("bundle", False))
+
+    @property
+    def disabled(self):
+        """ Disabled flag - this flag can be flipped to True by a bot and
+            will be reset to False after reset only.
+
+            Changing the flag calls ``onDisabledChange`` which allows the
+            infrastructure to unsubscribe from markets and accounts that
+            are no longer in use.
+        """
+        return self._disabled
+
+    @disabled.setter
+    def disabled(self, value):
+        value = bool(value)
+        if value != self._disabled:
+            self._disabled = value
+            self.onDisabledChange(value)
+
+    def head_block(self):
+        """ Return the number of the latest block
+
+            This is the block the infrastructure has handled last, which
+            all bots share and which is known without asking the node.
+            Only if there is none yet, the node is asked for its head
+            block.
+        """
+        num = self._head() if self._head else None
+        if num:
+            return num
+        return self.bitshares.rpc.get_dynamic_global_properties()["head_block_number"]
 
     @property
     def orders(self):
         """ Return the bot's open accounts in the current market
         """
-        self.account.refresh()
-        return [o for o in self.account.openorders if self.bot["market"] == o.market and self.account.openorders]
+        return self.orders_in(self.market)
+
+    def orders_in(self, *markets):
+        """ Return the bot's open orders in the given markets
+
+            With ``account_mode: light``, only the orders in the order
+            registry are fetched (see :meth:`chain_orders_in` for all
+            orders on the chain).
+
+            :param bitshares.market.Market markets: Markets
+        """
+        if self.paper:
+            return [
+                o for m in markets
+                for o in self.paper.open_orders(self.account, m)
+            ]
+        if isinstance(self.account, LightAccount):
+            return self._in_markets(self.account.orders(self.registry.ids), markets)
+        return self.chain_orders_in(*markets)
+
+    def chain_orders_in(self, *markets):
+        """ Return all open orders of the bot's account in the given
+            markets as found on the chain, whether registered or not
+
+            :param bitshares.market.Market markets: Markets
+        """
+        if isinstance(self.account, LightAccount):
+            orders = self.account.openorders
+        else:
+            self.account.refresh()
+            orders = [
+                open_order(o, bitshares_instance=self.bitshares)
+                for o in self.account["limit_orders"]
+            ]
+        return self._in_markets(orders, markets)
+
+    @staticmethod
+    def _in_markets(orders, markets):
+        names = [m.get_string() for m in markets]
+        return [
+            o for o in orders
+            if any(name == o.market for name in names)
+        ]
 
     @property
     def market(self):
@@ -125,10 +336,20 @@ class BaseStrategy(Storage, StateMachine, Events):
         """
         return self._market
 
+    @property
+    def markets(self):
+        """ Return all markets of the bot (see ``markets`` in the bot's
+            configuration)
+        """
+        return self._markets
+
     @property
     def account(self):
         """ Return the full account as :class:`bitshares.account.Account` object!
 
+            With ``account_mode: light`` in the bot's configuration, this
+            is a :class:`stakemachine.account.LightAccount` instead.
+
             Can be refreshed by using ``x.refresh()``
         """
         return self._account
@@ -136,40 +357,245 @@ class BaseStrategy(Storage, StateMachine, Events):
     def balance(self, asset):
         """ Return the balance of your bot's account for a specific asset
         """
+        if self.paper:
+            return self.paper.balance(self.account, asset)
         return self._account.balance(asset)
 
     @property
     def balances(self):
         """ Return the balances of your bot's account
         """
+        if self.paper:
+            return self.paper.balances(self.account)
         return self._account.balances
 
+    def _handlers(self, event):
+        """ Return the handlers registered for ``event``
+        """
+        handler = getattr(self, event)
+        if callable(handler) and not hasattr(handler, "targets"):
+            # Handler has been assigned directly, e.g.
+            # ``self.error_ontick = self.error``
+            return [handler]
+        return [
+            h for h in handler.targets
+            if h not in self._internal_handlers
+        ]
+
+    def get_interests(self):
+        """ Return the set of events this bot consumes
+        """
+        if "events" in self.bot:
+            interests = set(self.bot["events"])
+        elif self.interests is not None:
+            interests = set(self.interests)
+        else:
+            interests = set(
+                event for event in BLOCK_EVENTS | MARKET_EVENTS | ACCOUNT_EVENTS
+                if self._handlers(event)
+            )
+        # The order registry always follows the bot's orders
+        if not self.paper:
+            interests.update(REGISTRY_EVENTS)
+        # Fills are recorded in the ledger
+        if self.ledger:
+            interests.add("onFill")
+        return interests
+
+    def wants(self, events):
+        """ Does the bot consume any of ``events``?
+
+            :param set events: Names of events
+        """
+        return bool(self._interests & events)
+
+    def prepare(self):
+        """ Called by the infrastructure once the bot has been
+            constructed and all handlers are registered
+        """
+        self._interests = frozenset(self.get_interests())
+
+        # No need to distinguish market updates nobody listens to
+        if not self.wants({'onOrderMatched', 'onOrderPlaced', 'onUpdateCallOrder'}):
+            self.onMarketUpdate -= self._callbackPlaceFillOrders
+
+        self.compile_handlers()
+
+        # Start off with the orders that are on the chain
+        self.reconcile_orders()
+
+    def reconcile_orders(self):
+        """ Compare the order registry with the bot's orders on the
+            chain and correct it
+        """
+        if self.paper:
+            return
+        return self.registry.reconcile(self.chain_orders_in(*self.markets))
+
+    def flush(self):
+        """ Write the bot's pending data (storage, latest event and
+            ledger) to disk
+        """
+        if self.ledger:
+            self.ledger.flush()
+        self.store_meta()
+        self.backend.flush()
+
+    def store_meta(self):
+        """ Store the bot's state and latest event (in the category
+            :data:`stakemachine.storage.metaCategory` under the bot's
+            name) for ``stakemachine status``
+        """
+        self.meta[self.name] = {
+            "state": self.get_state(),
+            "last_event": (
+                {"event": self._last_event_name, "time": self.last_event}
+                if self.last_event else None
+            ),
+        }
+
+    def timeseries(self, name, columns=("value",)):
+        """ Return the time series ``name`` of this bot as
+            :class:`stakemachine.timeseries.TimeSeries`
+
+            :param str name: Name of the series
+            :param list columns: Value columns (only used when the
+                series is created)
+        """
+        if name not in self._timeseries:
+            self._timeseries[name] = TimeSeries(self.name, name, columns)
+        return self._timeseries[name]
+
     def _callbackPlaceFillOrders(self, d):
         """ This method distringuishes notifications caused by Matched orders
             from those caused by placed orders
         """
-        if isinstance(d, FilledOrder):
-            self.onOrderMatched(d)
-        elif isinstance(d, Order):
-            self.onOrderPlaced(d)
-        elif isinstance(d, UpdateCallOrder):
-            self.onUpdateCallOrder(d)
-        else:
-            pass
+        event = self._route_event(type(d))
+        if event:
+            getattr(self, event)(d)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Resolved types are cached in ``_routes``; a copy per class
+        # keeps one strategy's routes from leaking into another's
+        cls._routes = dict(cls._routes)
+
+    @classmethod
+    def _route_event(cls, klass):
+        """ Return the event market updates of type ``klass`` are
+            routed to
+        """
+        try:
+            return cls._routes[klass]
+        except KeyError:
+            # Subclasses of the known types are resolved once
+            event = None
+            for base in klass.__mro__:
+                if base in cls._routes:
+                    event = cls._routes[base]
+                    break
+            cls._routes[klass] = event
+            return event
+
+    def _route(self, d):
+        """ Compiled counterpart of :meth:`_callbackPlaceFillOrders`
+        """
+        event = self._route_event(type(d))
+        if event:
+            for handler in self._dispatch_table[event]:
+                handler(d)
+
+    def __setattr__(self, name, value):
+        # ``self.ontick += f`` ends with setting the attribute, so
+        # any change of the handlers invalidates the compiled table
+        if name in self.__events__:
+            self.__dict__["_dispatch_table"] = None
+        super().__setattr__(name, value)
+
+    def compile_handlers(self):
+        """ Resolve the handlers of all events into fixed tuples
+
+            This happens automatically on the first :meth:`dispatch`
+            after handlers have been added or removed.
+        """
+        table = dict()
+        for event in self.__events__:
+            handler = getattr(self, event)
+            if callable(handler) and not hasattr(handler, "targets"):
+                table[event] = (handler,)
+            else:
+                table[event] = tuple(
+                    self._route if h == self._callbackPlaceFillOrders else h
+                    for h in handler.targets
+                )
+        self.__dict__["_dispatch_table"] = table
+        return table
+
+    def dispatch(self, event, data):
+        """ Call all handlers of ``event`` with ``data``
+
+            This is what the infrastructure uses instead of calling the
+            event slots directly.
+        """
+        table = self._dispatch_table or self.compile_handlers()
+        self.last_event = time.time()
+        self._last_event_name = event
+        with self.bundling():
+            for handler in table[event]:
+                handler(data)
+
+    @contextmanager
+    def bundling(self):
+        """ Apply the bot's ``bundle`` setting to the BitShares
+            instance, which all bots share, and restore it afterwards
+        """
+        previous = self.bitshares.bundle
+        self.bitshares.bundle = self.bundle
+        try:
+            yield
+        finally:
+            self.bitshares.bundle = previous
+
+    def set_state(self, state):
+        """ Change the state of the state machine and store it
+
+            :param str state: Name of the new state
+        """
+        StateMachine.set_state(self, state)
+        self.store_meta()
 
     def execute(self):
         """ Execute a bundle of operations
         """
+        if self.paper:
+            return self.paper.execute()
         self.bitshares.blocking = "head"
         r = self.bitshares.txbuffer.broadcast()
         self.bitshares.blocking = False
+        self.registry.record(r)
         return r
 
     def cancelall(self):
         """ Cancel all orders of this bot
+
+            The orders are taken from the order registry, so no account
+            data needs to be fetched. If the registry is empty, the
+            bot's open orders on the chain are cancelled.
         """
-        if self.orders:
-            return self.bitshares.cancel(
-                [o["id"] for o in self.orders],
-                account=self.account
-            )
+        if self.paper:
+            ids = [o["id"] for o in self.orders_in(*self.markets)]
+        else:
+            ids = self.registry.ids or [
+                o["id"] for o in self.chain_orders_in(*self.markets)]
+        if ids:
+            return self.cancel(ids)
+
+    def cancel(self, ids):
+        """ Cancel orders of this bot and forget them in the order
+            registry
+
+            :param list ids: Order ids
+        """
+        tx = (self.paper or self.bitshares).cancel(ids, account=self.account)
+        self.registry.record(tx)
+        return tx
@@ -0,0 +1,59 @@
+import time
+import tempfile
+import os
+from .storage import Storage, SQLiteBackend, MemoryBackend, DBMBackend
+
+
+def walls_pattern(storage, rounds=1000, update_every=10):
+    """ Replay the storage access pattern of
+        :class:`stakemachine.strategies.walls.Walls`
+
+        Every round corresponds to a call of ``Walls.test()`` which
+        reads the stored feed price and the insufficient funds flags.
+        Every ``update_every`` rounds the orders are replaced which
+        writes those values.
+
+        The value cache of :class:`stakemachine.storage.Storage` is
+        cleared every round, so that the reads hit the backend.
+
+        :returns: Seconds per round
+    """
+    start = time.time()
+    for i in range(rounds):
+        storage.clear_cache()
+        storage["insufficient_buy"]
+        storage["insufficient_sell"]
+        storage["feed_price"]
+        if not i % update_every:
+            storage["feed_price"] = 0.3 + i * 1e-6
+            storage["insufficient_buy"] = False
+            storage["insufficient_sell"] = bool(i % 2)
+    storage.backend.flush()
+    return (time.time() - start) / rounds
+
+
+def benchmark_storage(rounds=1000, update_every=10):
+    """ Compare the storage backends on the ``Walls`` access pattern
+
+        Persistent backends are benchmarked on temporary files to not
+        touch the user's data.
+
+        :returns: list of ``(backend, seconds per round)``
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        candidates = [
+            ("memory", MemoryBackend()),
+            ("dbm", DBMBackend(os.path.join(tmp, "benchmark.dbm"))),
+            ("sqlite", SQLiteBackend(os.path.join(tmp, "benchmark.sqlite"))),
+        ]
+        for name, backend in candidates:
+            storage = Storage("__benchmark__", backend=backend)
+            results.append((name, walls_pattern(storage, rounds, update_every)))
+            backend.close()
+    return results
+
+
+if __name__ == "__main__":
+    for name, t in benchmark_storage():
+        print("%-8s %10.1f us/round" % (name, t * 1e6))
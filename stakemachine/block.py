@@ -0,0 +1,90 @@
+import threading
+from bitshares.utils import parse_time
+from bitshares.instance import shared_bitshares_instance
+
+
+class BlockContext(str):
+    """ Read-only context of a block that is shared by all bots
+
+        Instances are passed to ``ontick``. They are strings holding
+        the block id (as it used to be), but additionally give access
+        to details of the block:
+
+        * ``num``: the block number (decoded from the id, no API call)
+        * ``time``: the block's timestamp as ``datetime``
+        * ``witness``: the id of the witness that produced the block
+        * ``operations``: operations of the block that concern the
+          subscribed markets and accounts (same format as entries of
+          the account history: ``op``, ``block_num``, ``trx_in_block``,
+          ``op_in_trx``)
+
+        All fields but ``num`` require the block to be fetched. This
+        happens at most once per block and only if a bot accesses them.
+
+        :param str block_id: The id of the block
+        :param fn operation_filter: Callable ``(op_id, op) -> bool`` that
+            selects the operations to expose
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares instance
+    """
+    def __new__(
+        cls,
+        block_id,
+        operation_filter=None,
+        bitshares_instance=None
+    ):
+        self = super().__new__(cls, block_id)
+        object.__setattr__(self, "_bitshares", bitshares_instance or shared_bitshares_instance())
+        object.__setattr__(self, "_filter", operation_filter)
+        object.__setattr__(self, "_lock", threading.RLock())
+        object.__setattr__(self, "_block", None)
+        object.__setattr__(self, "_operations", None)
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BlockContext is read-only")
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+    @property
+    def id(self):
+        return str(self)
+
+    @property
+    def num(self):
+        return int(self[:8], 16)
+
+    @property
+    def block(self):
+        """ The full block as returned by the API
+        """
+        with self._lock:
+            if self._block is None:
+                object.__setattr__(self, "_block", self._bitshares.rpc.get_block(self.num))
+        return self._block
+
+    @property
+    def time(self):
+        return parse_time(self.block["timestamp"])
+
+    @property
+    def witness(self):
+        return self.block["witness"]
+
+    @property
+    def operations(self):
+        with self._lock:
+            if self._operations is None:
+                operations = []
+                for trx_in_block, tx in enumerate(self.block["transactions"]):
+                    for op_in_trx, (op_id, op) in enumerate(tx["operations"]):
+                        if self._filter and not self._filter(op_id, op):
+                            continue
+                        operations.append({
+                            "op": [op_id, op],
+                            "block_num": self.num,
+                            "trx_in_block": trx_in_block,
+                            "op_in_trx": op_in_trx,
+                        })
+                object.__setattr__(self, "_operations", tuple(operations))
+        return self._operations
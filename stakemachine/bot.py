@@ -3,9 +3,21 @@ import importlib
 import time
 import logging
 from bitshares.notify import Notify
+from bitshares.price import FilledOrder
 from bitshares.instance import shared_bitshares_instance
+from .subscriptions import SubscriptionManager
+from .backfill import Backfill
+from .block import BlockContext
+from .operations import decode as decode_operation, events as operation_events
+from .basestrategy import BLOCK_EVENTS, MARKET_EVENTS, ACCOUNT_EVENTS
+from .memory import MemoryWatchdog
+from .pool import NodePool
+from .coalescer import Coalescer
+from .scheduler import Scheduler
 log = logging.getLogger(__name__)
 
+OPERATION_EVENTS = frozenset(operation_events.values())
+
 
 class BotInfrastructure():
 
@@ -15,100 +27,412 @@ class BotInfrastructure():
         self,
         config,
         bitshares_instance=None,
+        paper=None,
     ):
         # BitShares instance
         self.bitshares = bitshares_instance or shared_bitshares_instance()
 
+        # Merge the read calls of all bots per notification, see
+        # :class:`stakemachine.coalescer.Coalescer`
+        if not isinstance(self.bitshares.rpc, Coalescer):
+            self.bitshares.rpc = Coalescer(self.bitshares.rpc)
+        self.coalescer = self.bitshares.rpc
+
         self.config = config
 
-        # Load all accounts and markets in use to subscribe to them
-        accounts = set()
-        markets = set()
+        # Paper trading engine, see :class:`stakemachine.paper.PaperEngine`
+        self.paper = paper
+
+        # Number of the latest block handled, shared with the bots (see
+        # :meth:`head_block`)
+        self._last_block = 0
+
         for botname, bot in config["bots"].items():
             if "account" not in bot:
                 raise ValueError("Bot %s has no account" % botname)
-            if "market" not in bot:
+            if "market" not in bot and not bot.get("markets"):
                 raise ValueError("Bot %s has no market" % botname)
 
-            accounts.add(bot["account"])
-            markets.add(bot["market"])
+        # Initialize bots:
+        for botname in config["bots"]:
+            self.init_bot(botname)
+
+        # Only subscribe to the feeds some bot is interested in
+        self.update_block_bots()
+
+        # Track memory, see :class:`stakemachine.memory.MemoryWatchdog`
+        memory = config.get("memory")
+        if memory:
+            self.memory = MemoryWatchdog(
+                self,
+                **(memory if isinstance(memory, dict) else {})
+            )
+        else:
+            self.memory = None
+
+        # Handle fills before routine work, see
+        # :class:`stakemachine.scheduler.Scheduler`
+        scheduler = config.get("scheduler")
+        if scheduler:
+            self.scheduler = Scheduler(
+                **(scheduler if isinstance(scheduler, dict) else {})
+            )
+        else:
+            self.scheduler = None
+
+        # Replay what we miss while the websocket is disconnected
+        backfill = config.get("backfill", True)
+        if backfill is False:
+            self.backfill = None
+        else:
+            self.backfill = Backfill(
+                self,
+                bitshares_instance=self.bitshares,
+                **(backfill if isinstance(backfill, dict) else {})
+            )
+
+        # Number of operations per account as of the last account update
+        self._total_ops = dict()
 
         # Create notification instance
         # Technically, this will multiplex markets and accounts and
-        # we need to demultiplex the events after we have received them
+        # we need to demultiplex the events after we have received them.
+        # The markets and accounts are set by the subscription manager
         self.notify = Notify(
-            markets=list(markets),
-            accounts=list(accounts),
             on_market=self.on_market,
             on_account=self.on_account,
-            on_block=self.on_block,
+            on_block=self.on_block if self.needs_blocks() else None,
             bitshares_instance=self.bitshares
         )
 
-        # Initialize bots:
-        for botname, bot in config["bots"].items():
-            klass = getattr(
-                importlib.import_module(bot["module"]),
-                bot["bot"]
-            )
-            self.bots[botname] = klass(
-                config=config,
-                name=botname,
-                bitshares_instance=self.bitshares
-            )
+        # Only subscribe to markets and accounts of enabled bots
+        self.subscriptions = SubscriptionManager(
+            self.notify,
+            self.bots,
+            config,
+            # Paper orders are filled from the market notifications
+            all_markets=bool(paper),
+            bitshares_instance=self.bitshares
+        )
+        self.subscriptions.update()
+        self.seed_operations()
+
+        # Move the subscription away from nodes that fail or fall behind
+        if isinstance(self.coalescer.rpc, NodePool):
+            self.coalescer.rpc.on_unhealthy += self.on_unhealthy_node
+
+    def on_unhealthy_node(self, url):
+        """ Reconnect the websocket if its node has become unhealthy
+
+            The websocket reconnects to the healthiest node of the
+            :class:`stakemachine.pool.NodePool`, the backfill replays
+            the blocks in between.
+
+            This is called from the thread that noticed the failure, so
+            the socket is not closed here: the notify thread stops its
+            loop, closes the socket and reconnects itself.
+        """
+        websocket = getattr(self.notify, "websocket", None)
+        if not websocket or websocket.url != url or not websocket.ws:
+            return
+        if self.bitshares.rpc.url == url:
+            # No better node available
+            return
+        log.warning("Moving the subscription away from %s" % url)
+        websocket.ws.keep_running = False
+
+    def init_bot(self, botname):
+        """ Instantiate the bot ``botname`` from the configuration
+        """
+        bot = self.config["bots"][botname]
+        klass = getattr(
+            importlib.import_module(bot["module"]),
+            bot["bot"]
+        )
+        kwargs = dict(paper=self.paper) if self.paper else dict()
+        self.bots[botname] = klass(
+            config=self.config,
+            name=botname,
+            bitshares_instance=self.bitshares,
+            head=self.head_block,
+            **kwargs
+        )
+        self.bots[botname].prepare()
+        self.bots[botname].onDisabledChange += self.on_disabled_change
+        return self.bots[botname]
+
+    def head_block(self):
+        """ Return the number of the latest block handled (``0`` if
+            none yet)
+        """
+        return self._last_block
+
+    def update_block_bots(self):
+        self.block_bots = tuple(
+            botname for botname in self.config["bots"]
+            if self.bots[botname].wants(BLOCK_EVENTS)
+        )
+
+    def needs_blocks(self):
+        """ Do we need to subscribe to new blocks?
+
+            Besides bots that consume ``ontick``, the memory watchdog,
+            the regular comparison of the order registries and the
+            backfill (which detects gaps in the block numbers) need
+            blocks. The backfill only if there are market or account
+            events to replay.
+        """
+        return bool(
+            self.block_bots or
+            self.memory or
+            any(bot.reconcile_blocks for bot in self.bots.values()) or
+            (self.backfill and (self.paper or any(
+                bot.wants(MARKET_EVENTS | ACCOUNT_EVENTS)
+                for bot in self.bots.values()
+            )))
+        )
+
+    def restart_bot(self, botname):
+        """ Replace bot ``botname`` by a new instance
+
+            The bot's stored data is flushed first so that the new
+            instance continues where the old one stopped.
+        """
+        log.warning("Restarting bot %s" % botname)
+        old = self.bots[botname]
+        old.onDisabledChange -= self.on_disabled_change
+        old.flush()
+        self.init_bot(botname)
+        self.update_block_bots()
+        self.subscriptions.update(force=True)
+        self.seed_operations()
+
+    def on_disabled_change(self, disabled):
+        self.subscriptions.update()
+        self.seed_operations()
+
+    def seed_operations(self):
+        """ Remember the number of operations of newly subscribed
+            accounts, so that their first update only delivers the
+            operations that happened since
+        """
+        # The statistics object (``2.6.x``) shares the instance number
+        # of its account (``1.2.x``). ``account["statistics"]`` is not
+        # used: full accounts hold the whole object there and light
+        # accounts would load the full account for it.
+        statistics = dict()
+        for account_id in self.subscriptions.account_id_index:
+            if account_id not in self._total_ops:
+                statistics[account_id] = "2.6.%s" % account_id.split(".")[2]
+        if not statistics:
+            return
+        objects = self.bitshares.rpc.get_objects(list(statistics.values()))
+        for account_id, stats in zip(statistics, objects):
+            if stats:
+                self._total_ops.setdefault(account_id, int(stats["total_ops"]))
 
     # Events
+    def dispatch(self, botname, event, data, error=None):
+        """ Call ``event`` of bot ``botname`` with ``data`` and hand
+            exceptions to the bot's ``error_<event>`` handler
+
+            :param str botname: Name of the bot
+            :param str event: Name of the event, e.g. ``ontick``,
+                ``onMarketUpdate``, ``onAccount``
+            :param data: Payload of the event
+            :param str error: Name of the error handler (defaults to
+                ``error_<event>``)
+        """
+        bot = self.bots[botname]
+        try:
+            bot.dispatch(event, data)
+        except Exception as e:
+            with bot.bundling():
+                getattr(bot, error or "error_" + event)(e)
+            log.error(
+                "Error while processing {botname}.{event}(): {exception}\n{stack}".format(
+                    botname=botname,
+                    event=event,
+                    exception=str(e),
+                    stack=traceback.format_exc()
+                ))
+
+    def handle(self, cls, func, data):
+        """ Handle a notification, through the scheduler if there is one
+
+            :param str cls: Event class (see
+                :data:`stakemachine.scheduler.PRIORITIES`)
+        """
+        if self.scheduler:
+            self.scheduler.submit(cls, self._handle, func, data)
+        else:
+            self._handle(func, data)
+
+    def _handle(self, func, *args):
+        with self.coalescer.cycle():
+            func(*args)
+
     def on_block(self, data):
-        for botname, bot in self.config["bots"].items():
-            if self.bots[botname].disabled:
+        self.handle("block", self._on_block, data)
+
+    def _on_block(self, data):
+        # One shared, lazily loaded context for all bots
+        block = BlockContext(
+            data,
+            operation_filter=self.subscriptions.is_relevant,
+            bitshares_instance=self.bitshares
+        )
+        if self.backfill:
+            self.backfill.on_block(block)
+        if self.memory:
+            self.memory.on_block(block)
+        self.reconcile(block)
+        self._last_block = block.num
+        self.tick(block, list(self.block_bots), time.time())
+
+    def tick(self, block, botnames, since):
+        """ Dispatch ``ontick`` to the bots ``botnames``
+
+            With a scheduler, the remaining bots are deferred as soon as
+            more important events are waiting. Ticks are dropped if a
+            newer block has arrived in the meantime or if they exceed
+            the bot's ``deadline`` (seconds).
+        """
+        for i, botname in enumerate(botnames):
+            if self.scheduler:
+                if block.num < self._last_block:
+                    self.scheduler.drop("tick", len(botnames) - i)
+                    return
+                if self.scheduler.waiting("tick"):
+                    self.scheduler.submit(
+                        "tick", self._handle, self.tick, block, botnames[i:], since,
+                        since=since)
+                    return
+            bot = self.bots[botname]
+            if bot.disabled:
+                continue
+            if self.scheduler and self.scheduler.expired(since, bot.bot.get("deadline")):
+                self.scheduler.drop("tick")
+                continue
+            self.dispatch(botname, "ontick", block)
+
+    def reconcile(self, block):
+        """ Compare the order registries of the bots with the chain
+            every ``reconcile_blocks`` blocks
+
+            Bots are spread over the blocks so that not all of them
+            query the chain at once.
+        """
+        for i, (botname, bot) in enumerate(sorted(self.bots.items())):
+            if not bot.reconcile_blocks or bot.disabled:
+                continue
+            if (block.num + i) % bot.reconcile_blocks:
                 continue
             try:
-                self.bots[botname].ontick(data)
+                bot.reconcile_orders()
             except Exception as e:
-                self.bots[botname].error_ontick(e)
-                log.error(
-                    "Error while processing {botname}.tick(): {exception}\n{stack}".format(
-                        botname=botname,
-                        exception=str(e),
-                        stack=traceback.format_exc()
-                    ))
+                log.error("Error while reconciling the orders of {}: {}".format(
+                    botname, str(e)))
 
     def on_market(self, data):
+        # Only fills of the bots' own orders are urgent
+        fill = (
+            isinstance(data, FilledOrder) and
+            data.get("account_id") in self.subscriptions.account_ids
+        )
+        self.handle("fill" if fill else "market", self._on_market, data)
+
+    def _on_market(self, data):
         if data.get("deleted", False):  # no info available on deleted orders
             return
-        for botname, bot in self.config["bots"].items():
+        if self.paper:
+            self.paper.on_market(data)
+        for botname in self.subscriptions.market_bots(data):
             if self.bots[botname].disabled:
-                log.info("The bot %s has been disabled" % botname)
                 continue
-            if bot["market"] == data.market:
-                try:
-                    self.bots[botname].onMarketUpdate(data)
-                except Exception as e:
-                    self.bots[botname].error_onMarketUpdate(e)
-                    log.error(
-                        "Error while processing {botname}.onMarketUpdate(): {exception}\n{stack}".format(
-                            botname=botname,
-                            exception=str(e),
-                            stack=traceback.format_exc()
-                        ))
+            self.dispatch(botname, "onMarketUpdate", data)
 
     def on_account(self, accountupdate):
-        account = accountupdate.account
-        for botname, bot in self.config["bots"].items():
+        self.handle("account", self._on_account, accountupdate)
+
+    def _on_account(self, accountupdate):
+        botnames = self.subscriptions.account_id_bots(accountupdate["owner"])
+
+        # Decode the new operations only once and only if a bot
+        # subscribed to typed operation events
+        operations = []
+        if any(self.wants_operations(b) for b in botnames):
+            operations = [
+                operation for operation in (
+                    decode_operation(entry, bitshares_instance=self.bitshares)
+                    for entry in self.new_operations(accountupdate)
+                ) if operation
+            ]
+        else:
+            self.count_operations(accountupdate)
+
+        for botname in botnames:
             if self.bots[botname].disabled:
-                log.info("The bot %s has been disabled" % botname)
                 continue
-            if bot["account"] == account["name"]:
-                try:
-                    self.bots[botname].onAccount(accountupdate)
-                except Exception as e:
-                    self.bots[botname].error_onAccount(e)
-                    log.error(
-                        "Error while processing {botname}.onAccount(): {exception}\n{stack}".format(
-                            botname=botname,
-                            exception=str(e),
-                            stack=traceback.format_exc()
-                        ))
+            self.dispatch(botname, "onAccount", accountupdate)
+            for event, payload in operations:
+                self.dispatch(botname, event, payload, error="error_onAccount")
+
+    def wants_operations(self, botname):
+        """ Does the bot handle any of the typed operation events?
+        """
+        return self.bots[botname].wants(OPERATION_EVENTS)
+
+    def count_operations(self, accountupdate):
+        """ Update the number of operations of the account
+
+            :returns: Number of operations since the previous update
+        """
+        account_id = accountupdate["owner"]
+        total = int(accountupdate["total_ops"])
+        previous = self._total_ops.get(account_id)
+        self._total_ops[account_id] = max(total, previous or 0)
+        if previous is None:
+            # Not seeded, only the latest operation is known to be new
+            return min(total, 1)
+        return max(total - previous, 0)
+
+    def new_operations(self, accountupdate):
+        """ Return the account history entries that are new since the
+            previous update of the account (oldest first)
+        """
+        total = int(accountupdate["total_ops"])
+        n = self.count_operations(accountupdate)
+        return self.account_history(accountupdate["owner"], total - n + 1, total)
+
+    def account_history(self, account_id, first, last, limit=100):
+        """ Return the account history entries with the sequence numbers
+            ``first`` to ``last`` (the account's ``total_ops`` after the
+            operation, inclusive), oldest first
+        """
+        entries = []
+        while last >= first:
+            page = self.bitshares.rpc.get_relative_account_history(
+                account_id,
+                first,
+                min(limit, last - first + 1),
+                last,
+                api="history"
+            )
+            if not page:
+                break
+            entries.extend(page)
+            last -= len(page)
+        return list(reversed(entries))
 
     def run(self):
-        self.notify.listen()
+        if self.scheduler:
+            self.scheduler.start()
+        try:
+            self.notify.listen()
+        finally:
+            if self.scheduler:
+                self.scheduler.stop()
+                self.scheduler.log_stats()
+            for bot in self.bots.values():
+                bot.flush()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import time
 import yaml
 import logging
 import click
@@ -12,7 +13,17 @@ from .ui import (
     warning,
     alert,
 )
+from datetime import datetime, timezone
+from prettytable import PrettyTable
+from bitshares.asset import Asset
+from bitshares.market import Market
 from stakemachine.bot import BotInfrastructure
+from stakemachine import storage
+from stakemachine.benchmark import benchmark_storage
+from stakemachine.paper import PaperEngine
+from stakemachine import ledger
+from stakemachine.codec import Codec
+from stakemachine.registry import OrderRegistry
 log = logging.getLogger(__name__)
 
 logging.basicConfig(
@@ -39,17 +50,228 @@ def main(ctx, **kwargs):
         ctx.obj[k] = v
 
 
+def paper_mode(ctx, param, value):
+    """ Paper trading must neither sign nor broadcast anything
+    """
+    if value:
+        ctx.obj["unsigned"] = True
+        ctx.obj["nobroadcast"] = True
+    return value
+
+
 @main.command()
+@click.option(
+    "--paper",
+    is_flag=True,
+    callback=paper_mode,
+    help="Simulate orders with a local matching engine instead of broadcasting them")
 @click.pass_context
 @configfile
 @chain
 @unlock
 @verbose
-def run(ctx):
+def run(ctx, paper):
     """ Continuously run the bot
     """
-    bot = BotInfrastructure(ctx.config)
-    bot.run()
+    engine = PaperEngine(bitshares_instance=ctx.bitshares) if paper else None
+    bot = BotInfrastructure(ctx.config, paper=engine)
+    try:
+        bot.run()
+    finally:
+        if engine:
+            paper_report(engine)
+
+
+def paper_report(engine):
+    """ Print the results of a paper trading session
+    """
+    t = PrettyTable(["Account", "Market", "Fills", "Base", "Quote", "Price", "PnL (base)"])
+    t.align = "r"
+    for row in engine.report():
+        t.add_row([
+            row["account"],
+            row["market"],
+            row["fills"],
+            "%.8f" % row["base"],
+            "%.8f" % row["quote"],
+            "%.8f" % row["price"],
+            "%.8f" % row["pnl"],
+        ])
+    click.echo(t)
+    click.echo("Operations that would have been broadcast: %d in %d transactions (%s)" % (
+        sum(engine.operations.values()),
+        engine.transactions,
+        ", ".join("%s: %d" % (k, v) for k, v in sorted(engine.operations.items())) or "none"
+    ))
+
+
+@main.command()
+@click.argument("bots", nargs=-1)
+@click.pass_context
+@configfile
+@verbose
+def status(ctx, bots):
+    """ Show the stored state of the bots (read-only)
+    """
+    botnames = bots or sorted(ctx.config["bots"])
+    for botname in botnames:
+        if botname not in ctx.config["bots"]:
+            raise click.BadParameter("Unknown bot %s" % botname)
+    keys = [OrderRegistry.key] + list(botnames)
+    snapshots = {"sqlite": storage.snapshot(keys)}
+    codec = Codec(plain=True)
+    now = time.time()
+
+    t = PrettyTable([
+        "Bot", "Strategy", "Market", "Storage", "Keys", "Size",
+        "State", "Orders", "Last event"
+    ])
+    t.align = "l"
+    for botname in botnames:
+        bot = ctx.config["bots"][botname]
+        backend = bot.get("storage") or "sqlite"
+        if backend not in snapshots:
+            snapshots[backend] = (
+                storage.dbm_snapshot(keys) if backend == "dbm" else None)
+        snapshot = snapshots[backend]
+        markets = bot.get("markets") or [bot.get("market")]
+        row = [
+            botname,
+            bot.get("bot"),
+            markets[0] + (" (+%d)" % (len(markets) - 1) if len(markets) > 1 else ""),
+            backend,
+        ]
+        if snapshot is None:
+            # The memory storage is not persistent, a dbm database is
+            # locked while a bot has it open
+            t.add_row(row + ["locked" if backend == "dbm" else "n/a"] * 5)
+            continue
+        empty = {"keys": 0, "bytes": 0, "values": {}}
+        category = snapshot.get(botname, empty)
+        values = {k: codec.decode(v) for k, v in category["values"].items()}
+        meta = snapshot.get(storage.metaCategory, empty)["values"].get(botname)
+        meta = codec.decode(meta) if meta is not None else {}
+        last = meta.get("last_event")
+        t.add_row(row + [
+            category["keys"],
+            category["bytes"],
+            meta.get("state") or "-",
+            len(values.get(OrderRegistry.key) or {}),
+            "%s, %ds ago" % (last["event"], now - last["time"]) if last else "-",
+        ])
+    click.echo(t)
+
+
+@main.command()
+@click.argument("bots", nargs=-1)
+@click.option(
+    "--every",
+    type=int,
+    help="Show the values at the end of every interval of this many seconds")
+@click.option(
+    "--ticker",
+    is_flag=True,
+    help="Value the inventory at the latest price instead of the last fill")
+@click.pass_context
+@configfile
+@chain
+@verbose
+def pnl(ctx, bots, every, ticker):
+    """ Evaluate the fills recorded for the bots
+    """
+    for botname in bots or sorted(ctx.config["bots"]):
+        fills = ledger.load(botname)
+        if fills is None or not len(fills["block"]):
+            click.echo("%s: no fills recorded" % botname)
+            continue
+        markets = {}
+        for b, q in set(zip(fills["base"].astype(int), fills["quote"].astype(int))):
+            markets[(b, q)] = Market(
+                base=Asset("1.3.%d" % b, bitshares_instance=ctx.bitshares),
+                quote=Asset("1.3.%d" % q, bitshares_instance=ctx.bitshares),
+                bitshares_instance=ctx.bitshares
+            )
+        marks = None
+        if ticker:
+            marks = {k: float(m.ticker()["latest"]) for k, m in markets.items()}
+        rows, summary = ledger.analyse(fills, marks)
+        names = [
+            markets[(b, q)].get_string()
+            for b, q in zip(summary["base"], summary["quote"])
+        ]
+
+        click.echo(botname)
+        if every:
+            t = PrettyTable([
+                "Time", "Market", "Price", "Inventory", "Turnover",
+                "Fees", "Realised", "Unrealised"
+            ])
+            t.align = "r"
+            r = ledger.timeline(rows, every)
+            for i in range(len(r["time"])):
+                t.add_row([
+                    datetime.fromtimestamp(r["time"][i], timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                    names[r["market"][i]],
+                    "%.8f" % r["price"][i],
+                    "%.8f" % r["inventory"][i],
+                    "%.8f" % r["turnover"][i],
+                    "%.8f" % r["fees"][i],
+                    "%.8f" % r["realised"][i],
+                    "%.8f" % r["unrealised"][i],
+                ])
+            click.echo(t)
+
+        t = PrettyTable([
+            "Market", "Fills", "Turnover", "Fees", "Inventory", "Mark",
+            "Realised", "Unrealised", "Total"
+        ])
+        t.align = "r"
+        for i, name in enumerate(names):
+            t.add_row([name, summary["fills"][i]] + [
+                "%.8f" % summary[k][i]
+                for k in ("turnover", "fees", "inventory", "mark", "realised", "unrealised", "total")
+            ])
+        click.echo(t)
+
+
+@main.command()
+@click.argument("source", type=click.Choice(["sqlite", "dbm"]))
+@click.argument("target", type=click.Choice(["sqlite", "dbm"]))
+@click.option(
+    "--category",
+    multiple=True,
+    help="Only migrate these categories (bot names)")
+@click.pass_context
+@verbose
+def migrate(ctx, source, target, category):
+    """ Copy stored bot data from one storage backend to another and
+        move data of older versions into place (with identical source
+        and target, only the latter)
+    """
+    if source != target:
+        cnt = storage.migrate(
+            storage.get_backend(source),
+            storage.get_backend(target),
+            categories=category
+        )
+        click.echo("Migrated %d values from %s to %s" % (cnt, source, target))
+    cnt = storage.migrate_meta(storage.get_backend(target), categories=category)
+    click.echo("Moved the state of %d bots into %s" % (cnt, storage.metaCategory))
+
+
+@main.command()
+@click.option("--rounds", type=int, default=1000)
+@click.option("--update-every", type=int, default=10)
+@click.pass_context
+@verbose
+def benchmark(ctx, rounds, update_every):
+    """ Compare the storage backends on the Walls access pattern
+    """
+    t = PrettyTable(["Backend", "us/round", "rounds/s"])
+    t.align = "r"
+    for name, seconds in benchmark_storage(rounds, update_every):
+        t.add_row([name, "%.1f" % (seconds * 1e6), "%.0f" % (1 / seconds)])
+    click.echo(t)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+log = logging.getLogger(__name__)
+
+#: Calls that only read from the chain
+READ_PREFIXES = ("get_", "lookup_", "list_")
+
+#: Calls that take a list of keys as first argument and return one
+#: result per key. The value maps a result to its key for calls that
+#: omit unknown keys from the result (``None`` for positional results).
+BATCH_CALLS = {
+    "get_objects": None,
+    "get_assets": None,
+    "lookup_account_names": None,
+    "lookup_asset_symbols": None,
+    "get_full_accounts": lambda r: r[0],
+}
+
+#: Batch calls that are cheap enough to also fetch the keys of the
+#: previous cycle in advance (``get_full_accounts`` is not: it returns
+#: the orders, balances and history of every account)
+PREFETCH_CALLS = {
+    "get_objects",
+    "get_assets",
+    "lookup_account_names",
+    "lookup_asset_symbols",
+}
+
+
+class Coalescer():
+    """ Wraps the RPC connection of a BitShares instance and merges the
+        read calls of all bots within a dispatch cycle
+
+        Within a :meth:`cycle` (the handling of one notification by all
+        bots)
+
+        * identical read calls are sent once and the answer is handed to
+          every caller,
+        * calls of :attr:`BATCH_CALLS` are answered per key: keys already
+          fetched in the cycle are not asked for again, and the first
+          call of a cycle to one of the :attr:`PREFETCH_CALLS` also
+          fetches the keys that were asked for in the previous cycle
+          (the bots ask for much the same keys every block), so that
+          e.g. the assets of all bots are loaded with a single
+          ``get_objects``,
+        * any other call (e.g. a broadcast) empties the cache so that
+          later reads see its effects.
+
+        Calls from other threads and outside a cycle are passed through.
+
+        Answers are not copied: all callers of a cycle get the same
+        objects, which must be treated as read-only.
+
+        :param rpc: The RPC connection (``bitshares.rpc``)
+    """
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.stats = Counter()
+        self._depth = 0
+        self._owner = None
+        self._lock = threading.RLock()
+        self._results = dict()
+        self._items = defaultdict(dict)
+        self._requested = defaultdict(set)
+        self._previous = dict()
+
+    @contextmanager
+    def cycle(self):
+        """ Coalesce the read calls of the current thread until the
+            outermost cycle ends
+        """
+        with self._lock:
+            # Calls of other threads are not coalesced
+            other = self._depth and self._owner != threading.get_ident()
+            if not other:
+                self._depth += 1
+                self._owner = threading.get_ident()
+        if other:
+            yield
+            return
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if not self._depth:
+                    self._end()
+
+    def _end(self):
+        self._owner = None
+        self._results.clear()
+        self._items.clear()
+        self._previous = dict(self._requested)
+        self._requested.clear()
+        if self.stats["calls"]:
+            log.debug("Coalesced {calls} read calls into {sent}".format(**self.stats))
+        self.stats.clear()
+
+    def _active(self):
+        return self._depth and self._owner == threading.get_ident()
+
+    def invalidate(self):
+        """ Forget the answers of the current cycle
+        """
+        self._results.clear()
+        self._items.clear()
+
+    def call(self, name, *args, **kwargs):
+        """ Execute call ``name``, coalescing it with the calls of the
+            current cycle if possible
+        """
+        method = getattr(self.rpc, name)
+        if not self._active():
+            return method(*args, **kwargs)
+        if not name.startswith(READ_PREFIXES):
+            self.invalidate()
+            return method(*args, **kwargs)
+
+        self.stats["calls"] += 1
+        if name == "get_object" and len(args) == 1 and not kwargs:
+            return self._batch("get_objects", self.rpc.get_objects, ([args[0]],), {})[0]
+        if name in BATCH_CALLS and args and isinstance(args[0], list):
+            return self._batch(name, method, args, kwargs)
+
+        key = repr((name, args, sorted(kwargs.items())))
+        if key not in self._results:
+            self.stats["sent"] += 1
+            self._results[key] = method(*args, **kwargs)
+        return self._results[key]
+
+    def _batch(self, name, method, args, kwargs):
+        keys, rest = args[0], args[1:]
+        group = repr((name, rest, sorted(kwargs.items())))
+        items = self._items[group]
+        self._requested[group].update(keys)
+
+        missing = [k for k in dict.fromkeys(keys) if k not in items]
+        if missing:
+            expected = []
+            if name in PREFETCH_CALLS:
+                expected = [
+                    k for k in self._previous.get(group, set()) - set(missing)
+                    if k not in items
+                ]
+            self.stats["sent"] += 1
+            try:
+                fetched = missing + expected
+                results = method(fetched, *rest, **kwargs)
+            except Exception:
+                if not expected:
+                    raise
+                # Do not fail because of keys that were not asked for
+                fetched = missing
+                results = method(fetched, *rest, **kwargs)
+            key_of = BATCH_CALLS[name]
+            if key_of:
+                for k in fetched:
+                    items[k] = None
+                for r in results:
+                    items[key_of(r)] = r
+            else:
+                items.update(zip(fetched, results))
+
+        results = [items.get(k) for k in keys]
+        if BATCH_CALLS[name]:
+            results = [r for r in results if r is not None]
+        return results
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self.rpc, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return method
@@ -0,0 +1,157 @@
+import json
+import msgpack
+from decimal import Decimal
+from bitshares.amount import Amount
+from bitshares.price import Price, Order
+
+#: Binary values start with this prefix followed by the codec version.
+#: JSON documents never start with a NUL byte which allows to tell
+#: both formats apart.
+MAGIC = b"\x00"
+VERSION = 1
+
+# msgpack extension types
+EXT_AMOUNT = 1
+EXT_PRICE = 2
+EXT_ORDER = 3
+
+
+def _satoshis(amount):
+    """ Return the integer amount of an :class:`bitshares.amount.Amount`
+
+        The (float) amount is converted through its shortest decimal
+        representation, so that e.g. ``89174383.8809069`` with a
+        precision of 8 does not end up one satoshi off.
+    """
+    value = Decimal(str(amount["amount"])).scaleb(amount["asset"]["precision"])
+    return int(value.to_integral_value())
+
+
+def _pack(value):
+    return msgpack.packb(
+        value,
+        default=_default,
+        use_bin_type=True,
+        strict_types=True
+    )
+
+
+def _default(obj):
+    """ Encode types msgpack does not know about natively
+    """
+    # Order and Price are dictionaries, Amounts as well, so the order
+    # of these tests matters
+    if isinstance(obj, Order):
+        extra = {
+            k: v for k, v in obj.items()
+            if k not in ("base", "quote", "price")
+        }
+        return msgpack.ExtType(EXT_ORDER, _pack(
+            [obj["base"], obj["quote"], extra]))
+    elif isinstance(obj, Price):
+        return msgpack.ExtType(EXT_PRICE, _pack([obj["base"], obj["quote"]]))
+    elif isinstance(obj, Amount):
+        return msgpack.ExtType(EXT_AMOUNT, _pack(
+            [_satoshis(obj), obj["asset"]["id"]]))
+    elif isinstance(obj, dict):
+        return dict(obj)
+    elif isinstance(obj, (list, tuple, set)):
+        return list(obj)
+    elif isinstance(obj, str):
+        return str(obj)
+    elif isinstance(obj, bool):
+        return bool(obj)
+    elif isinstance(obj, int):
+        return int(obj)
+    elif isinstance(obj, float):
+        return float(obj)
+    raise TypeError("Cannot encode object of type %s" % type(obj).__name__)
+
+
+class Codec():
+    """ Compact binary encoding for values in
+        :class:`stakemachine.storage.Storage`
+
+        Values are encoded with msgpack. Instances of
+        :class:`bitshares.amount.Amount`, :class:`bitshares.price.Price`
+        and :class:`bitshares.price.Order` are stored losslessly using
+        their integer amounts and asset ids. Values written as JSON by
+        earlier versions of stakemachine can still be decoded.
+
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares
+            instance used to instantiate decoded amounts and prices
+        :param bool plain: Decode amounts, prices and orders into plain
+            dictionaries with integer amounts and asset ids (no
+            blockchain access needed)
+    """
+    def __init__(self, bitshares_instance=None, plain=False):
+        self.bitshares = bitshares_instance
+        self.plain = plain
+
+    def encode(self, value):
+        """ Encode a value into ``bytes``
+        """
+        return MAGIC + bytes([VERSION]) + _pack(value)
+
+    def decode(self, data):
+        """ Decode a value previously encoded with :meth:`encode` or
+            stored as JSON
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+            if data[:1] != MAGIC:
+                return json.loads(data.decode("utf-8"))
+            version = data[1]
+            if version != VERSION:
+                raise ValueError("Unknown storage codec version %d" % version)
+            return self._unpack(data[2:])
+        return json.loads(data)
+
+    def _unpack(self, data):
+        return msgpack.unpackb(
+            data,
+            ext_hook=self._ext_hook,
+            raw=False,
+            strict_map_key=False
+        )
+
+    def _ext_hook(self, code, data):
+        if self.plain:
+            return self._plain(code, data)
+        if code == EXT_AMOUNT:
+            amount, asset_id = self._unpack(data)
+            return Amount(
+                {"amount": amount, "asset_id": asset_id},
+                bitshares_instance=self.bitshares
+            )
+        elif code == EXT_PRICE:
+            base, quote = self._unpack(data)
+            return Price(
+                base=base,
+                quote=quote,
+                bitshares_instance=self.bitshares
+            )
+        elif code == EXT_ORDER:
+            base, quote, extra = self._unpack(data)
+            if base is None or quote is None:
+                # Deleted orders carry no amounts
+                order = Order.__new__(Order)
+                dict.update(order, extra, base=None, quote=None, price=None)
+                return order
+            order = Order(quote, base, bitshares_instance=self.bitshares)
+            for k, v in extra.items():
+                order[k] = v
+            return order
+        return msgpack.ExtType(code, data)
+
+    def _plain(self, code, data):
+        if code == EXT_AMOUNT:
+            amount, asset_id = self._unpack(data)
+            return {"amount": amount, "asset_id": asset_id}
+        elif code == EXT_PRICE:
+            base, quote = self._unpack(data)
+            return {"base": base, "quote": quote}
+        elif code == EXT_ORDER:
+            base, quote, extra = self._unpack(data)
+            return dict(extra, base=base, quote=quote)
+        return msgpack.ExtType(code, data)
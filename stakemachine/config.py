@@ -0,0 +1,241 @@
+import re
+import copy
+import hashlib
+import logging
+import importlib
+import itertools
+import yaml
+from .exceptions import InvalidConfigException
+log = logging.getLogger(__name__)
+
+#: Version of the expansion and validation rules, part of the cache key
+VERSION = 4
+
+#: Default name of bots created from templates
+DEFAULT_NAME = "{template}-{quote}-{base}-{account}"
+
+MARKET = re.compile(r"^[A-Z0-9.]+[:/][A-Z0-9.]+$")
+
+_cache = dict()
+
+
+def _merge(a, b):
+    """ Deep merge ``b`` into a copy of ``a``
+    """
+    result = copy.deepcopy(a)
+    for k, v in b.items():
+        if isinstance(v, dict) and isinstance(result.get(k), dict):
+            result[k] = _merge(result[k], v)
+        else:
+            result[k] = copy.deepcopy(v)
+    return result
+
+
+def expand(config, errors=None):
+    """ Expand the ``templates`` of a configuration into bots
+
+        Every template creates one bot per combination of its
+        ``markets`` and ``accounts``:
+
+        .. code-block:: yaml
+
+            templates:
+                walls:
+                    markets: [HERO:BTS, USD:BTS]
+                    accounts: [maker-1, maker-2]
+                    # optional, defaults to {template}-{quote}-{base}-{account}
+                    name: "walls-{quote}-{account}"
+                    # settings of all bots
+                    defaults:
+                        module: stakemachine.strategies.walls
+                        bot: Walls
+                    # per market, account or bot name
+                    overrides:
+                        HERO:BTS:
+                            threshold: 5
+
+        Overrides are applied in the order market, account, bot name.
+
+        :param dict config: The configuration as loaded from YAML
+        :param list errors: Collect errors in this list instead of
+            raising
+        :returns: A new configuration without ``templates``
+        :raises InvalidConfigException: if a template is malformed or
+            creates a bot that exists already
+    """
+    raise_errors = errors is None
+    errors = [] if errors is None else errors
+    if not isinstance(config, dict):
+        raise InvalidConfigException("Invalid configuration: must be a mapping")
+    config = copy.deepcopy(config)
+    templates = config.pop("templates", None) or {}
+    bots = config.setdefault("bots", {}) or {}
+    config["bots"] = bots
+    if not isinstance(templates, dict):
+        errors.append("templates: must be a mapping")
+        templates = {}
+
+    for template, t in templates.items():
+        path = "templates.%s" % template
+        if not isinstance(t, dict):
+            errors.append("%s: must be a mapping" % path)
+            continue
+        unknown = set(t) - {"markets", "accounts", "name", "defaults", "overrides"}
+        if unknown:
+            errors.append("%s: unknown keys %s" % (path, ", ".join(sorted(unknown))))
+        markets = t.get("markets") or []
+        accounts = t.get("accounts") or []
+        if not isinstance(markets, list) or not markets:
+            errors.append("%s.markets: must be a non-empty list" % path)
+            continue
+        if not isinstance(accounts, list) or not accounts:
+            errors.append("%s.accounts: must be a non-empty list" % path)
+            continue
+        defaults = t.get("defaults") or {}
+        overrides = t.get("overrides") or {}
+        for market, account in itertools.product(markets, accounts):
+            if not isinstance(market, str) or not MARKET.match(market):
+                errors.append("%s.markets: invalid market %r" % (path, market))
+                continue
+            quote, base = re.split("[:/]", market)
+            name = t.get("name", DEFAULT_NAME).format(
+                template=template,
+                market=market,
+                quote=quote,
+                base=base,
+                account=account
+            )
+            if name in bots:
+                errors.append("%s: bot %s exists already" % (path, name))
+                continue
+            bot = _merge(defaults, {"market": market, "account": account})
+            for key in (market, account, name):
+                bot = _merge(bot, overrides.get(key) or {})
+            bots[name] = bot
+
+    if errors and raise_errors:
+        raise InvalidConfigException(
+            "Invalid configuration:\n  " + "\n  ".join(errors))
+    return config
+
+
+def _check_type(errors, path, value, types, name):
+    if not isinstance(value, types):
+        errors.append("%s: must be %s, not %r" % (path, name, value))
+        return False
+    return True
+
+
+def validate(config, check_modules=True, errors=None):
+    """ Validate an (expanded) configuration
+
+        All errors are collected and reported together.
+
+        :param dict config: The configuration
+        :param bool check_modules: Also make sure the strategies can be
+            imported
+        :param list errors: Errors found earlier (e.g. by :func:`expand`)
+        :raises InvalidConfigException: if the configuration is invalid
+    """
+    from .storage import backends
+    from .basestrategy import BaseStrategy
+
+    errors = [] if errors is None else errors
+    if not _check_type(errors, "config", config, dict, "a mapping"):
+        raise InvalidConfigException(errors[0])
+    if "node" not in config:
+        errors.append("node: missing")
+    else:
+        _check_type(errors, "node", config["node"], (str, list), "a url or a list of urls")
+    for key in ("backfill", "memory", "scheduler"):
+        if key in config:
+            _check_type(errors, key, config[key], (bool, dict), "true, false or a mapping")
+    if "pool" in config:
+        if _check_type(errors, "pool", config["pool"], dict, "a mapping"):
+            unknown = set(config["pool"]) - {"max_lag", "interval", "backoff", "num_retries"}
+            if unknown:
+                errors.append("pool: unknown keys %s" % ", ".join(sorted(unknown)))
+
+    bots = config.get("bots")
+    if not bots or not isinstance(bots, dict):
+        errors.append("bots: must be a non-empty mapping")
+        bots = {}
+
+    for name, bot in bots.items():
+        path = "bots.%s" % name
+        if not _check_type(errors, path, bot, dict, "a mapping"):
+            continue
+        for key in ("module", "bot", "account"):
+            if key not in bot:
+                errors.append("%s.%s: missing" % (path, key))
+            else:
+                _check_type(errors, "%s.%s" % (path, key), bot[key], str, "a string")
+
+        markets = bot.get("markets") or ([bot["market"]] if "market" in bot else [])
+        if not markets:
+            errors.append("%s.market: missing" % path)
+        for market in markets:
+            if not isinstance(market, str) or not MARKET.match(market):
+                errors.append("%s.market: invalid market %r" % (path, market))
+
+        if (bot.get("storage") or "sqlite") not in backends:
+            errors.append("%s.storage: must be one of %s" % (
+                path, ", ".join(sorted(backends))))
+        if (bot.get("account_mode") or "full") not in ("full", "light"):
+            errors.append("%s.account_mode: must be full or light" % path)
+        for key in ("bundle", "ledger"):
+            if key in bot:
+                _check_type(errors, "%s.%s" % (path, key), bot[key], bool, "true or false")
+        if "reconcile_blocks" in bot:
+            if _check_type(errors, "%s.reconcile_blocks" % path, bot["reconcile_blocks"], int, "a number"):
+                if bot["reconcile_blocks"] < 0:
+                    errors.append("%s.reconcile_blocks: must not be negative" % path)
+        if "deadline" in bot:
+            if _check_type(errors, "%s.deadline" % path, bot["deadline"], (int, float), "a number"):
+                if bot["deadline"] < 0:
+                    errors.append("%s.deadline: must not be negative" % path)
+        if "events" in bot:
+            if _check_type(errors, "%s.events" % path, bot["events"], list, "a list"):
+                unknown = set(bot["events"]) - set(BaseStrategy.__events__)
+                if unknown:
+                    errors.append("%s.events: unknown events %s" % (
+                        path, ", ".join(sorted(unknown))))
+
+        if check_modules and isinstance(bot.get("module"), str) and isinstance(bot.get("bot"), str):
+            try:
+                module = importlib.import_module(bot["module"])
+            except ImportError as e:
+                errors.append("%s.module: cannot import %s (%s)" % (path, bot["module"], e))
+            else:
+                if not hasattr(module, bot["bot"]):
+                    errors.append("%s.bot: %s has no strategy %s" % (
+                        path, bot["module"], bot["bot"]))
+
+    if errors:
+        raise InvalidConfigException(
+            "Invalid configuration:\n  " + "\n  ".join(errors))
+    return config
+
+
+def load_config(filename):
+    """ Load, expand and validate a configuration file
+
+        The result is cached in memory keyed on the hash of the file's
+        content, so loading an unchanged file again (e.g. to restart a
+        bot) neither parses nor validates it. Nothing is cached on
+        disk: validation runs once per start and is cheap.
+
+        :param str filename: Path of the YAML file
+        :raises InvalidConfigException: if the configuration is invalid
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data + bytes([VERSION])).hexdigest()
+    if digest not in _cache:
+        try:
+            config = yaml.safe_load(data)
+        except yaml.YAMLError as e:
+            raise InvalidConfigException("Invalid configuration: %s" % e)
+        errors = []
+        _cache[digest] = validate(expand(config, errors), errors=errors)
+    return copy.deepcopy(_cache[digest])
@@ -1,2 +1,10 @@
 class MissingSettingsException(Exception):
     pass
+
+
+class InsufficientFundsException(Exception):
+    pass
+
+
+class InvalidConfigException(Exception):
+    pass
@@ -0,0 +1,248 @@
+import os
+import time
+import logging
+import numpy as np
+from datetime import datetime, timezone
+from .timeseries import TimeSeries, timeseriesDirectory
+from .storage import data_dir
+log = logging.getLogger(__name__)
+
+
+def _instance(object_id):
+    """ Return the instance number of an object id (``1.3.121`` → 121)
+    """
+    return int(object_id.split(".")[-1])
+
+
+class Ledger():
+    """ Fills of a bot's orders
+
+        Every fill in one of the bot's markets is stored as a sample of
+        the bot's :class:`stakemachine.timeseries.TimeSeries` ``fills``
+        with the columns
+
+        * ``base``, ``quote``: instance numbers of the market's assets
+        * ``side``: ``1`` if ``quote`` has been bought, ``-1`` if sold
+        * ``amount``: amount of ``quote`` bought or sold
+        * ``price``: ``base`` per ``quote``
+        * ``fee``: market fee, converted into ``base``
+        * ``operation``: instance number of the operation (``1.11.x``)
+
+        Samples carry the block number and time of the block that
+        contains the fill. They are written to disk every
+        ``flush_interval`` seconds and by :meth:`flush`.
+
+        See :func:`analyse` for the evaluation.
+
+        :param stakemachine.basestrategy.BaseStrategy strategy: The bot
+        :param list markets: Asset id pairs (``base``, ``quote``) of the
+            bot's markets
+        :param float flush_interval: Seconds between two writes to disk
+    """
+    name = "fills"
+    columns = ["base", "quote", "side", "amount", "price", "fee", "operation"]
+
+    def __init__(self, strategy, markets, flush_interval=60):
+        self.strategy = strategy
+        self.markets = {frozenset(m): tuple(m) for m in markets}
+        self.flush_interval = flush_interval
+        self._flushed = time.time()
+
+    @property
+    def series(self):
+        return self.strategy.timeseries(self.name, self.columns)
+
+    def flush(self):
+        """ Write the recorded fills to disk
+        """
+        self._flushed = time.time()
+        if self.name in self.strategy._timeseries:
+            self.series.flush()
+
+    def block_time(self, block_num):
+        """ Return the time (unix timestamp) of block ``block_num``, or
+            now if the block is unknown
+        """
+        if block_num:
+            try:
+                header = self.strategy.bitshares.rpc.get_block_header(block_num)
+                return datetime.strptime(
+                    header["timestamp"], "%Y-%m-%dT%H:%M:%S"
+                ).replace(tzinfo=timezone.utc).timestamp()
+            except Exception as e:
+                log.warning("Could not fetch the time of block %d: %s" % (block_num, e))
+        return time.time()
+
+    def onFill(self, fill):
+        """ Record a fill (``onFill`` payload, see
+            :func:`stakemachine.operations.decode`)
+
+            :returns: ``True`` if the fill has been recorded
+        """
+        # The account receives ``base`` and pays ``quote`` of the fill
+        receives = fill["base"]["asset"]["id"]
+        pays = fill["quote"]["asset"]["id"]
+        market = self.markets.get(frozenset([receives, pays]))
+        if not market:
+            return False
+        base, quote = market
+        if receives == quote:
+            side, amount, value = 1, float(fill["base"]), float(fill["quote"])
+        else:
+            side, amount, value = -1, float(fill["quote"]), float(fill["base"])
+        if amount <= 0:
+            return False
+        price = value / amount
+
+        fee = 0.0
+        if fill.get("fee"):
+            if fill["fee"]["asset"]["id"] == base:
+                fee = float(fill["fee"])
+            elif fill["fee"]["asset"]["id"] == quote:
+                fee = float(fill["fee"]) * price
+
+        series = self.series
+        last = series.last(100)
+        operation = np.nan
+        if fill.get("operation_id"):
+            operation = _instance(fill["operation_id"])
+            if operation in last["operation"]:
+                # Replayed by the backfill
+                return False
+
+        # The series needs non-decreasing block numbers and times
+        block = fill.get("block_num") or 0
+        when = self.block_time(block)
+        if len(last["block"]):
+            block = max(block, int(last["block"][-1]))
+            when = max(when, float(last["time"][-1]))
+
+        series.append(
+            block,
+            when,
+            base=_instance(base),
+            quote=_instance(quote),
+            side=side,
+            amount=amount,
+            price=price,
+            fee=fee,
+            operation=operation,
+        )
+        if time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+        return True
+
+
+def load(botname):
+    """ Return all fills of bot ``botname`` as dictionary of column
+        arrays or ``None`` if the bot has no ledger
+    """
+    path = os.path.join(data_dir, timeseriesDirectory, botname, Ledger.name)
+    if not os.path.isfile(os.path.join(path, "meta.json")):
+        return None
+    return TimeSeries(botname, Ledger.name, Ledger.columns).range()
+
+
+def _group_cumsum(values, starts, counts):
+    """ Cumulative sums that restart at every group of sorted rows
+    """
+    total = np.cumsum(values)
+    before = (total - values)[starts]
+    return total - np.repeat(before, counts)
+
+
+def analyse(fills, marks=None):
+    """ Evaluate the fills of a ledger
+
+        Everything is computed with vectorised cumulative sums, so
+        millions of fills take well below a second:
+
+        * ``inventory``: ``quote`` bought minus sold
+        * ``turnover``: traded volume in ``base``
+        * ``fees``: fees paid in ``base``
+        * ``realised``: PnL of the matched volume, i.e. ``min(bought,
+          sold)`` times the difference of the average sell and buy
+          prices, less fees
+        * ``unrealised``: value of the remaining inventory at the mark
+          price relative to its average cost, so that ``realised +
+          unrealised`` equals cash flow plus inventory at the mark
+
+        :param dict fills: Column arrays as returned by :func:`load`
+        :param dict marks: Mark prices by ``(base, quote)`` instance
+            numbers (defaults to the price of the latest fill)
+        :returns: ``(rows, summary)``: ``rows`` holds the running values
+            for every fill grouped by market and ordered by block,
+            ``summary`` the final values per market
+        :raises ValueError: if there are no fills
+    """
+    if not len(fills["block"]):
+        raise ValueError("No fills")
+    pairs = fills["base"].astype(np.int64) << 32 | fills["quote"].astype(np.int64)
+    keys, groups = np.unique(pairs, return_inverse=True)
+    keys = np.stack([keys >> 32, keys & 0xffffffff], axis=1)
+    groups = groups.reshape(-1)
+    order = np.argsort(groups, kind="stable")
+    groups = groups[order]
+    counts = np.bincount(groups, minlength=len(keys))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    ends = starts + counts - 1
+
+    side = fills["side"][order]
+    amount = fills["amount"][order]
+    price = fills["price"][order]
+    fee = np.nan_to_num(fills["fee"][order])
+    value = amount * price
+    bought = np.where(side > 0, amount, 0.0)
+    sold = np.where(side < 0, amount, 0.0)
+
+    def cum(v):
+        return _group_cumsum(v, starts, counts)
+
+    b, s = cum(bought), cum(sold)
+    vb, vs = cum(np.where(side > 0, value, 0.0)), cum(np.where(side < 0, value, 0.0))
+    fees = cum(fee)
+    inventory = b - s
+    cash = vs - vb - fees
+    with np.errstate(divide="ignore", invalid="ignore"):
+        matched = np.minimum(b, s)
+        realised = np.where(matched > 0, matched * (vs / s - vb / b), 0.0) - fees
+
+    rows = {
+        "market": groups,
+        "block": fills["block"][order],
+        "time": fills["time"][order],
+        "price": price,
+        "inventory": inventory,
+        "turnover": cum(value),
+        "fees": fees,
+        "realised": realised,
+        "unrealised": cash + inventory * price - realised,
+    }
+
+    mark = price[ends].copy()
+    for i, (kb, kq) in enumerate(keys):
+        if marks and (kb, kq) in marks:
+            mark[i] = marks[(kb, kq)]
+    total = cash[ends] + inventory[ends] * mark
+    summary = {
+        "base": keys[:, 0],
+        "quote": keys[:, 1],
+        "fills": counts,
+        "turnover": rows["turnover"][ends],
+        "fees": fees[ends],
+        "inventory": inventory[ends],
+        "mark": mark,
+        "realised": realised[ends],
+        "unrealised": total - realised[ends],
+        "total": total,
+    }
+    return rows, summary
+
+
+def timeline(rows, every):
+    """ Reduce the running values of :func:`analyse` to the last row per
+        market and interval of ``every`` seconds
+    """
+    key = rows["market"].astype(np.int64) << 32 | (rows["time"] // every).astype(np.int64)
+    last = np.flatnonzero(np.append(key[1:] != key[:-1], True))
+    return {k: v[last] for k, v in rows.items()}
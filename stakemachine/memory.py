@@ -0,0 +1,235 @@
+import os
+import gc
+import sys
+import time
+import types
+import logging
+import tracemalloc
+from bitshares.account import Account
+from bitshares.witness import Witness
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+#: Subsystems allocations are attributed to, by the path of the file
+#: that allocated the memory
+subsystems = [
+    ("websocket", ["websocket"]),
+    ("bitshares", ["bitshares", "grapheneapi", "graphenebase", "graphenecommon"]),
+    ("storage", ["sqlalchemy", "sqlite3", "msgpack", "stakemachine/storage.py", "stakemachine/codec.py"]),
+    ("events", ["events/", "stakemachine/basestrategy.py", "stakemachine/bot.py"]),
+    ("stakemachine", ["stakemachine"]),
+]
+
+
+def subsystem(filename):
+    """ Return the subsystem a file belongs to
+    """
+    filename = filename.replace(os.sep, "/")
+    for name, patterns in subsystems:
+        if any(p in filename for p in patterns):
+            return name
+    return "other"
+
+
+def retained_size(root, exclude=(), limit=1000000):
+    """ Return the size in bytes of the objects reachable from ``root``
+
+        Modules, classes and functions are not followed, neither are
+        the objects in ``exclude`` (e.g. shared instances).
+
+        :param int limit: Maximum number of objects to visit
+    """
+    seen = set(id(o) for o in exclude)
+    stack = [root]
+    size = 0
+    while stack and len(seen) < limit:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, (type, types.ModuleType, types.FunctionType, types.CodeType)):
+            continue
+        size += sys.getsizeof(obj, 0)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def handler_count(bot):
+    """ Return the number of event handlers of a bot without creating
+        or compiling any
+    """
+    count = 0
+    for event in bot.__events__:
+        handler = vars(bot).get(event)
+        if handler is not None:
+            count += len(getattr(handler, "targets", [handler]))
+    return count
+
+
+def rss():
+    """ Return the resident set size of this process in bytes or
+        ``None`` if it is not available
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryWatchdog():
+    """ Tracks the memory of the bot infrastructure with
+        :mod:`tracemalloc`
+
+        Every ``interval`` seconds, a snapshot is taken and
+
+        * the memory per subsystem (see :data:`subsystems`) and per bot
+          (the objects only that bot holds, see :meth:`by_bot`) is
+          logged,
+        * the allocations that have grown most since the previous
+          snapshot are logged,
+        * above ``soft_limit``, caches are evicted (accounts, witnesses
+          and the decoded values of the bots' storage),
+        * above ``hard_limit``, the bot that holds the most memory is
+          restarted.
+
+        Limits apply to the resident set size of the process (or the
+        memory traced by :mod:`tracemalloc` where that is unavailable).
+
+        :param stakemachine.bot.BotInfrastructure infrastructure: The bots
+        :param int interval: Seconds between two snapshots
+        :param int top: Number of allocation diffs to log
+        :param int frames: Number of frames to store per allocation
+        :param float soft_limit: Soft limit in MB
+        :param float hard_limit: Hard limit in MB
+    """
+    def __init__(
+        self,
+        infrastructure,
+        interval=600,
+        top=10,
+        frames=5,
+        soft_limit=None,
+        hard_limit=None,
+    ):
+        self.infrastructure = infrastructure
+        self.interval = interval
+        self.top = top
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._snapshot = None
+        self._last = 0
+        self._restarted_at = 0
+
+    def on_block(self, block=None):
+        """ Called on every block, checks memory every ``interval``
+            seconds
+        """
+        now = time.time()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        self.check()
+
+    def usage(self):
+        """ Return the memory in use in bytes
+        """
+        return rss() or tracemalloc.get_traced_memory()[0]
+
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+
+    def check(self):
+        """ Take a snapshot, log it and enforce the limits
+        """
+        snapshot = self.take_snapshot()
+        usage = self.usage()
+        log.info("Memory: {:.1f} MB in use, {:.1f} MB traced".format(
+            usage / MB, tracemalloc.get_traced_memory()[0] / MB))
+
+        per_subsystem = self.by_subsystem(snapshot)
+        log.info("Memory per subsystem: " + ", ".join(
+            "{}={:.1f} MB".format(k, v / MB)
+            for k, v in sorted(per_subsystem.items(), key=lambda x: -x[1])))
+
+        per_bot = self.by_bot()
+        for botname, size in sorted(per_bot.items()):
+            bot = self.infrastructure.bots[botname]
+            log.info("Memory of bot {}: {:.1f} MB, {} cached values, {} handlers".format(
+                botname,
+                size / MB,
+                len(bot._cache),
+                handler_count(bot)))
+
+        if self._snapshot:
+            for stat in snapshot.compare_to(self._snapshot, "lineno")[:self.top]:
+                if stat.size_diff > 0:
+                    log.info("Memory growth: %s" % stat)
+        self._snapshot = snapshot
+
+        if self.hard_limit and usage > self.hard_limit * MB:
+            log.warning("Memory above hard limit of {} MB".format(self.hard_limit))
+            self.evict()
+            # Freed memory is rarely returned to the operating system,
+            # so only restart again if memory keeps growing
+            if usage > self._restarted_at:
+                self._restarted_at = usage
+                self.restart(self.by_bot())
+        elif self.soft_limit and usage > self.soft_limit * MB:
+            log.warning("Memory above soft limit of {} MB".format(self.soft_limit))
+            self.evict()
+
+    def by_subsystem(self, snapshot):
+        """ Return the traced memory per subsystem in bytes
+        """
+        sizes = dict()
+        for stat in snapshot.statistics("filename"):
+            name = subsystem(stat.traceback[0].filename)
+            sizes[name] = sizes.get(name, 0) + stat.size
+        return sizes
+
+    def by_bot(self):
+        """ Return the memory held by each bot in bytes
+
+            This is the size of the objects reachable from the bot that
+            are not shared with the infrastructure or other bots (see
+            :func:`retained_size`).
+        """
+        infrastructure = self.infrastructure
+        bots = infrastructure.bots
+        shared = [infrastructure, infrastructure.config, infrastructure.bitshares]
+        shared += [getattr(infrastructure, "paper", None)]
+        shared += [b.backend for b in bots.values()]
+        sizes = dict()
+        for botname, bot in bots.items():
+            others = [b for name, b in bots.items() if name != botname]
+            sizes[botname] = retained_size(bot, exclude=shared + others)
+        return sizes
+
+    def evict(self):
+        """ Drop caches that can be reloaded on demand
+        """
+        Account.accounts_cache.clear()
+        Witness.witness_cache.clear()
+        for bot in self.infrastructure.bots.values():
+            bot.clear_cache()
+        log.info("Evicted caches, {} objects collected".format(gc.collect()))
+
+    def restart(self, per_bot):
+        """ Restart the bot that holds the most memory
+        """
+        if not per_bot:
+            return
+        botname = max(sorted(per_bot), key=per_bot.get)
+        self.infrastructure.restart_bot(botname)
+        gc.collect()
+        # Compare against the state after the restart next time
+        self._snapshot = None
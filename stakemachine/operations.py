@@ -0,0 +1,74 @@
+from bitshares.amount import Amount
+from bitshares.price import Order, FilledOrder
+
+#: Operation ids (see ``bitsharesbase.operationids``) and the events
+#: they are delivered as
+events = {
+    0: "onTransfer",
+    1: "onOrderCreated",
+    2: "onOrderCancelled",
+    3: "onCallOrderUpdated",
+    4: "onFill",
+}
+
+
+def decode(entry, bitshares_instance=None):
+    """ Decode an entry of an account's history into a typed event
+
+        :param dict entry: Operation history object (``1.11.x``)
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares instance
+        :returns: ``(event, payload)`` or ``None`` for operations that
+            have no typed event
+
+        Payloads carry ``operation_id`` (the ``1.11.x`` id) and
+        ``block_num`` in addition to the fields listed below:
+
+        * ``onFill``: :class:`bitshares.price.FilledOrder` with
+          ``order_id``, ``account_id`` and ``fee``
+        * ``onOrderCreated``: :class:`bitshares.price.Order` with ``id``
+          and ``seller``
+        * ``onOrderCancelled``: ``order_id``, ``account_id`` and the
+          ``refunded`` amount
+        * ``onTransfer``: ``from``, ``to``, ``amount`` and ``memo``
+        * ``onCallOrderUpdated``: ``account_id``, ``delta_collateral``
+          and ``delta_debt``
+    """
+    op_id, op = entry["op"]
+    if op_id not in events:
+        return None
+    result = entry.get("result") or [0, None]
+
+    if op_id == 4:
+        payload = FilledOrder(op, bitshares_instance=bitshares_instance)
+        payload["order_id"] = op["order_id"]
+        payload["account_id"] = op["account_id"]
+        payload["fee"] = Amount(op["fee"], bitshares_instance=bitshares_instance)
+    elif op_id == 1:
+        payload = Order(op, bitshares_instance=bitshares_instance)
+        payload["id"] = result[1]
+        payload["seller"] = op["seller"]
+    elif op_id == 2:
+        payload = {
+            "order_id": op["order"],
+            "account_id": op["fee_paying_account"],
+            "refunded": (
+                Amount(result[1], bitshares_instance=bitshares_instance)
+                if isinstance(result[1], dict) else None
+            ),
+        }
+    elif op_id == 0:
+        payload = {
+            "from": op["from"],
+            "to": op["to"],
+            "amount": Amount(op["amount"], bitshares_instance=bitshares_instance),
+            "memo": op.get("memo"),
+        }
+    elif op_id == 3:
+        payload = {
+            "account_id": op["funding_account"],
+            "delta_collateral": Amount(op["delta_collateral"], bitshares_instance=bitshares_instance),
+            "delta_debt": Amount(op["delta_debt"], bitshares_instance=bitshares_instance),
+        }
+    payload["operation_id"] = entry.get("id")
+    payload["block_num"] = entry.get("block_num")
+    return events[op_id], payload
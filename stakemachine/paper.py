@@ -0,0 +1,448 @@
+import time
+import logging
+import itertools
+from collections import Counter
+from bitshares.amount import Amount
+from bitshares.price import Price, Order
+from bitshares.market import Market
+from bitshares.account import Account
+from bitshares.instance import shared_bitshares_instance
+from .exceptions import InsufficientFundsException
+log = logging.getLogger(__name__)
+
+#: Amounts below this are considered zero
+EPSILON = 1e-12
+
+
+def _ids(market):
+    """ Asset ids (``base``, ``quote``) of a market
+    """
+    return (market["base"]["id"], market["quote"]["id"])
+
+
+class PaperEngine():
+    """ Local matching engine for paper trading
+
+        Orders placed through a :class:`PaperMarket` are not broadcast
+        but matched against the live order book of the market. Orders
+        that do not fill right away rest in the engine and are filled
+        by new orders that show up in the live market notifications
+        (see :meth:`on_market`). Balances start from the real balances
+        of the accounts and are maintained locally. There are no fees.
+
+        Liquidity consumed by paper orders is remembered so that the
+        same live order cannot be filled twice. What has been consumed
+        of a price level of the book is forgotten once the level has
+        left the book and is capped to the level's current size
+        whenever the book is fetched. Any consumed liquidity is
+        forgotten after ``consumed_ttl`` seconds.
+
+        :param int book_depth: Number of orders of the live order book
+            to match new orders against
+        :param float consumed_ttl: Seconds consumed liquidity is
+            remembered
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares instance
+    """
+    def __init__(self, book_depth=25, consumed_ttl=300, bitshares_instance=None):
+        self.bitshares = bitshares_instance or shared_bitshares_instance()
+        self.book_depth = book_depth
+        self.consumed_ttl = consumed_ttl
+
+        self.wallets = dict()
+        self.orders = dict()
+        self.fills = []
+        self.operations = Counter()
+        self.transactions = 0
+
+        self._pending = []
+        self._results = []
+        # Consumed liquidity: key -> [amount, time of the first fill]
+        self._consumed = dict()
+        self._counter = itertools.count(1)
+
+    def _wallet(self, account):
+        """ Return the (free) balances of an account, loading them from
+            the chain on first use
+        """
+        if account not in self.wallets:
+            balances = Account(account, bitshares_instance=self.bitshares).balances
+            self.wallets[account] = {b["symbol"]: float(b) for b in balances}
+        return self.wallets[account]
+
+    @staticmethod
+    def _account_name(account):
+        if isinstance(account, dict):
+            return account["name"]
+        return account
+
+    @staticmethod
+    def _normalize(market, price, amount):
+        """ Return price (``base``/``quote``) and amount (``quote``) of
+            an order as floats
+        """
+        if (
+            isinstance(price, Price) and
+            price["base"]["symbol"] == market["quote"]["symbol"]
+        ):
+            price = price.invert()
+        return float(price), float(amount)
+
+    def _operation(self, name, op, result=None):
+        """ Count an operation that would have been broadcast
+        """
+        self.operations[name] += 1
+        self._pending.append(op)
+        self._results.append([1, result] if result else [0, {}])
+        if not self.bitshares.bundle:
+            return self.execute()
+
+    def execute(self):
+        """ Complete the current transaction
+
+            :returns: The transaction with ``operations`` and
+                ``operation_results`` (like a blocking broadcast)
+        """
+        if not self._pending:
+            return None
+        self.transactions += 1
+        tx = {
+            "operations": self._pending,
+            "operation_results": self._results,
+        }
+        self._pending = []
+        self._results = []
+        return tx
+
+    def place(self, market, side, price, amount, account, killfill=False):
+        """ Place a paper order
+
+            :param bitshares.market.Market market: Market of the order
+            :param str side: ``buy`` or ``sell``
+            :param price: Price in ``base``/``quote``
+            :param amount: Amount of ``quote`` to buy or sell
+            :param account: Account that places the order
+            :param bool killfill: Cancel the order unless it fills at once
+            :returns: The order id and the transaction (if not bundled)
+        """
+        account = self._account_name(account)
+        price, amount = self._normalize(market, price, amount)
+        base, quote = market["base"]["symbol"], market["quote"]["symbol"]
+
+        # Lock the funds that are sold
+        wallet = self._wallet(account)
+        symbol, locked = (base, amount * price) if side == "buy" else (quote, amount)
+        if wallet.get(symbol, 0.0) < locked - EPSILON:
+            raise InsufficientFundsException(
+                "%s needs %f %s but has %f" % (
+                    account, locked, symbol, wallet.get(symbol, 0.0)))
+        wallet[symbol] = wallet.get(symbol, 0.0) - locked
+
+        order = {
+            "id": "paper.%d" % next(self._counter),
+            "account": account,
+            "market": market,
+            "side": side,
+            "price": price,
+            "amount": amount,
+        }
+        tx = self._operation("limit_order_create", [1, {
+            "seller": account,
+            "side": side,
+            "price": price,
+            "amount": amount,
+            "market": "%s:%s" % (quote, base),
+        }], order["id"])
+
+        self._take(order)
+        if order["amount"] > EPSILON:
+            if killfill:
+                self._release(order)
+            else:
+                self.orders[order["id"]] = order
+        return order["id"], tx
+
+    def _expire(self):
+        """ Forget liquidity consumed more than ``consumed_ttl`` ago
+        """
+        limit = time.time() - self.consumed_ttl
+        for key in [k for k, (_, t) in self._consumed.items() if t < limit]:
+            del self._consumed[key]
+
+    def _available(self, key, size):
+        """ Return what is left of ``size`` after the paper fills
+        """
+        return size - self._consumed.get(key, (0.0,))[0]
+
+    def _consume(self, key, amount):
+        self._consumed.setdefault(key, [0.0, time.time()])[0] += amount
+
+    def _take(self, order):
+        """ Match a new order against the live order book
+        """
+        market = order["market"]
+        book = market.orderbook(limit=self.book_depth)
+        buy = order["side"] == "buy"
+        side = "asks" if buy else "bids"
+
+        # Aggregate the book by price level
+        levels = dict()
+        for o in book[side]:
+            p = float(o["price"])
+            levels[p] = levels.get(p, 0.0) + float(o["quote"])
+
+        # The book has changed since it was consumed from
+        self._expire()
+        prefix = _ids(market) + (side,)
+        for key in [k for k in self._consumed if k[:3] == prefix]:
+            if key[3] not in levels:
+                del self._consumed[key]
+            else:
+                consumed = self._consumed[key]
+                consumed[0] = min(consumed[0], levels[key[3]])
+
+        for p in sorted(levels, reverse=not buy):
+            if order["amount"] <= EPSILON:
+                break
+            if (buy and p > order["price"]) or (not buy and p < order["price"]):
+                break
+            key = prefix + (p,)
+            available = self._available(key, levels[p])
+            if available > EPSILON:
+                filled = min(available, order["amount"])
+                self._consume(key, filled)
+                self._fill(order, p, filled, maker=False)
+
+    def _fill(self, order, price, amount, maker):
+        """ Fill ``amount`` of ``order`` at ``price``
+        """
+        market = order["market"]
+        wallet = self._wallet(order["account"])
+        base, quote = market["base"]["symbol"], market["quote"]["symbol"]
+        if order["side"] == "buy":
+            wallet[quote] = wallet.get(quote, 0.0) + amount
+            # Refund what has been locked in excess of the fill price
+            wallet[base] += amount * (order["price"] - price)
+        else:
+            wallet[base] = wallet.get(base, 0.0) + amount * price
+        order["amount"] -= amount
+        self.fills.append({
+            "order_id": order["id"],
+            "account": order["account"],
+            "market": market,
+            "side": order["side"],
+            "price": price,
+            "amount": amount,
+            "maker": maker,
+            "time": time.time(),
+        })
+        log.info("[paper] {} {} {} {} @ {} ({})".format(
+            order["account"], order["side"], amount, quote, price, order["id"]))
+        if order["amount"] <= EPSILON:
+            self.orders.pop(order["id"], None)
+
+    def _release(self, order):
+        """ Return the funds locked in the unfilled part of ``order``
+        """
+        market = order["market"]
+        wallet = self._wallet(order["account"])
+        if order["side"] == "buy":
+            wallet[market["base"]["symbol"]] += order["amount"] * order["price"]
+        else:
+            wallet[market["quote"]["symbol"]] += order["amount"]
+        order["amount"] = 0.0
+
+    def on_market(self, data):
+        """ Fill resting paper orders with a new order from the live
+            market notifications
+
+            :param data: Market notification (only
+                :class:`bitshares.price.Order` instances are used)
+        """
+        if not isinstance(data, Order) or not data.get("base") or not self.orders:
+            return
+        sold = data["base"]["asset"]["id"]
+        received = data["quote"]["asset"]["id"]
+
+        # The live order sells its ``base``. Relative to our market it
+        # is an ask if it sells our quote asset and a bid otherwise.
+        buys, sells = [], []
+        for order in self.orders.values():
+            ids = _ids(order["market"])
+            if ids == (received, sold) and order["side"] == "buy":
+                buys.append(order)
+            elif ids == (sold, received) and order["side"] == "sell":
+                sells.append(order)
+        if buys:
+            price = float(data["quote"]) / float(data["base"])
+            available = float(data["base"])
+            candidates = sorted(buys, key=lambda o: -o["price"])
+        elif sells:
+            price = float(data["base"]) / float(data["quote"])
+            available = float(data["quote"])
+            candidates = sorted(sells, key=lambda o: o["price"])
+        else:
+            return
+
+        self._expire()
+        key = data.get("id") or id(data)
+        for order in candidates:
+            if (
+                (order["side"] == "buy" and price > order["price"]) or
+                (order["side"] == "sell" and price < order["price"])
+            ):
+                break
+            remaining = self._available(key, available)
+            if remaining <= EPSILON:
+                break
+            filled = min(remaining, order["amount"])
+            self._consume(key, filled)
+            # Resting orders are makers and fill at their own price
+            self._fill(order, order["price"], filled, maker=True)
+
+    def cancel(self, ids, account=None):
+        """ Cancel paper orders
+
+            :param list ids: Order ids
+            :param account: Account that owns the orders
+        """
+        tx = None
+        for order_id in ids:
+            order = self.orders.pop(order_id, None)
+            if not order:
+                continue
+            self._release(order)
+            tx = self._operation("limit_order_cancel", [2, {
+                "fee_paying_account": order["account"],
+                "order": order_id,
+            }])
+        return tx
+
+    def open_orders(self, account, market):
+        """ Return the resting paper orders of an account in a market as
+            :class:`bitshares.price.Order`
+        """
+        account = self._account_name(account)
+        orders = []
+        for order in self.orders.values():
+            if order["account"] != account or _ids(order["market"]) != _ids(market):
+                continue
+            base = Amount(
+                order["amount"] * order["price"],
+                market["base"]["symbol"],
+                bitshares_instance=self.bitshares)
+            quote = Amount(
+                order["amount"],
+                market["quote"]["symbol"],
+                bitshares_instance=self.bitshares)
+            # Orders are represented as on chain: ``base`` is sold
+            if order["side"] == "buy":
+                o = Order(quote, base, bitshares_instance=self.bitshares)
+            else:
+                o = Order(base, quote, bitshares_instance=self.bitshares)
+            o["id"] = order["id"]
+            o["seller"] = account
+            orders.append(o)
+        return orders
+
+    def balance(self, account, asset):
+        """ Return the free balance of an account as
+            :class:`bitshares.amount.Amount`
+        """
+        if isinstance(asset, dict):
+            asset = asset["symbol"]
+        wallet = self._wallet(self._account_name(account))
+        return Amount(wallet.get(asset, 0.0), asset, bitshares_instance=self.bitshares)
+
+    def balances(self, account):
+        """ Return the free balances of an account
+        """
+        wallet = self._wallet(self._account_name(account))
+        return [
+            Amount(v, k, bitshares_instance=self.bitshares)
+            for k, v in sorted(wallet.items()) if v > EPSILON
+        ]
+
+    def report(self):
+        """ Summarize the paper trades per account and market
+
+            Profits are the traded base and quote amounts with the quote
+            amount valued at the latest price of the market.
+
+            :returns: list of dicts with ``account``, ``market``,
+                ``fills``, ``base``, ``quote``, ``price`` and ``pnl``
+        """
+        rows = dict()
+        for fill in self.fills:
+            market = fill["market"]
+            key = (fill["account"], _ids(market))
+            if key not in rows:
+                rows[key] = {
+                    "account": fill["account"],
+                    "market": "%s:%s" % (market["quote"]["symbol"], market["base"]["symbol"]),
+                    "fills": 0,
+                    "base": 0.0,
+                    "quote": 0.0,
+                    "price": fill["price"],
+                    "_market": market,
+                }
+            row = rows[key]
+            sign = 1 if fill["side"] == "buy" else -1
+            row["fills"] += 1
+            row["quote"] += sign * fill["amount"]
+            row["base"] -= sign * fill["amount"] * fill["price"]
+            row["price"] = fill["price"]
+
+        for row in rows.values():
+            market = row.pop("_market")
+            try:
+                row["price"] = float(market.ticker()["latest"])
+            except Exception:
+                log.warning("No latest price for %s, using the last fill" % row["market"])
+            row["pnl"] = row["base"] + row["quote"] * row["price"]
+        return [rows[k] for k in sorted(rows)]
+
+
+class PaperMarket(Market):
+    """ :class:`bitshares.market.Market` that places its orders in a
+        :class:`PaperEngine` instead of broadcasting them
+
+        :param PaperEngine paper: The matching engine
+    """
+    def __init__(self, *args, paper=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.paper = paper
+
+    def _place(self, side, price, amount, killfill, account, returnOrderId):
+        if not account:
+            account = self.bitshares.config["default_account"]
+        order_id, tx = self.paper.place(
+            self, side, price, amount, account, killfill=killfill)
+        if returnOrderId and tx:
+            tx["orderid"] = order_id
+        return tx
+
+    def buy(
+        self,
+        price,
+        amount,
+        expiration=None,
+        killfill=False,
+        account=None,
+        returnOrderId=False
+    ):
+        """ Places a paper buy order (see :meth:`bitshares.market.Market.buy`)
+        """
+        return self._place("buy", price, amount, killfill, account, returnOrderId)
+
+    def sell(
+        self,
+        price,
+        amount,
+        expiration=None,
+        killfill=False,
+        account=None,
+        returnOrderId=False
+    ):
+        """ Places a paper sell order (see :meth:`bitshares.market.Market.sell`)
+        """
+        return self._place("sell", price, amount, killfill, account, returnOrderId)
@@ -0,0 +1,272 @@
+import time
+import random
+import logging
+import itertools
+import threading
+from events import Events
+from bitsharesapi.bitsharesnoderpc import BitSharesNodeRPC
+from bitsharesapi.exceptions import RPCError
+log = logging.getLogger(__name__)
+
+
+class Node():
+    """ A connection to a single node and its health
+
+        :param str url: Websocket URL of the node
+        :param BitSharesNodeRPC rpc: An existing connection (optional)
+    """
+    def __init__(self, url, rpc=None):
+        self.url = url
+        self.rpc = rpc
+        self.lock = threading.RLock()
+        self.latency = None
+        self.head = 0
+        self.lag = 0
+        self.errors = 0
+        self.down_until = 0
+        self.calls = 0
+
+    @property
+    def up(self):
+        return time.time() >= self.down_until
+
+    def observe(self, seconds, alpha=0.2):
+        """ Update the moving average of the latency
+        """
+        self.calls += 1
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = (1 - alpha) * self.latency + alpha * seconds
+
+    def failed(self, backoff):
+        """ Mark the node as down for an increasing amount of time and
+            close its connection
+        """
+        self.errors += 1
+        self.down_until = time.time() + min(backoff * 2 ** (self.errors - 1), 300)
+        self.close()
+
+    def close(self):
+        """ Close and forget the connection to the node
+        """
+        with self.lock:
+            rpc, self.rpc = self.rpc, None
+        # ``rpc.ws`` is the websocket, any other attribute of the
+        # connection would be taken as an API call
+        ws = vars(rpc).get("ws") if rpc is not None else None
+        if ws is None:
+            return
+        try:
+            ws.close()
+        except Exception as e:
+            log.debug("Could not close the connection to {}: {}".format(self.url, e))
+
+    def __repr__(self):
+        return "<Node {} latency={} lag={} up={}>".format(
+            self.url,
+            "%.0fms" % (self.latency * 1000) if self.latency is not None else "?",
+            self.lag,
+            self.up
+        )
+
+
+class HealthiestURL(itertools.cycle):
+    """ Endless iterator over the url of the currently healthiest node
+
+        Handed to :class:`bitsharesapi.websocket.BitSharesWebsocket` so
+        that the subscription (re)connects to the healthiest node.
+    """
+    def __new__(cls, pool):
+        self = super().__new__(cls, [])
+        self.pool = pool
+        return self
+
+    def __next__(self):
+        return self.pool.primary().url
+
+
+class NodePool(Events):
+    """ Drop-in replacement for ``bitshares.rpc`` that spreads calls
+        over several nodes
+
+        * Read calls (``get_*``, ``lookup_*``, ``list_*``) go to one of
+          the two fastest healthy nodes, picked at random.
+        * All other calls (e.g. broadcasts) go to the healthiest node.
+        * A node that fails to answer is taken out of the pool for a
+          while and the call is retried on the next node.
+        * Latency (moving average) and head block lag of each node are
+          tracked by :meth:`check`, which runs every ``interval``
+          seconds in a background thread once :meth:`start` is called.
+
+        ``on_unhealthy(url)`` is fired for nodes that fail or fall
+        behind so that subscriptions can move away from them.
+
+        :param list urls: Websocket URLs of the nodes
+        :param str user: RPC user
+        :param str password: RPC password
+        :param BitSharesNodeRPC rpc: Existing connection to one of the
+            nodes (``rpc.url``), reused by the pool
+        :param int max_lag: Nodes that are more blocks behind are not
+            used for reads
+        :param int interval: Seconds between two health checks
+        :param float backoff: Seconds a failed node is not used (doubles
+            with every consecutive failure)
+    """
+    __events__ = ["on_unhealthy"]
+
+    read_prefixes = ("get_", "lookup_", "list_")
+
+    def __init__(
+        self,
+        urls,
+        user="",
+        password="",
+        rpc=None,
+        max_lag=3,
+        interval=10,
+        backoff=5,
+        **kwargs
+    ):
+        Events.__init__(self)
+        self.user = user
+        self.password = password
+        self.max_lag = max_lag
+        self.interval = interval
+        self.backoff = backoff
+        self.kwargs = kwargs
+        self.kwargs.setdefault("num_retries", 1)
+        self.nodes = [Node(url) for url in urls]
+        if rpc:
+            for node in self.nodes:
+                if node.url == getattr(rpc, "url", None):
+                    node.rpc = rpc
+        self.urls = HealthiestURL(self)
+        self._chain_params = rpc.chain_params if rpc else None
+        self._thread = None
+
+    def _connect(self, node):
+        if node.rpc is None:
+            node.rpc = BitSharesNodeRPC(
+                node.url, self.user, self.password, **self.kwargs)
+            self._chain_params = self._chain_params or node.rpc.chain_params
+        return node.rpc
+
+    @property
+    def chain_params(self):
+        if self._chain_params is None:
+            self._connect(self.primary())
+        return self._chain_params
+
+    @property
+    def url(self):
+        return self.primary().url
+
+    def healthy(self):
+        """ Return the nodes that are up and not lagging behind, the
+            fastest first
+        """
+        nodes = [
+            n for n in self.nodes
+            if n.up and n.lag <= self.max_lag
+        ] or [n for n in self.nodes if n.up] or list(self.nodes)
+        return sorted(
+            nodes,
+            key=lambda n: (n.latency is None, n.latency or 0)
+        )
+
+    def primary(self):
+        """ Return the healthiest node
+        """
+        return self.healthy()[0]
+
+    def candidates(self, name):
+        """ Return the nodes to try for call ``name`` in order
+        """
+        nodes = self.healthy()
+        if name.startswith(self.read_prefixes) and len(nodes) > 1:
+            # Spread reads over the two fastest nodes
+            first = random.choice(nodes[:2])
+            nodes.remove(first)
+            nodes.insert(0, first)
+        return nodes
+
+    def call(self, name, *args, **kwargs):
+        """ Execute call ``name`` on the best node, failing over to the
+            next one on connection problems
+        """
+        error = None
+        for node in self.candidates(name):
+            try:
+                with node.lock:
+                    rpc = self._connect(node)
+                    start = time.time()
+                    result = getattr(rpc, name)(*args, **kwargs)
+                node.observe(time.time() - start)
+                node.errors = 0
+                return result
+            except RPCError:
+                # The node answered, the call itself failed
+                raise
+            except Exception as e:
+                error = e
+                log.warning("Node {} failed on {}: {}".format(node.url, name, e))
+                node.failed(self.backoff)
+                self.on_unhealthy(node.url)
+        raise error
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self.__events__:
+            return Events.__getattr__(self, name)
+
+        def method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return method
+
+    def check(self):
+        """ Measure latency and head block of all nodes
+        """
+        for node in self.nodes:
+            if not node.up:
+                continue
+            try:
+                with node.lock:
+                    rpc = self._connect(node)
+                    start = time.time()
+                    props = rpc.get_dynamic_global_properties()
+                node.observe(time.time() - start)
+                node.head = props["head_block_number"]
+                node.errors = 0
+            except Exception as e:
+                log.warning("Node {} failed the health check: {}".format(node.url, e))
+                node.failed(self.backoff)
+                self.on_unhealthy(node.url)
+
+        head = max(n.head for n in self.nodes)
+        for node in self.nodes:
+            was_lagging = node.lag > self.max_lag
+            node.lag = head - node.head if node.head else 0
+            if node.lag > self.max_lag and not was_lagging and node.up:
+                log.warning("Node {} is {} blocks behind".format(node.url, node.lag))
+                self.on_unhealthy(node.url)
+        log.debug("Nodes: {}".format(self.healthy()))
+
+    def start(self):
+        """ Check the nodes every ``interval`` seconds in a background
+            thread
+        """
+        if self._thread:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.check()
+                except Exception as e:
+                    log.error("Health check failed: %s" % e)
+                time.sleep(self.interval)
+
+        self._thread = threading.Thread(target=run, name="NodePool", daemon=True)
+        self._thread.start()
@@ -0,0 +1,175 @@
+import logging
+import threading
+from bitshares.amount import Amount
+log = logging.getLogger(__name__)
+
+
+class OrderRegistry():
+    """ Ids of the orders a bot has placed
+
+        The registry is persisted in the bot's
+        :class:`stakemachine.storage.Storage` (key ``__orders__``) and
+        maps order ids to the ids of the assets sold and received and
+        the amount that is still for sale. It is updated from
+
+        * the results of transactions (:meth:`record`),
+        * ``onOrderCreated``, ``onFill`` and ``onOrderCancelled`` and
+        * a regular comparison with the orders on the chain
+          (:meth:`reconcile`).
+
+        :param stakemachine.storage.Storage storage: Storage of the bot
+        :param str account_id: Id of the bot's account
+        :param list markets: Asset id pairs of the bot's markets
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares instance
+    """
+    key = "__orders__"
+
+    def __init__(self, storage, account_id, markets, bitshares_instance=None):
+        self.storage = storage
+        self.account_id = account_id
+        self.markets = set(frozenset(m) for m in markets)
+        self.bitshares = bitshares_instance
+        self._lock = threading.RLock()
+        self.orders = dict(storage[self.key] or {})
+
+    def __contains__(self, order_id):
+        return order_id in self.orders
+
+    def __len__(self):
+        return len(self.orders)
+
+    @property
+    def ids(self):
+        """ Ids of the registered orders
+        """
+        with self._lock:
+            return sorted(self.orders)
+
+    def _save(self):
+        self.storage[self.key] = self.orders
+
+    def _in_market(self, *asset_ids):
+        return frozenset(asset_ids) in self.markets
+
+    def add(self, order_id, asset_id, receive_id, for_sale):
+        """ Register an order
+
+            :param str order_id: Id of the order (``1.7.x``)
+            :param str asset_id: Id of the asset for sale
+            :param str receive_id: Id of the asset to receive
+            :param float for_sale: Amount for sale
+        """
+        with self._lock:
+            self.orders[order_id] = {
+                "asset_id": asset_id,
+                "receive_id": receive_id,
+                "for_sale": for_sale
+            }
+            self._save()
+
+    def market_ids(self, *asset_ids):
+        """ Ids of the registered orders in the market of the two
+            assets
+        """
+        market = frozenset(asset_ids)
+        with self._lock:
+            return sorted(
+                k for k, v in self.orders.items()
+                if frozenset([v["asset_id"], v.get("receive_id")]) == market
+            )
+
+    def remove(self, order_id):
+        """ Forget an order that has been cancelled or filled
+        """
+        with self._lock:
+            if self.orders.pop(order_id, None) is not None:
+                self._save()
+
+    def filled(self, order_id, asset_id, amount):
+        """ Reduce the amount for sale of an order, forgetting the order
+            once it has been filled completely
+        """
+        with self._lock:
+            order = self.orders.get(order_id)
+            if not order or order["asset_id"] != asset_id:
+                return
+            order["for_sale"] -= amount
+            # Allow for rounding errors of the float amounts
+            if order["for_sale"] <= 1e-9:
+                del self.orders[order_id]
+            self._save()
+
+    def record(self, tx):
+        """ Register the orders created and forget the orders cancelled
+            by a transaction
+
+            Only blocking broadcasts contain the ids of new orders (in
+            ``operation_results``). Orders of other broadcasts are
+            registered once ``onOrderCreated`` arrives.
+        """
+        if not isinstance(tx, dict):
+            return
+        results = tx.get("operation_results") or []
+        for i, (op_id, op) in enumerate(tx.get("operations") or []):
+            if op_id == 1 and i < len(results):
+                sell = op["amount_to_sell"]
+                if (
+                    op["seller"] == self.account_id and
+                    self._in_market(sell["asset_id"], op["min_to_receive"]["asset_id"]) and
+                    isinstance(results[i][1], str)
+                ):
+                    self.add(
+                        results[i][1],
+                        sell["asset_id"],
+                        op["min_to_receive"]["asset_id"],
+                        float(Amount(sell, bitshares_instance=self.bitshares))
+                    )
+            elif op_id == 2:
+                self.remove(op["order"])
+
+    def onOrderCreated(self, order):
+        if (
+            order.get("seller") == self.account_id and order.get("id") and
+            self._in_market(order["base"]["asset"]["id"], order["quote"]["asset"]["id"])
+        ):
+            self.add(
+                order["id"],
+                order["base"]["asset"]["id"],
+                order["quote"]["asset"]["id"],
+                float(order["base"])
+            )
+
+    def onFill(self, fill):
+        # The order's owner pays the ``quote`` of the fill
+        self.filled(fill["order_id"], fill["quote"]["asset"]["id"], float(fill["quote"]))
+
+    def onOrderCancelled(self, d):
+        self.remove(d["order_id"])
+
+    def reconcile(self, orders):
+        """ Make the registry match the orders on the chain
+
+            :param list orders: The bot's open orders on the chain
+                (:class:`bitshares.price.Order` with the remaining
+                amount as ``for_sale``, see
+                :func:`stakemachine.account.open_order`)
+            :returns: ``(added, removed)`` order ids
+        """
+        chain = {
+            o["id"]: {
+                "asset_id": o["base"]["asset"]["id"],
+                "receive_id": o["quote"]["asset"]["id"],
+                "for_sale": float(o["for_sale"])
+            }
+            for o in orders
+        }
+        with self._lock:
+            added = set(chain) - set(self.orders)
+            removed = set(self.orders) - set(chain)
+            if added or removed:
+                log.info("Order registry out of sync: {} missing, {} gone".format(
+                    sorted(added), sorted(removed)))
+            if chain != self.orders:
+                self.orders = chain
+                self._save()
+        return added, removed
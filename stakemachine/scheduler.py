@@ -0,0 +1,213 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import defaultdict
+log = logging.getLogger(__name__)
+
+#: Default priorities of the event classes (lower runs first)
+PRIORITIES = {
+    "fill": 0,      # market notifications about matched orders
+    "account": 0,   # account updates (fills, new and cancelled orders)
+    "market": 1,    # other market notifications
+    "block": 2,     # block bookkeeping (backfill, memory, reconcile)
+    "tick": 3,      # ontick of the bots
+}
+
+
+class Scheduler():
+    """ Runs the event handling of the infrastructure in a worker thread,
+        the most important event classes first
+
+        Notifications are queued by the websocket thread and handled in
+        the order of their class' priority (see :data:`PRIORITIES`) and
+        then in the order of their arrival. The time each class waits
+        in the queue is recorded and logged every ``log_interval``
+        seconds.
+
+        Work that may be postponed (like the ``ontick`` of the bots)
+        checks :meth:`waiting` and re-submits itself when more important
+        work is queued. Such work is dropped once its ``deadline`` is
+        exceeded (see :meth:`expired`).
+
+        The queue holds at most ``max_queue`` tasks. When it is full,
+        queued work of the ``shed`` classes is dropped (the least
+        important and oldest first, e.g. ticks of past blocks) to make
+        room, or else the new work if it is of such a class. Other work
+        makes the submitting thread wait until the worker has caught up.
+
+        :param dict priorities: Priorities of the event classes, merged
+            into :data:`PRIORITIES`
+        :param float deadline: Seconds after which tick work is dropped
+            (default: never)
+        :param int log_interval: Seconds between two log lines with the
+            waiting times
+        :param int max_queue: Maximum number of queued tasks
+        :param list shed: Event classes that may be dropped when the
+            queue is full
+    """
+    def __init__(
+        self,
+        priorities=None,
+        deadline=None,
+        log_interval=300,
+        max_queue=1000,
+        shed=("tick",)
+    ):
+        self.priorities = dict(PRIORITIES, **(priorities or {}))
+        self.deadline = deadline
+        self.log_interval = log_interval
+        self.max_queue = max_queue
+        self.shed = set(shed)
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._logged = time.time()
+        self.reset_stats()
+
+    def reset_stats(self):
+        #: Per class: number of tasks, total and maximum waiting time
+        #: (seconds) and number of dropped tasks
+        self.stats = defaultdict(lambda: {
+            "count": 0, "wait": 0.0, "max_wait": 0.0, "dropped": 0
+        })
+
+    def priority(self, cls):
+        return self.priorities.get(cls, max(self.priorities.values()) + 1)
+
+    def submit(self, cls, func, *args, since=None):
+        """ Queue ``func(*args)`` as work of class ``cls``
+
+            :param str cls: Event class, e.g. ``fill`` or ``tick``
+            :param float since: Time the event arrived (defaults to
+                now), used for the waiting time
+        """
+        with self._condition:
+            while len(self._queue) >= self.max_queue:
+                if self._shed(self.priority(cls)):
+                    continue
+                if cls in self.shed:
+                    self.drop(cls)
+                    return
+                if threading.current_thread() is self._thread or not self._running:
+                    # The worker must not wait for itself
+                    break
+                self._condition.wait(1)
+            heapq.heappush(self._queue, (
+                self.priority(cls),
+                next(self._counter),
+                since or time.time(),
+                cls,
+                func,
+                args
+            ))
+            self._condition.notify()
+
+    def _shed(self, priority):
+        """ Drop the least important and oldest queued task of the
+            ``shed`` classes that is not more important than
+            ``priority``
+
+            :returns: ``False`` if there is none
+        """
+        candidates = [
+            i for i, task in enumerate(self._queue)
+            if task[3] in self.shed and task[0] >= priority
+        ]
+        if not candidates:
+            return False
+        i = max(candidates, key=lambda i: (self._queue[i][0], -self._queue[i][1]))
+        self.drop(self._queue[i][3])
+        self._queue[i] = self._queue[-1]
+        self._queue.pop()
+        heapq.heapify(self._queue)
+        return True
+
+    def waiting(self, cls):
+        """ Is work of a higher priority than ``cls`` queued?
+        """
+        with self._condition:
+            return bool(self._queue) and self._queue[0][0] < self.priority(cls)
+
+    def expired(self, since, deadline=None):
+        """ Has work that arrived at ``since`` missed its deadline?
+
+            :param float deadline: Deadline in seconds, defaults to the
+                scheduler's
+        """
+        deadline = deadline if deadline is not None else self.deadline
+        return deadline is not None and time.time() - since > deadline
+
+    def drop(self, cls, n=1):
+        """ Count ``n`` dropped tasks of class ``cls``
+        """
+        self.stats[cls]["dropped"] += n
+
+    def run_next(self, timeout=None):
+        """ Run the most important queued work
+
+            :returns: ``False`` if nothing was queued within ``timeout``
+        """
+        with self._condition:
+            if not self._queue:
+                self._condition.wait(timeout)
+            if not self._queue:
+                return False
+            _, _, since, cls, func, args = heapq.heappop(self._queue)
+            # Wake up submitters waiting for room
+            self._condition.notify_all()
+
+        wait = time.time() - since
+        stats = self.stats[cls]
+        stats["count"] += 1
+        stats["wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+        try:
+            func(*args)
+        except Exception:
+            log.exception("Error while handling {} event".format(cls))
+        return True
+
+    def run(self):
+        """ Handle queued work until :meth:`stop` is called
+        """
+        while self._running:
+            self.run_next(timeout=1)
+            if time.time() - self._logged > self.log_interval:
+                self.log_stats()
+
+    def log_stats(self):
+        """ Log (and reset) the waiting times per event class
+        """
+        self._logged = time.time()
+        for cls, s in sorted(self.stats.items(), key=lambda i: self.priority(i[0])):
+            log.info("{}: {} handled, waited {:.1f}ms on average, {:.1f}ms at most, {} dropped".format(
+                cls,
+                s["count"],
+                s["wait"] / s["count"] * 1000 if s["count"] else 0,
+                s["max_wait"] * 1000,
+                s["dropped"]
+            ))
+        self.reset_stats()
+
+    def start(self):
+        """ Start the worker thread
+        """
+        if self._thread:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name="Scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the worker thread after the current work
+        """
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
@@ -1,16 +1,29 @@
 import os
-import json
+import dbm
+import copy
+import queue
+import sqlite3
+import atexit
+import time
+import logging
+import threading
 import sqlalchemy
-from sqlalchemy import create_engine, Table, Column, String, Integer, MetaData
+from sqlalchemy import create_engine, event, Table, Column, String, Integer, MetaData
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 from appdirs import user_data_dir
+from .codec import Codec
+log = logging.getLogger(__name__)
 Base = declarative_base()
 
 # For stakemachine.sqlite file
 appname = "stakemachine"
 appauthor = "ChainSquad GmbH"
 storageDatabase = "stakemachine.sqlite"
+dbmDatabase = "stakemachine.dbm"
+#: Category of the bots' own bookkeeping (state, latest event), one
+#: value per bot, kept apart from the values the strategies store
+metaCategory = "__meta__"
 
 
 def mkdir_p(d):
@@ -25,6 +38,29 @@ def mkdir_p(d):
             raise
 
 
+def create_sqlite_engine(filename):
+    """ Create an engine for a sqlite file that can be shared by
+        threads and processes
+
+        The database is put into write-ahead-log mode so that readers
+        never block the writer and vice versa.
+    """
+    e = create_engine(
+        'sqlite:///%s' % filename,
+        echo=False,
+        connect_args={"check_same_thread": False, "timeout": 30}
+    )
+
+    @event.listens_for(e, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return e
+
+
 class Config(Base):
     __tablename__ = 'config'
 
@@ -39,58 +75,574 @@ class Config(Base):
         self.value = v
 
 
+class StorageBackend():
+    """ Interface for the backends :class:`Storage` can write to
+
+        Backends store opaque (already serialized) values in
+        namespaces called *categories*. Values are ``bytes`` or, for
+        data written by older versions, JSON ``str``.
+    """
+    def get(self, category, key):
+        """ Return the stored value or ``None``
+        """
+        raise NotImplementedError
+
+    def set(self, category, key, value):
+        raise NotImplementedError
+
+    def delete(self, category, key):
+        raise NotImplementedError
+
+    def contains(self, category, key):
+        return self.get(category, key) is not None
+
+    def items(self, category):
+        """ Return a list of ``(key, value)`` tuples of a category
+        """
+        raise NotImplementedError
+
+    def categories(self):
+        """ Return all categories that hold at least one key
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Make sure all writes have been persisted
+        """
+        pass
+
+    def close(self):
+        """ Persist all writes and release the database files
+        """
+        self.flush()
+
+    def cache(self, category):
+        """ Return the :class:`ValueCache` of a category, shared by all
+            :class:`Storage` instances on this backend
+        """
+        with _caches_lock:
+            caches = self.__dict__.setdefault("_caches", dict())
+            if category not in caches:
+                caches[category] = ValueCache()
+            return caches[category]
+
+
+class ValueCache(dict):
+    """ Encoded values of a category by key, along with the decoded
+        value if it is immutable (see :data:`IMMUTABLE`)
+
+        Mutable values are decoded again on every read, so that no
+        caller can change what another one reads.
+    """
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.RLock()
+
+
+#: Types of decoded values that can be handed out without copying (all
+#: others are handed out as shallow copies)
+IMMUTABLE = (type(None), bool, int, float, str, bytes)
+_caches_lock = threading.Lock()
+_decode = object()
+
+
+class StorageWriter(threading.Thread):
+    """ Single thread that performs all writes to a sqlite database
+
+        Writes of all bots are put into a queue. The writer takes
+        whatever is queued, merges writes to the same key and commits
+        them in a single transaction.
+
+        A failed commit is retried ``retries`` times with a backoff
+        that starts at ``backoff`` seconds and doubles up to
+        ``max_backoff``. If it still fails, the writes stay pending in
+        the backend (so reads keep seeing them) and are merged into the
+        next transaction, which is attempted at the latest after
+        ``max_backoff`` seconds.
+
+        :param sessionmaker Session: Session factory for the database
+        :param SQLiteBackend backend: Backend that holds pending writes
+        :param int max_batch: Maximum number of writes per transaction
+        :param int retries: Attempts per transaction
+        :param float backoff: Seconds to wait after the first failure
+        :param float max_backoff: Maximum seconds between two attempts
+    """
+    def __init__(self, Session, backend, max_batch=1000, retries=5, backoff=0.5, max_backoff=30):
+        super().__init__(name="StorageWriter", daemon=True)
+        self.Session = Session
+        self.backend = backend
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue()
+        #: Writes that could not be committed yet
+        self.failed = dict()
+
+    def run(self):
+        session = self.Session()
+        while True:
+            batch = []
+            try:
+                batch.append(self.queue.get(
+                    timeout=self.max_backoff if self.failed else None))
+            except queue.Empty:
+                pass
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Only the last write to a key matters
+            writes, self.failed = self.failed, dict()
+            for seq, category, key, value in batch:
+                writes[(category, key)] = (seq, value)
+
+            if self.commit(session, writes):
+                self.backend._written(writes)
+            else:
+                log.error("Keeping %d values pending, retrying later" % len(writes))
+                self.failed = writes
+            for _ in batch:
+                self.queue.task_done()
+
+    def commit(self, session, writes):
+        """ Write ``writes`` in a single transaction
+
+            :returns: ``True`` if the transaction has been committed
+        """
+        delay = self.backoff
+        for attempt in range(self.retries):
+            try:
+                for (category, key), (seq, value) in writes.items():
+                    e = session.query(Config).filter_by(
+                        category=category,
+                        key=key
+                    ).first()
+                    if value is None:
+                        if e:
+                            session.delete(e)
+                    elif e:
+                        e.value = value
+                    else:
+                        session.add(Config(category, key, value))
+                session.commit()
+                return True
+            except Exception:
+                log.exception("Failed to write %d values to storage" % len(writes))
+                session.rollback()
+            if attempt + 1 < self.retries:
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        return False
+
+
+class SQLiteBackend(StorageBackend):
+    """ Stores values in the ``config`` table of ``stakemachine.sqlite``
+
+        This backend is thread-safe: Reads use a session per thread
+        while all writes are handed to a single :class:`StorageWriter`
+        thread and committed in batches. Until a write has been
+        committed, reads see the pending value.
+
+        :param str filename: Use a different sqlite file
+    """
+    def __init__(self, filename=None):
+        if filename:
+            self.engine = create_sqlite_engine(filename)
+            Base.metadata.create_all(self.engine)
+        else:
+            self.engine = engine
+        self.Session = scoped_session(sessionmaker(bind=self.engine))
+
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._pending = dict()
+        self.writer = StorageWriter(sessionmaker(bind=self.engine), self)
+        self.writer.start()
+        atexit.register(self.flush)
+
+    def _enqueue(self, category, key, value):
+        with self._lock:
+            self._seq += 1
+            self._pending[(category, key)] = (self._seq, value)
+            self.writer.queue.put((self._seq, category, key, value))
+
+    def _written(self, writes):
+        """ Called by the writer once ``writes`` have been committed
+        """
+        with self._lock:
+            for k, (seq, _) in writes.items():
+                if k in self._pending and self._pending[k][0] == seq:
+                    del self._pending[k]
+
+    def _query(self, *entities, **filters):
+        # End the read transaction right away so the next read sees
+        # everything the writer has committed in the meantime
+        session = self.Session()
+        try:
+            return session.query(*entities).filter_by(**filters).all()
+        finally:
+            session.rollback()
+
+    def get(self, category, key):
+        with self._lock:
+            if (category, key) in self._pending:
+                return self._pending[(category, key)][1]
+        rows = self._query(Config.value, category=category, key=key)
+        if rows:
+            return rows[0].value
+
+    def set(self, category, key, value):
+        self._enqueue(category, key, value)
+
+    def delete(self, category, key):
+        self._enqueue(category, key, None)
+
+    def contains(self, category, key):
+        return self.get(category, key) is not None
+
+    def items(self, category):
+        values = {
+            r.key: r.value
+            for r in self._query(Config.key, Config.value, category=category)
+        }
+        with self._lock:
+            for (c, key), (_, value) in self._pending.items():
+                if c != category:
+                    continue
+                if value is None:
+                    values.pop(key, None)
+                else:
+                    values[key] = value
+        return list(values.items())
+
+    def categories(self):
+        session = self.Session()
+        try:
+            categories = set(
+                c for c, in session.query(Config.category).distinct())
+        finally:
+            session.rollback()
+        with self._lock:
+            categories.update(c for (c, _), (_, v) in self._pending.items() if v is not None)
+        return list(categories)
+
+    def flush(self):
+        """ Block until all queued writes have been committed or, if
+            committing keeps failing, have been left pending (see
+            :class:`StorageWriter`)
+        """
+        self.writer.queue.join()
+
+    def close(self):
+        self.flush()
+        self.engine.dispose()
+
+
+class MemoryBackend(StorageBackend):
+    """ Keeps all values in memory. Useful for tests and backtests
+        where nothing should be persisted.
+    """
+    def __init__(self):
+        self.data = dict()
+
+    def get(self, category, key):
+        return self.data.get(category, {}).get(key)
+
+    def set(self, category, key, value):
+        self.data.setdefault(category, {})[key] = value
+
+    def delete(self, category, key):
+        self.data.get(category, {}).pop(key, None)
+
+    def contains(self, category, key):
+        return key in self.data.get(category, {})
+
+    def items(self, category):
+        return list(self.data.get(category, {}).items())
+
+    def categories(self):
+        return [c for c, d in self.data.items() if d]
+
+
+class DBMBackend(StorageBackend):
+    """ Stores values in an embedded key-value database
+        (``stakemachine.dbm``) using python's :mod:`dbm` module.
+
+        Lookups are plain hash lookups and do not require any SQL
+        processing which makes this backend the fastest persistent one.
+        Access is serialized with a lock as :mod:`dbm` databases are
+        not thread-safe.
+
+        :param str filename: Path of the database file
+    """
+    separator = "\x00"
+
+    def __init__(self, filename=None):
+        self.filename = filename or os.path.join(data_dir, dbmDatabase)
+        self.db = dbm.open(self.filename, "c")
+        self._lock = threading.RLock()
+
+    def _key(self, category, key):
+        return (category + self.separator + key).encode("utf-8")
+
+    def _sync(self):
+        if hasattr(self.db, "sync"):
+            self.db.sync()
+
+    def get(self, category, key):
+        with self._lock:
+            return self.db.get(self._key(category, key))
+
+    def set(self, category, key, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self._lock:
+            self.db[self._key(category, key)] = value
+            self._sync()
+
+    def delete(self, category, key):
+        k = self._key(category, key)
+        with self._lock:
+            if k in self.db:
+                del self.db[k]
+                self._sync()
+
+    def contains(self, category, key):
+        with self._lock:
+            return self._key(category, key) in self.db
+
+    def items(self, category):
+        prefix = (category + self.separator).encode("utf-8")
+        with self._lock:
+            return [
+                (k[len(prefix):].decode("utf-8"), self.db[k])
+                for k in self.db.keys() if k.startswith(prefix)
+            ]
+
+    def categories(self):
+        categories = set()
+        with self._lock:
+            for k in self.db.keys():
+                categories.add(k.decode("utf-8").split(self.separator)[0])
+        return list(categories)
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+#: Available storage backends, selectable with ``storage`` in a bot's
+#: configuration
+backends = {
+    "sqlite": SQLiteBackend,
+    "memory": MemoryBackend,
+    "dbm": DBMBackend,
+}
+_backend_instances = dict()
+
+
+def get_backend(name=None):
+    """ Return the (shared) instance of a storage backend
+
+        :param str name: One of ``sqlite`` (default), ``memory``, ``dbm``
+    """
+    name = name or "sqlite"
+    if name not in backends:
+        raise ValueError(
+            "Unknown storage backend '%s'. Use one of: %s" % (
+                name, ", ".join(sorted(backends))))
+    if name not in _backend_instances:
+        _backend_instances[name] = backends[name]()
+    return _backend_instances[name]
+
+
+def migrate(source, target, categories=None):
+    """ Copy all values from one backend into another
+
+        :param StorageBackend source: Backend to read from
+        :param StorageBackend target: Backend to write to
+        :param list categories: Only copy these categories (defaults to all)
+        :returns: Number of copied values
+    """
+    cnt = 0
+    for category in categories or source.categories():
+        for key, value in source.items(category):
+            target.set(category, key, value)
+            cnt += 1
+    target.flush()
+    return cnt
+
+
+def migrate_meta(backend, categories=None):
+    """ Move the state and latest event that older versions stored
+        among a bot's values (keys ``__state__`` and
+        ``__last_event__``) into :data:`metaCategory`
+
+        :param StorageBackend backend: Backend to migrate in place
+        :param list categories: Only migrate these categories (defaults
+            to all)
+        :returns: Number of migrated categories
+    """
+    codec = Codec()
+    cnt = 0
+    for category in categories or backend.categories():
+        if category == metaCategory:
+            continue
+        state = backend.get(category, "__state__")
+        last_event = backend.get(category, "__last_event__")
+        if state is None and last_event is None:
+            continue
+        meta = backend.get(metaCategory, category)
+        meta = codec.decode(meta) if meta is not None else {}
+        if meta.get("state") is None and state is not None:
+            meta["state"] = codec.decode(state)
+        if meta.get("last_event") is None and last_event is not None:
+            meta["last_event"] = codec.decode(last_event)
+        backend.set(metaCategory, category, codec.encode(meta))
+        backend.delete(category, "__state__")
+        backend.delete(category, "__last_event__")
+        cnt += 1
+    backend.flush()
+    return cnt
+
+
+def snapshot(keys=(), filename=None):
+    """ Read the content of the sqlite database from a consistent
+        snapshot, without blocking a running writer
+
+        A separate read-only connection reads everything in a single
+        query, which in write-ahead-log mode sees exactly the
+        transactions committed before it started.
+
+        :param list keys: Keys whose (encoded) values are returned
+        :param str filename: Use a different sqlite file
+        :returns: ``{category: {"keys": n, "bytes": n, "values":
+            {key: value}}}``
+    """
+    filename = filename or sqlDataBaseFile
+    if not os.path.isfile(filename):
+        return dict()
+    keys = list(keys)
+    connection = sqlite3.connect(
+        "file:%s?mode=ro" % filename, uri=True, timeout=30)
+    try:
+        rows = connection.execute(
+            "SELECT category, key, length(value), "
+            "CASE WHEN key IN (%s) THEN value END FROM config" % (
+                ", ".join("?" * len(keys)) or "NULL"),
+            keys
+        ).fetchall()
+    finally:
+        connection.close()
+    return _summarize(rows)
+
+
+def dbm_snapshot(keys=(), filename=None):
+    """ Like :func:`snapshot` for the :class:`DBMBackend` database
+
+        :returns: ``None`` if the database is locked by a running
+            writer, an empty dictionary if it does not exist
+    """
+    filename = filename or os.path.join(data_dir, dbmDatabase)
+    keys = set(keys)
+    if dbm.whichdb(filename) is None:
+        # Nothing has been stored yet
+        return dict()
+    try:
+        db = dbm.open(filename, "r")
+    except dbm.error:
+        return None
+    rows = []
+    try:
+        for k in db.keys():
+            category, key = k.decode("utf-8").split(DBMBackend.separator, 1)
+            value = db[k]
+            rows.append((category, key, len(value), value if key in keys else None))
+    finally:
+        db.close()
+    return _summarize(rows)
+
+
+def _summarize(rows):
+    categories = dict()
+    for category, key, size, value in rows:
+        c = categories.setdefault(category, {"keys": 0, "bytes": 0, "values": {}})
+        c["keys"] += 1
+        c["bytes"] += size or 0
+        if value is not None:
+            c["values"][key] = value
+    return categories
+
+
 class Storage(dict):
     """ Storage class
 
         :param string category: The category to distinguish
                                 different storage namespaces
+        :param StorageBackend backend: Backend to store the data in
+                                       (defaults to sqlite)
+        :param stakemachine.codec.Codec codec: Codec to serialize values
+
+        Values are cached per key in a cache that all instances of the
+        same category and backend share (see
+        :meth:`StorageBackend.cache`), so repeated reads do not hit the
+        backend and writes through any instance are seen by all of
+        them. Values are decoded once, on the first read after they
+        have been loaded or written. Immutable values are returned from
+        the cache as they are, all others as shallow copies, whose
+        nested values must not be modified.
     """
-    def __init__(self, category):
+    def __init__(self, category, backend=None, codec=None):
         self.category = category
+        self.backend = backend or get_backend()
+        self.codec = codec or Codec()
+        self._cache = self.backend.cache(category)
 
     def __setitem__(self, key, value):
-        value = json.dumps(value)
-        e = session.query(Config).filter_by(
-            category=self.category,
-            key=key
-        ).first()
-        if e:
-            e.value = value
-        else:
-            e = Config(self.category, key, value)
-            session.add(e)
-        session.commit()
+        data = self.codec.encode(value)
+        with self._cache.lock:
+            self.backend.set(self.category, key, data)
+            # Mutable values are decoded on the next read, so that the
+            # caller's later changes to ``value`` do not reach the cache
+            self._cache[key] = (data, value if type(value) in IMMUTABLE else _decode)
 
     def __getitem__(self, key):
-        e = session.query(Config).filter_by(
-            category=self.category,
-            key=key
-        ).first()
-        if not e:
-            return None
-        else:
-            return json.loads(e.value)
+        with self._cache.lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                data = self.backend.get(self.category, key)
+                if data is None:
+                    return None
+                entry = (data, _decode)
+            data, value = entry
+            if value is _decode:
+                value = self.codec.decode(data)
+                self._cache[key] = (data, value)
+        if type(value) in IMMUTABLE:
+            return value
+        return copy.copy(value)
 
     def __delitem__(self, key):
-        e = session.query(Config).filter_by(
-            category=self.category,
-            key=key
-        ).first()
-        session.delete(e)
-        session.commit()
+        with self._cache.lock:
+            self.backend.delete(self.category, key)
+            self._cache.pop(key, None)
 
     def __contains__(self, key):
-        e = session.query(Config).filter_by(
-            category=self.category,
-            key=key
-        ).first()
-        return bool(e)
+        return key in self._cache or self.backend.contains(self.category, key)
+
+    def clear_cache(self):
+        """ Forget all cached values of the category
+        """
+        self._cache.clear()
 
     def items(self):
-        es = session.query(Config).filter_by(
-            category=self.category
-        ).all()
-        return [(e.key, e.value) for e in es]
+        return [
+            (key, self.codec.decode(value))
+            for key, value in self.backend.items(self.category)
+        ]
 
 
 # Derive sqlite file directory
@@ -101,11 +653,10 @@ sqlDataBaseFile = os.path.join(data_dir, storageDatabase)
 mkdir_p(data_dir)
 
 # Obtain engine and session
-engine = create_engine('sqlite:///%s' % sqlDataBaseFile, echo=False)
-Session = sessionmaker(bind=engine)
-session = Session()
+engine = create_sqlite_engine(sqlDataBaseFile)
+Session = scoped_session(sessionmaker(bind=engine))
+session = Session
 Base.metadata.create_all(engine)
-session.commit()
 
 if __name__ == "__main__":
     storage = Storage("test")
@@ -69,14 +69,16 @@ class Echo(BaseStrategy):
     def print_newBlock(self, i):
         """ Is called when a block is received
 
-            :param str i: The hash of the block
-
-            .. note:: Unfortunately, it is currently not possible to
-                      identify the block number for ``i`` alone. If you
-                      need to know the most recent block number, you
-                      need to use ``bitshares.blockchain.Blockchain``
+            :param stakemachine.block.BlockContext i: The block. This
+                is the hash of the block that additionally provides
+                ``i.num``, ``i.time``, ``i.witness`` and
+                ``i.operations``.
+
+            .. note:: Only ``i.num`` is available without an API call.
+                      The block is fetched once on first access of any
+                      other field and shared by all bots.
         """
-        print("new block:     %s" % i)
+        print("new block:     %s (#%d)" % (i, i.num))
         # raise ValueError("Testing disabling")
 
     def print_accountUpdate(self, i):
@@ -0,0 +1,242 @@
+import numpy as np
+from pprint import pprint
+from collections import Counter
+from bitshares.asset import Asset
+from stakemachine.basestrategy import BaseStrategy
+import logging
+log = logging.getLogger(__name__)
+
+
+class PortfolioWalls(BaseStrategy):
+    """ Buy and sell walls around the price feed in many markets, run
+        by a single bot
+
+        Reference prices, targets and the capital of all markets are
+        computed in one vectorised pass. The capital of each asset
+        (free balance plus the amounts in the bot's own orders) is
+        split across the markets that trade it according to their
+        ``weights``. All order changes of a pass are bundled into as
+        few transactions as possible (at most ``max_ops`` operations
+        each).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Define Callbacks
+        self.ontick += self.tick
+        self.onFill += self.filled
+
+        self.error_ontick = self.error
+        self.error_onAccount = self.error
+
+        # Orders of all markets are bundled
+        self.bundle = True
+
+        target = self.bot.get("target", {})
+        self.offsets = target.get("offsets", {"buy": 0, "sell": 0})
+        self.capital = target.get("capital", {"buy": 50, "sell": 50})
+        self.max_amounts = target.get("amount", {})
+        self.threshold = self.bot.get("threshold", 0) / 100.0
+        self.max_ops = self.bot.get("max_ops", 50)
+        self.test_blocks = self.bot.get("test", {}).get("blocks", 10)
+
+        self.names = [m.get_string() for m in self.markets]
+        weights = self.bot.get("weights", {})
+        self.weights = np.array([float(weights.get(n, 1)) for n in self.names])
+
+        # Assets of the markets
+        self.base_ids = [m["base"]["id"] for m in self.markets]
+        self.quote_ids = [m["quote"]["id"] for m in self.markets]
+        self.base_precision = np.array([m["base"]["precision"] for m in self.markets])
+        self.quote_precision = np.array([m["quote"]["precision"] for m in self.markets])
+        self.index = {
+            frozenset([b, q]): i
+            for i, (b, q) in enumerate(zip(self.base_ids, self.quote_ids))
+        }
+
+        # The price feeds of the quote assets are fetched in one call
+        self.bitasset_ids = []
+        for m in self.markets:
+            asset = Asset(m["quote"]["id"], bitshares_instance=self.bitshares)
+            if not asset.get("bitasset_data_id"):
+                raise ValueError("%s has no price feed" % m["quote"]["symbol"])
+            self.bitasset_ids.append(asset["bitasset_data_id"])
+
+        # Counter for blocks and markets to update after fills
+        self.counter = Counter()
+        self.dirty = set()
+
+    def error(self, *args, **kwargs):
+        self.disabled = True
+        self.cancelall()
+        pprint(self.execute())
+
+    def feed_prices(self):
+        """ Return the feed prices (``base``/``quote``) of all markets
+
+            Markets whose feed is not denominated in their base asset
+            get ``nan``.
+        """
+        feeds = self.bitshares.rpc.get_objects(self.bitasset_ids)
+        prices = np.full(len(self.markets), np.nan)
+        feed_base = np.zeros(len(self.markets))
+        feed_quote = np.zeros(len(self.markets))
+        for i, feed in enumerate(feeds):
+            sp = feed["current_feed"]["settlement_price"]
+            if (
+                sp["base"]["asset_id"] == self.quote_ids[i] and
+                sp["quote"]["asset_id"] == self.base_ids[i]
+            ):
+                feed_base[i] = int(sp["base"]["amount"])
+                feed_quote[i] = int(sp["quote"]["amount"])
+        valid = (feed_base > 0) & (feed_quote > 0)
+        prices[valid] = (
+            (feed_quote[valid] / 10.0 ** self.base_precision[valid]) /
+            (feed_base[valid] / 10.0 ** self.quote_precision[valid])
+        )
+        return prices
+
+    def own_orders(self):
+        """ Return the bot's orders as ``(id, asset_id, for_sale)``
+            tuples per market
+        """
+        orders = [[] for _ in self.markets]
+        if self.paper:
+            for i, market in enumerate(self.markets):
+                for o in self.paper.open_orders(self.account, market):
+                    orders[i].append((o["id"], o["base"]["asset"]["id"], float(o["base"])))
+        else:
+            for order_id, o in list(self.registry.orders.items()):
+                i = self.index.get(frozenset([o["asset_id"], o.get("receive_id")]))
+                if i is not None:
+                    orders[i].append((order_id, o["asset_id"], o["for_sale"]))
+        return orders
+
+    def split(self, asset_ids, capital, percent):
+        """ Split the capital of each asset across the markets that use
+            it according to their weights
+        """
+        keys, groups = np.unique(asset_ids, return_inverse=True)
+        total_weights = np.bincount(groups, weights=self.weights)
+        amounts = np.array([capital.get(k, 0.0) for k in keys])
+        return amounts[groups] * percent / 100.0 * self.weights / total_weights[groups]
+
+    def targets(self, free, orders):
+        """ Compute prices and amounts of the walls of all markets
+
+            :param collections.Counter free: Free balances by asset id
+            :param list orders: The bot's orders (see :meth:`own_orders`)
+            :returns: ``(prices, buy_prices, buy_amounts, sell_prices,
+                sell_amounts)`` as arrays, amounts in ``quote``
+        """
+        prices = self.feed_prices()
+        buy_prices = prices * (1 - self.offsets["buy"] / 100.0)
+        sell_prices = prices * (1 + self.offsets["sell"] / 100.0)
+
+        # Capital is what is free plus what is in our own orders
+        capital = Counter(free)
+        for market_orders in orders:
+            for _, asset_id, for_sale in market_orders:
+                capital[asset_id] += for_sale
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            buy_amounts = self.split(self.base_ids, capital, self.capital["buy"]) / buy_prices
+        sell_amounts = self.split(self.quote_ids, capital, self.capital["sell"])
+
+        if "buy" in self.max_amounts:
+            buy_amounts = np.minimum(buy_amounts, self.max_amounts["buy"])
+        if "sell" in self.max_amounts:
+            sell_amounts = np.minimum(sell_amounts, self.max_amounts["sell"])
+
+        # Amounts below the precision of the quote asset cannot be placed
+        smallest = 10.0 ** -self.quote_precision
+        buy_amounts[~(buy_amounts >= smallest)] = 0
+        sell_amounts[~(sell_amounts >= smallest)] = 0
+        return prices, buy_prices, buy_amounts, sell_prices, sell_amounts
+
+    def outdated(self, prices, buy_amounts, sell_amounts, orders):
+        """ Return a mask of the markets whose walls need to be replaced
+        """
+        stored = self["feed_prices"] or {}
+        previous = np.array([stored.get(n, np.nan) for n in self.names])
+        counts = np.array([len(o) for o in orders])
+        expected = (buy_amounts > 0).astype(int) + (sell_amounts > 0).astype(int)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            moved = np.abs(1 - prices / previous) > self.threshold
+        dirty = np.zeros(len(self.markets), dtype=bool)
+        dirty[list(self.dirty)] = True
+        return ~np.isnan(prices) & (
+            np.isnan(previous) | moved | (counts < expected) | dirty
+        )
+
+    def updateorders(self):
+        """ Replace the walls of all markets that are outdated
+        """
+        free = Counter()
+        for b in self.balances:
+            free[b["asset"]["id"]] += float(b)
+        orders = self.own_orders()
+        prices, buy_prices, buy_amounts, sell_prices, sell_amounts = self.targets(free, orders)
+        outdated = np.flatnonzero(self.outdated(prices, buy_amounts, sell_amounts, orders))
+        self.dirty.clear()
+        if not len(outdated):
+            return
+        log.info("Replacing orders in {} of {} markets".format(
+            len(outdated), len(self.markets)))
+
+        # Funds of cancelled orders are available for the new orders.
+        # Never spend more than that, one failing operation would void
+        # the whole transaction.
+        budget = Counter(free)
+        for i in outdated:
+            for _, asset_id, for_sale in orders[i]:
+                budget[asset_id] += for_sale
+
+        stored = dict(self["feed_prices"] or {})
+        ops = 0
+        for i in outdated:
+            ids = [order_id for order_id, _, _ in orders[i]]
+            buy = min(buy_amounts[i], budget[self.base_ids[i]] / buy_prices[i])
+            sell = min(sell_amounts[i], budget[self.quote_ids[i]])
+            if buy < buy_amounts[i] or sell < sell_amounts[i]:
+                log.warning("Insufficient funds for the walls in %s" % self.names[i])
+            smallest = 10.0 ** -self.quote_precision[i]
+            buy = buy if buy >= smallest else 0
+            sell = sell if sell >= smallest else 0
+            needed = len(ids) + int(buy > 0) + int(sell > 0)
+            if ops and ops + needed > self.max_ops:
+                pprint(self.execute())
+                ops = 0
+
+            if ids:
+                self.cancel(ids)
+            market = self.markets[i]
+            if buy > 0:
+                market.buy(float(buy_prices[i]), float(buy), account=self.account)
+                budget[self.base_ids[i]] -= buy * buy_prices[i]
+            if sell > 0:
+                market.sell(float(sell_prices[i]), float(sell), account=self.account)
+                budget[self.quote_ids[i]] -= sell
+            ops += needed
+            stored[self.names[i]] = float(prices[i])
+
+        if ops:
+            pprint(self.execute())
+
+        # Store the prices of all markets in a single value
+        self["feed_prices"] = stored
+
+    def filled(self, fill):
+        """ Replace the walls of a market with the next block after one
+            of its orders has been filled
+        """
+        key = frozenset([fill["base"]["asset"]["id"], fill["quote"]["asset"]["id"]])
+        if key in self.index:
+            self.dirty.add(self.index[key])
+
+    def tick(self, d):
+        """ ticks come in on every block
+        """
+        if self.dirty or not self.counter["blocks"]:
+            self.updateorders()
+        self.counter["blocks"] = (self.counter["blocks"] + 1) % max(self.test_blocks, 1)
@@ -1,3 +1,4 @@
+import time
 from math import fabs
 from pprint import pprint
 from collections import Counter
@@ -9,13 +10,33 @@ log = logging.getLogger(__name__)
 
 
 class Walls(BaseStrategy):
+    """ Buy and sell walls around the price feed
+
+        The walls are replaced (re-quoted) if one of them is missing or
+        if the feed has moved by more than ``threshold`` percent. To
+        avoid cancel/replace storms on volatile feeds
+
+        * a re-quote stays pending until it is sent, a re-quote because
+          of the feed also until the feed returns to within
+          ``requote.reset`` percent of the walls' price (hysteresis),
+        * re-quotes are at least ``requote.interval`` seconds apart,
+        * at most one re-quote is sent per block (see
+          :meth:`stakemachine.basestrategy.BaseStrategy.head_block`) and
+        * the orders are not even looked at while re-quoting is held
+          back; they are tested again on the next block after that.
+
+        Re-quotes sent and suppressed are counted in ``requotes`` (and
+        stored under the same key).
+    """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         # Define Callbacks
         self.onMarketUpdate += self.test
         self.ontick += self.tick
-        self.onAccount += self.test
+        # Only react to account operations that affect our walls
+        self.onFill += self.test
+        self.onOrderCancelled += self.test
 
         self.error_ontick = self.error
         self.error_onMarketUpdate = self.error
@@ -27,6 +48,16 @@ class Walls(BaseStrategy):
         # Tests for actions
         self.test_blocks = self.bot.get("test", {}).get("blocks", 0)
 
+        # Re-quoting
+        requote = self.bot.get("requote", {})
+        self.requote_interval = requote.get("interval", 0)
+        self.threshold = self.bot["threshold"] / 100.0
+        self.reset = min(requote.get("reset", self.bot["threshold"]) / 100.0, self.threshold)
+        self.pending = False
+        self.recheck = False
+        self.requotes = Counter(self["requotes"] or {})
+        self._requotes_changed = False
+
     def error(self, *args, **kwargs):
         self.disabled = True
         self.cancelall()
@@ -49,7 +80,7 @@ class Walls(BaseStrategy):
         sell_price = price * (1 + target["offsets"]["sell"] / 100)
 
         # Store price in storage for later use
-        self["feed_price"] = float(price)
+        self["feed_price"] = price
 
         # Buy Side
         if float(self.balance(self.market["base"])) < buy_price * target["amount"]["buy"]:
@@ -92,14 +123,46 @@ class Walls(BaseStrategy):
     def tick(self, d):
         """ ticks come in on every block
         """
+        test = self.pending or self.recheck
         if self.test_blocks:
             if not (self.counter["blocks"] or 0) % self.test_blocks:
-                self.test()
-            self.counter["blocks"] += 1
+                test = True
+            # Wrap around so that the counter stays bounded
+            self.counter["blocks"] = (self.counter["blocks"] + 1) % self.test_blocks
+        if test:
+            self.test()
+
+        # Store the counters at most once per block
+        if self._requotes_changed:
+            self["requotes"] = dict(self.requotes)
+            self._requotes_changed = False
+
+    def count(self, key):
+        self.requotes[key] += 1
+        self._requotes_changed = True
+
+    def debounced(self):
+        """ Is it too soon for another re-quote?
+
+            :returns: The reason (``block`` or ``interval``) or ``None``
+        """
+        last = self["last_requote"] or {}
+        if self.requote_interval and time.time() - last.get("time", 0) < self.requote_interval:
+            return "interval"
+        if last.get("block") is not None and last["block"] == self.head_block():
+            return "block"
+        return None
 
     def test(self, *args, **kwargs):
         """ Tests if the orders need updating
         """
+        # Nothing could be done about it now, so do not load the orders
+        reason = self.debounced()
+        if reason:
+            self.count(reason)
+            self.recheck = True
+            return
+        self.recheck = False
         orders = self.orders
 
         # Test if still 2 orders in the market (the walls)
@@ -109,14 +172,37 @@ class Walls(BaseStrategy):
                 not self["insufficient_sell"]
             ):
                 log.info("No 2 orders available. Updating orders!")
-                self.updateorders()
+                return self.requote()
         elif len(orders) == 0:
-            self.updateorders()
-
-        # Test if price feed has moved more than the threshold
-        if (
-            self["feed_price"] and
-            fabs(1 - float(self.getprice()) / self["feed_price"]) > self.bot["threshold"] / 100.0
-        ):
-            log.info("Price feed moved by more than the threshold. Updating orders!")
-            self.updateorders()
+            return self.requote()
+
+        # Test if price feed has moved more than the threshold, and
+        # whether a pending re-quote is still needed
+        if self["feed_price"]:
+            moved = fabs(1 - float(self.getprice()) / float(self["feed_price"]))
+            if moved > self.threshold:
+                if not self.pending:
+                    log.info("Price feed moved by more than the threshold. Updating orders!")
+                self.pending = True
+            elif self.pending and moved <= self.reset:
+                log.info("Price feed is back within the reset threshold")
+                self.pending = False
+                self.count("reset")
+        if self.pending:
+            self.requote()
+
+    def requote(self):
+        """ Replace the walls unless this is too soon after the last
+            re-quote
+        """
+        reason = self.debounced()
+        if reason:
+            log.debug("Re-quote held back (%s)" % reason)
+            self.count(reason)
+            # Try again on a later block
+            self.pending = True
+            return
+        self.updateorders()
+        self.pending = False
+        self["last_requote"] = {"time": time.time(), "block": self.head_block()}
+        self.count("sent")
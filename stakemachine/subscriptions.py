@@ -0,0 +1,226 @@
+import time
+import logging
+from bitshares.market import Market
+from bitshares.account import Account
+from bitshares.instance import shared_bitshares_instance
+from .basestrategy import MARKET_EVENTS, ACCOUNT_EVENTS
+log = logging.getLogger(__name__)
+
+
+def renew_subscriptions(notify, accounts, markets, market_ids):
+    """ Change the accounts and markets a
+        :class:`bitshares.notify.Notify` instance is subscribed to
+
+        Newer versions of python-bitshares provide
+        ``Notify.reset_subscriptions()``. For older versions (0.1.x)
+        this is the only place that relies on the internals of
+        :class:`bitsharesapi.websocket.BitSharesWebsocket`.
+
+        :param list accounts: Account names
+        :param list markets: Market names
+        :param list market_ids: ``[base_id, quote_id]`` of the markets
+    """
+    if hasattr(notify, "reset_subscriptions"):
+        notify.reset_subscriptions(accounts, markets)
+        return
+
+    ws = notify.websocket
+    if not all(hasattr(ws, a) for a in (
+        "subscription_accounts", "subscription_markets", "__events__"
+    )):
+        raise RuntimeError(
+            "Unsupported version of python-bitshares: cannot change subscriptions")
+    ws.subscription_accounts = list(accounts)
+    ws.subscription_markets = list(market_ids)
+
+    # If we are not connected yet, on_open() subscribes for us
+    if not (ws.ws and ws.ws.sock and ws.ws.sock.connected):
+        return
+
+    ws.cancel_all_subscriptions()
+    if len(ws.on_object) or ws.subscription_accounts:
+        ws.set_subscribe_callback(ws.__events__.index('on_object'), False)
+    if len(ws.on_tx):
+        ws.set_pending_transaction_callback(ws.__events__.index('on_tx'))
+    if len(ws.on_block):
+        ws.set_block_applied_callback(ws.__events__.index('on_block'))
+    if ws.subscription_accounts:
+        ws.get_full_accounts(ws.subscription_accounts, True)
+    for market in ws.subscription_markets:
+        ws.subscribe_to_market(
+            ws.__events__.index('on_market'),
+            market[0], market[1])
+
+
+class SubscriptionManager():
+    """ Keeps the subscriptions of a :class:`bitshares.notify.Notify`
+        instance in line with the bots that are currently enabled.
+
+        Markets and accounts are only subscribed to as long as at least
+        one enabled bot is interested in their events. Once a bot is
+        re-enabled, its market and account are subscribed to again.
+
+        :param bitshares.notify.Notify notify: Notification instance
+        :param dict bots: Bot instances indexed by their name
+        :param dict config: The stakemachine configuration
+        :param bool all_markets: Subscribe to the markets of all enabled
+            bots, even if they are not interested in market events
+        :param bitshares.bitshares.BitShares bitshares_instance: BitShares instance
+        :param int log_interval: Seconds between two log lines about
+            the same bot being disabled
+    """
+    #: Fields of operations that refer to accounts
+    account_fields = [
+        "seller", "fee_paying_account", "from", "to",
+        "account_id", "funding_account", "account",
+    ]
+    #: Fields of operations that hold the amounts traded
+    amount_fields = [
+        "amount_to_sell", "min_to_receive", "pays", "receives",
+    ]
+
+    def __init__(
+        self,
+        notify,
+        bots,
+        config,
+        all_markets=False,
+        bitshares_instance=None,
+        log_interval=60,
+    ):
+        self.bitshares = bitshares_instance or shared_bitshares_instance()
+        self.log_interval = log_interval
+        self._last_logged = dict()
+        self.notify = notify
+        self.bots = bots
+        self.config = config
+        self.all_markets = all_markets
+
+        self.markets = set()
+        self.accounts = set()
+        self.market_index = dict()
+        self.account_index = dict()
+        self.account_id_index = dict()
+        self.account_ids = set()
+
+        self._enabled = None
+        self._market_ids = dict()
+        self._account_ids = dict()
+
+    def market_key(self, market):
+        """ Return the key used to identify a market independent of
+            its orientation
+
+            :param market: Market name (e.g. ``GOLD:TEST``) or an
+                object that carries ``base`` and ``quote`` amounts
+                (e.g. :class:`bitshares.price.Order`)
+        """
+        if isinstance(market, str):
+            return frozenset(self._market_ids[market])
+        return frozenset([
+            market["base"]["asset"]["id"],
+            market["quote"]["asset"]["id"]
+        ])
+
+    def log_disabled(self, botname):
+        """ Log that a bot has been disabled, but only once every
+            ``log_interval`` seconds
+        """
+        now = time.time()
+        if now - self._last_logged.get(botname, 0) >= self.log_interval:
+            self._last_logged[botname] = now
+            log.warning("The bot %s has been disabled" % botname)
+
+    def update(self, force=False):
+        """ Recompute the set of subscribed markets and accounts from
+            the enabled bots and resubscribe if it has changed
+
+            :param bool force: Recompute even if the same bots are
+                enabled (e.g. after bots have been replaced)
+        """
+        enabled = frozenset(
+            name for name, bot in self.bots.items() if not bot.disabled
+        )
+        if enabled == self._enabled and not force:
+            return
+        for botname in sorted((self._enabled or frozenset()) - enabled):
+            self.log_disabled(botname)
+        self._enabled = enabled
+
+        markets = set()
+        accounts = set()
+        market_index = dict()
+        account_index = dict()
+        for botname in sorted(enabled):
+            bot = self.config["bots"][botname]
+            if self.all_markets or self.bots[botname].wants(MARKET_EVENTS):
+                for market in bot.get("markets") or [bot["market"]]:
+                    if market not in self._market_ids:
+                        m = Market(market, bitshares_instance=self.bitshares)
+                        self._market_ids[market] = [m["base"]["id"], m["quote"]["id"]]
+                    markets.add(market)
+                    market_index.setdefault(self.market_key(market), []).append(botname)
+            if self.bots[botname].wants(ACCOUNT_EVENTS):
+                account = bot["account"]
+                if account not in self._account_ids:
+                    self._account_ids[account] = Account(
+                        account, bitshares_instance=self.bitshares)["id"]
+                accounts.add(account)
+                account_index.setdefault(account, []).append(botname)
+
+        self.market_index = {k: tuple(v) for k, v in market_index.items()}
+        self.account_index = {k: tuple(v) for k, v in account_index.items()}
+        self.account_id_index = {
+            self._account_ids[k]: v for k, v in self.account_index.items()
+        }
+        self.account_ids = set(self.account_id_index)
+
+        if markets != self.markets or accounts != self.accounts:
+            log.info(
+                "Subscribing to markets {} and accounts {}".format(
+                    sorted(markets), sorted(accounts)))
+            self.markets = markets
+            self.accounts = accounts
+            self.resubscribe()
+
+    def resubscribe(self):
+        """ Hand the current set of markets and accounts to the
+            websocket (see :func:`renew_subscriptions`)
+        """
+        markets = sorted(self.markets)
+        renew_subscriptions(
+            self.notify,
+            sorted(self.accounts),
+            markets,
+            [self._market_ids[m] for m in markets]
+        )
+
+    def market_bots(self, data):
+        """ Return the names of the enabled bots that trade in the
+            market of ``data``
+        """
+        return self.market_index.get(self.market_key(data), ())
+
+    def account_bots(self, account):
+        """ Return the names of the enabled bots that use ``account``
+        """
+        return self.account_index.get(account, ())
+
+    def account_id_bots(self, account_id):
+        """ Return the names of the enabled bots that use the account
+            with id ``account_id``
+        """
+        return self.account_id_index.get(account_id, ())
+
+    def is_relevant(self, op_id, op):
+        """ Test whether an operation concerns one of the subscribed
+            accounts or markets
+        """
+        for field in self.account_fields:
+            if op.get(field) in self.account_ids:
+                return True
+        assets = set(
+            op[field]["asset_id"] for field in self.amount_fields
+            if field in op
+        )
+        return len(assets) == 2 and frozenset(assets) in self.market_index
@@ -0,0 +1,230 @@
+import os
+import json
+from time import time as now
+import numpy as np
+from .storage import data_dir, mkdir_p
+
+# For the time series directory
+timeseriesDirectory = "timeseries"
+
+
+class TimeSeries():
+    """ Append-only column store for numerical time series
+
+        Every sample carries the block number and the time at which it
+        has been taken plus an arbitrary number of ``float`` columns.
+        Each column is stored in its own memory-mapped NumPy array so
+        that reading ranges or millions of samples does not touch
+        SQLite at all.
+
+        :param str category: The category (bot name) the series belongs to
+        :param str name: The name of the series (e.g. ``feed``)
+        :param list columns: Names of the value columns
+        :param int chunk: Number of samples the files grow by
+        :param str path: Directory to store the series in (defaults to
+            the user's data directory)
+
+        .. code-block:: python
+
+            series = TimeSeries("Walls", "feed", columns=["price"])
+            series.append(24000000, price=0.31)
+            series.timerange(time.time() - 3600)["price"].mean()
+
+        .. note:: Samples need to be appended with non-decreasing block
+                  numbers and times as ranges are looked up by bisection.
+                  :meth:`extend` raises ``ValueError`` otherwise.
+    """
+
+    index_columns = [("block", np.int64), ("time", np.float64)]
+
+    def __init__(
+        self,
+        category,
+        name,
+        columns=("value",),
+        chunk=2 ** 16,
+        path=None
+    ):
+        self.category = category
+        self.name = name
+        self.chunk = chunk
+        self.path = path or os.path.join(
+            data_dir, timeseriesDirectory, category, name)
+        mkdir_p(self.path)
+
+        # The column layout is fixed once the series has been created
+        metafile = os.path.join(self.path, "meta.json")
+        if os.path.isfile(metafile):
+            with open(metafile) as fp:
+                columns = json.load(fp)["columns"]
+        else:
+            with open(metafile, "w") as fp:
+                json.dump({"columns": list(columns)}, fp)
+        self.columns = list(columns)
+        self.dtypes = dict(self.index_columns)
+        self.dtypes.update({c: np.float64 for c in self.columns})
+
+        # The number of valid samples lives in its own tiny memmap so
+        # that appending never requires rewriting metadata
+        self._length = self._memmap("_length", np.int64, 1)
+        self._open(max(self.chunk, int(self._length[0])))
+
+    def _memmap(self, column, dtype, size):
+        filename = os.path.join(self.path, "%s.bin" % column)
+        nbytes = size * np.dtype(dtype).itemsize
+        with open(filename, "ab") as fp:
+            if fp.tell() < nbytes:
+                fp.truncate(nbytes)
+        return np.memmap(filename, dtype=dtype, mode="r+", shape=(size,))
+
+    def _open(self, capacity):
+        self.capacity = capacity
+        self._data = {
+            column: self._memmap(column, dtype, capacity)
+            for column, dtype in self.dtypes.items()
+        }
+
+    def _reserve(self, size):
+        if size <= self.capacity:
+            return
+        self.flush()
+        capacity = self.capacity
+        while capacity < size:
+            capacity += max(self.chunk, capacity // 2)
+        self._open(capacity)
+
+    def __len__(self):
+        return int(self._length[0])
+
+    def append(self, block, time=None, **values):
+        """ Append a single sample
+
+            :param int block: Block number of the sample
+            :param float time: Unix timestamp (defaults to now)
+            :param values: Values of the columns, missing ones are
+                stored as ``nan``
+        """
+        self.extend(
+            [block],
+            [time if time is not None else now()],
+            **{k: [v] for k, v in values.items()}
+        )
+
+    def extend(self, blocks, times, **columns):
+        """ Append many samples at once
+
+            :param list blocks: Block numbers
+            :param list times: Unix timestamps
+            :param columns: Sequences of values for each column
+        """
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError("Unknown columns: %s" % ", ".join(sorted(unknown)))
+        blocks = np.asarray(blocks, dtype=np.int64)
+        times = np.asarray(times, dtype=np.float64)
+        n = len(blocks)
+        if not n:
+            return
+        if len(times) != n:
+            raise ValueError("Need one time per block")
+        start = len(self)
+        for key, values in (("block", blocks), ("time", times)):
+            if start:
+                values = np.concatenate([self._data[key][start - 1:start], values])
+            if np.any(np.diff(values) < 0):
+                raise ValueError("Samples need to be appended in %s order" % key)
+        self._reserve(start + n)
+        self._data["block"][start:start + n] = blocks
+        self._data["time"][start:start + n] = times
+        for column in self.columns:
+            self._data[column][start:start + n] = columns.get(column, np.nan)
+        self._length[0] = start + n
+
+    def flush(self):
+        """ Write pending changes to disk
+        """
+        for m in self._data.values():
+            m.flush()
+        self._length.flush()
+
+    def column(self, name):
+        """ Return a read-only view on all samples of a column
+        """
+        view = self._data[name][:len(self)]
+        view.flags.writeable = False
+        return view
+
+    def _slice(self, start, stop):
+        return {
+            column: self.column(column)[start:stop]
+            for column in self.dtypes
+        }
+
+    def range(self, start=None, stop=None):
+        """ Return all samples with ``start <= block < stop`` as a
+            dictionary of column arrays
+        """
+        return self._between("block", start, stop)
+
+    def timerange(self, start=None, stop=None):
+        """ Return all samples with ``start <= time < stop`` as a
+            dictionary of column arrays
+        """
+        return self._between("time", start, stop)
+
+    def last(self, n=1):
+        """ Return the ``n`` most recent samples
+        """
+        length = len(self)
+        return self._slice(max(length - n, 0), length)
+
+    def _between(self, key, start, stop):
+        index = self.column(key)
+        a = 0 if start is None else int(np.searchsorted(index, start, "left"))
+        b = len(index) if stop is None else int(np.searchsorted(index, stop, "left"))
+        return self._slice(a, b)
+
+    def downsample(self, step, by="block", how="mean", start=None, stop=None):
+        """ Aggregate samples into buckets of width ``step``
+
+            :param step: Bucket width in blocks or seconds
+            :param str by: Either ``block`` or ``time``
+            :param str how: One of ``mean``, ``sum``, ``min``, ``max``,
+                ``first``, ``last``
+            :returns: dictionary of column arrays with one row per
+                non-empty bucket; ``block``/``time`` hold the bucket start
+                (a multiple of ``step``, e.g. full hours for
+                ``step=3600, by="time"``)
+        """
+        data = self._between(by, start, stop)
+        index = data[by]
+        if not len(index):
+            return data
+        buckets = index // step
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        ends = np.append(starts[1:], len(index)) - 1
+        counts = np.diff(np.append(starts, len(index)))
+
+        ret = {
+            by: buckets[starts] * step,
+            "count": counts,
+        }
+        other = "time" if by == "block" else "block"
+        ret[other] = data[other][starts]
+        for column in self.columns:
+            values = data[column]
+            if how == "mean":
+                ret[column] = np.add.reduceat(values, starts) / counts
+            elif how == "sum":
+                ret[column] = np.add.reduceat(values, starts)
+            elif how == "min":
+                ret[column] = np.minimum.reduceat(values, starts)
+            elif how == "max":
+                ret[column] = np.maximum.reduceat(values, starts)
+            elif how == "first":
+                ret[column] = values[starts]
+            elif how == "last":
+                ret[column] = values[ends]
+            else:
+                raise ValueError("Unknown aggregation '%s'" % how)
+        return ret
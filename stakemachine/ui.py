@@ -1,13 +1,15 @@
 import os
 import click
 import logging
-import yaml
 from datetime import datetime
 from bitshares.price import Price
 from prettytable import PrettyTable
 from functools import update_wrapper
 from bitshares import BitShares
 from bitshares.instance import set_shared_bitshares_instance
+from .config import load_config
+from .pool import NodePool
+from .exceptions import InvalidConfigException
 log = logging.getLogger(__name__)
 
 
@@ -53,6 +55,17 @@ def chain(f):
             ctx.config["node"],
             **ctx.obj
         )
+        # Spread the calls over all nodes if there are several
+        if isinstance(ctx.config["node"], list) and len(ctx.config["node"]) > 1:
+            rpc = ctx.bitshares.rpc
+            ctx.bitshares.rpc = NodePool(
+                ctx.config["node"],
+                user=rpc.user,
+                password=rpc.password,
+                rpc=rpc,
+                **ctx.config.get("pool", {})
+            )
+            ctx.bitshares.rpc.start()
         set_shared_bitshares_instance(ctx.bitshares)
         return ctx.invoke(f, *args, **kwargs)
     return update_wrapper(new_func, f)
@@ -79,7 +92,10 @@ def unlock(f):
 def configfile(f):
     @click.pass_context
     def new_func(ctx, *args, **kwargs):
-        ctx.config = yaml.load(open(ctx.obj["configfile"]))
+        try:
+            ctx.config = load_config(ctx.obj["configfile"])
+        except InvalidConfigException as e:
+            raise click.ClickException(str(e))
         return ctx.invoke(f, *args, **kwargs)
     return update_wrapper(new_func, f)
 
@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+import stakemachine.account as account
+from stakemachine.account import LightAccount
+from stakemachine.basestrategy import BaseStrategy
+
+
+class Order(dict):
+    def __init__(self, o, bitshares_instance=None):
+        super().__init__(o)
+
+    @property
+    def market(self):
+        return self["market"]
+
+
+ALICE = {"id": "1.2.1", "name": "alice"}
+
+
+class RPC():
+    def __init__(self, objects):
+        self.objects = dict(objects, **{ALICE["id"]: ALICE})
+        self.calls = []
+
+    def get_asset(self, asset_id):
+        # Used by ``Amount`` (not recorded, assets are cached)
+        return {
+            "id": asset_id,
+            "symbol": {"1.3.0": "BTS", "1.3.1": "GOLD"}[asset_id],
+            "precision": 5,
+            "options": {"issuer_permissions": 0, "flags": 0, "description": ""},
+        }
+
+    def lookup_account_names(self, names):
+        self.calls.append(("lookup_account_names", names))
+        return [ALICE if n == ALICE["name"] else None for n in names]
+
+    def get_objects(self, ids):
+        self.calls.append(("get_objects", ids))
+        return [self.objects.get(i) for i in ids]
+
+    def get_full_accounts(self, ids, subscribe):
+        self.calls.append(("get_full_accounts", ids))
+        orders = [o for i, o in sorted(self.objects.items()) if i.startswith("1.7.")]
+        return [[ids[0], {"account": ALICE, "limit_orders": orders}]]
+
+
+def light(objects, monkeypatch):
+    monkeypatch.setattr(account, "Order", Order)
+    bitshares = SimpleNamespace(rpc=RPC(objects))
+    a = LightAccount("alice", bitshares_instance=bitshares)
+    assert a["id"] == ALICE["id"]
+    a.bitshares = bitshares
+    a.refresh = lambda: a.bitshares.rpc.calls.append(("refresh",))
+    # Only look at the calls made by the code under test
+    bitshares.rpc.calls.clear()
+    return a
+
+
+def limit_order(order_id, seller, market):
+    return {
+        "id": order_id,
+        "seller": seller,
+        "market": market,
+        "for_sale": 150000,
+        "sell_price": {
+            "base": {"amount": 200000, "asset_id": "1.3.0"},
+            "quote": {"amount": 100000, "asset_id": "1.3.1"},
+        },
+    }
+
+
+OBJECTS = {
+    "1.7.1": limit_order("1.7.1", "1.2.1", "GOLD:BTS"),
+    "1.7.2": limit_order("1.7.2", "1.2.9", "GOLD:BTS"),
+    "1.7.3": limit_order("1.7.3", "1.2.1", "SILVER:BTS"),
+}
+
+
+def test_orders_by_id(monkeypatch):
+    a = light(OBJECTS, monkeypatch)
+    orders = a.orders(["1.7.1", "1.7.2", "1.7.4"])
+    assert [o["id"] for o in orders] == ["1.7.1"]
+    assert float(orders[0]["for_sale"]) == 1.5
+    assert orders[0]["for_sale"]["asset"]["id"] == "1.3.0"
+    assert a.bitshares.rpc.calls == [("get_objects", ["1.7.1", "1.7.2", "1.7.4"])]
+    assert a.orders([]) == []
+
+
+def market(name):
+    return SimpleNamespace(get_string=lambda: name)
+
+
+def strategy(a, ids):
+    s = SimpleNamespace(
+        paper=None,
+        account=a,
+        registry=SimpleNamespace(ids=ids),
+        _in_markets=BaseStrategy._in_markets,
+    )
+    s.chain_orders_in = lambda *m: BaseStrategy.chain_orders_in(s, *m)
+    return s
+
+
+def test_light_orders_use_the_registry(monkeypatch):
+    a = light(OBJECTS, monkeypatch)
+    s = strategy(a, ["1.7.1", "1.7.3"])
+    orders = BaseStrategy.orders_in(s, market("GOLD:BTS"))
+    assert [o["id"] for o in orders] == ["1.7.1"]
+    assert a.bitshares.rpc.calls == [("get_objects", ["1.7.1", "1.7.3"])]
+
+
+def test_light_chain_orders_do_not_refresh(monkeypatch):
+    a = light(OBJECTS, monkeypatch)
+    s = strategy(a, [])
+    orders = BaseStrategy.chain_orders_in(s, market("GOLD:BTS"), market("SILVER:BTS"))
+    assert [o["id"] for o in orders] == ["1.7.1", "1.7.2", "1.7.3"]
+    assert a.bitshares.rpc.calls == [("get_full_accounts", ["1.2.1"])]
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+import stakemachine.backfill as backfill
+from stakemachine.backfill import Backfill, LIMIT_ORDER_CREATE
+
+
+class Subscriptions():
+    def __init__(self, markets):
+        self.market_index = markets
+        self.account_index = {}
+
+
+class Infrastructure():
+    def __init__(self, markets):
+        self.subscriptions = Subscriptions(markets)
+
+
+def order_block(num):
+    op = {
+        "amount_to_sell": {"asset_id": "1.3.0", "amount": num},
+        "min_to_receive": {"asset_id": "1.3.1", "amount": 1},
+    }
+    return {"transactions": [{"operations": [[LIMIT_ORDER_CREATE, op]]}]}
+
+
+class RPC():
+    def __init__(self, block_api=True):
+        self.block_api = block_api
+        self.calls = []
+
+    def get_blocks(self, start, stop, api=None):
+        self.calls.append(("get_blocks", start, stop))
+        if not self.block_api:
+            raise Exception("no method with name 'get_blocks'")
+        return [order_block(num) for num in range(start, stop + 1)]
+
+    def get_block(self, num):
+        self.calls.append(("get_block", num))
+        return order_block(num)
+
+
+class BitShares():
+    def __init__(self, rpc):
+        self.rpc = rpc
+
+
+def make(rpc, markets=None, **kwargs):
+    if markets is None:
+        markets = {frozenset(["1.3.0", "1.3.1"]): ["bot"]}
+    return Backfill(
+        Infrastructure(markets), bitshares_instance=BitShares(rpc), **kwargs)
+
+
+def test_blocks_are_fetched_in_batches(monkeypatch):
+    monkeypatch.setattr(backfill, "Order", lambda op, **kwargs: op)
+    rpc = RPC()
+    events = make(rpc, batch=100).market_events(1, 250)
+    assert rpc.calls == [
+        ("get_blocks", 151, 250), ("get_blocks", 51, 150), ("get_blocks", 1, 50)]
+    assert sorted(e[0][0] for e in events) == list(range(1, 251))
+
+
+def test_falls_back_to_single_blocks(monkeypatch):
+    monkeypatch.setattr(backfill, "Order", lambda op, **kwargs: op)
+    rpc = RPC(block_api=False)
+    b = make(rpc, batch=2)
+    assert len(b.market_events(1, 3)) == 3
+    assert rpc.calls == [
+        ("get_blocks", 2, 3), ("get_block", 2), ("get_block", 3), ("get_block", 1)]
+
+
+def test_stops_fetching_after_max_seconds(monkeypatch):
+    monkeypatch.setattr(backfill, "Order", lambda op, **kwargs: op)
+    rpc = RPC()
+    events = make(rpc, batch=10, max_seconds=-1).market_events(1, 100)
+    assert rpc.calls == []
+    assert events == []
+
+
+def test_no_blocks_without_market_subscriptions():
+    rpc = RPC()
+    assert make(rpc, markets={}).market_events(1, 100) == []
+    assert rpc.calls == []
+
+
+def test_replayed_market_events_reach_the_paper_engine(monkeypatch):
+    monkeypatch.setattr(backfill, "Order", lambda op, **kwargs: dict(op))
+    seen = []
+
+    def amount(data):
+        return data["amount_to_sell"]["amount"]
+
+    b = make(RPC())
+    infrastructure = b.infrastructure
+    infrastructure.paper = SimpleNamespace(on_market=lambda d: seen.append(("paper", amount(d))))
+    infrastructure.bots = {"bot": SimpleNamespace(disabled=False)}
+    infrastructure.dispatch = lambda botname, event, data, **kwargs: seen.append((botname, amount(data)))
+    assert b.replay(1, 2) == 2
+    assert seen == [("paper", 1), ("bot", 1), ("paper", 2), ("bot", 2)]
@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+from bitshares.price import Order, FilledOrder
+from stakemachine.basestrategy import BaseStrategy
+
+
+class Custom(FilledOrder):
+    pass
+
+
+class A(BaseStrategy):
+    pass
+
+
+class B(BaseStrategy):
+    pass
+
+
+B._routes[FilledOrder] = "onMarketUpdate"
+
+
+def test_routes_are_per_class():
+    assert A._route_event(Custom) == "onOrderMatched"
+    assert B._route_event(Custom) == "onMarketUpdate"
+    assert Custom not in BaseStrategy._routes
+    assert BaseStrategy._route_event(FilledOrder) == "onOrderMatched"
+    assert A._route_event(Order) == "onOrderPlaced"
+    assert A._route_event(dict) is None
+
+
+class Recorder(list):
+    def cancel(self, ids, account=None):
+        self.append(ids)
+        return {"operations": []}
+
+
+def strategy(registered, on_chain, **bot):
+    s = SimpleNamespace(
+        paper=None,
+        ledger=None,
+        bot=bot,
+        interests=None,
+        markets=[],
+        account=None,
+        bitshares=Recorder(),
+        registry=SimpleNamespace(ids=registered, record=lambda tx: None),
+        chain_orders_in=lambda *m: [{"id": i} for i in on_chain],
+        _handlers=lambda event: [],
+    )
+    s.cancel = lambda ids: BaseStrategy.cancel(s, ids)
+    return s
+
+
+def test_cancelall_uses_the_registry():
+    s = strategy(["1.7.1"], ["1.7.1", "1.7.2"])
+    BaseStrategy.cancelall(s)
+    assert s.bitshares == [["1.7.1"]]
+
+
+def test_cancelall_falls_back_to_the_chain():
+    s = strategy([], ["1.7.1", "1.7.2"])
+    BaseStrategy.cancelall(s)
+    assert s.bitshares == [["1.7.1", "1.7.2"]]
+
+
+def test_registry_events_are_always_consumed():
+    s = strategy([], [], events=["ontick"])
+    assert BaseStrategy.get_interests(s) == {
+        "ontick", "onFill", "onOrderCreated", "onOrderCancelled"}
+    s.paper = object()
+    assert BaseStrategy.get_interests(s) == {"ontick"}
+
+
+def test_bundling_is_per_bot():
+    s = SimpleNamespace(bitshares=SimpleNamespace(bundle=False), bundle=True)
+    with BaseStrategy.bundling(s):
+        assert s.bitshares.bundle is True
+    assert s.bitshares.bundle is False
+
+
+def test_latest_event_is_kept_in_memory_until_flushed():
+    from contextlib import nullcontext
+    handled = []
+    s = SimpleNamespace(
+        name="bot",
+        meta={},
+        last_event=None,
+        _last_event_name=None,
+        _dispatch_table={"ontick": (handled.append,)},
+        bundling=nullcontext,
+        get_state=lambda: "running",
+        ledger=None,
+        backend=SimpleNamespace(flush=lambda: None),
+    )
+    s.store_meta = lambda: BaseStrategy.store_meta(s)
+    BaseStrategy.dispatch(s, "ontick", 1)
+    assert handled == [1]
+    assert s.meta == {}
+    BaseStrategy.flush(s)
+    assert s.meta["bot"]["state"] == "running"
+    assert s.meta["bot"]["last_event"] == {"event": "ontick", "time": s.last_event}
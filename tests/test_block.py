@@ -0,0 +1,46 @@
+import threading
+from stakemachine.block import BlockContext
+
+
+class RPC():
+    def __init__(self):
+        self.calls = 0
+
+    def get_block(self, num):
+        self.calls += 1
+        return {
+            "timestamp": "2018-01-01T00:00:00",
+            "witness": "1.6.1",
+            "transactions": [{"operations": [[1, {"fee": 1}], [0, {"fee": 2}]]}],
+        }
+
+
+class BitShares():
+    def __init__(self):
+        self.rpc = RPC()
+
+
+def test_block_is_fetched_once():
+    bitshares = BitShares()
+    block = BlockContext(
+        "000000ff" + "0" * 32,
+        operation_filter=lambda op_id, op: op_id == 1,
+        bitshares_instance=bitshares)
+    assert block.num == 255
+    assert block == "000000ff" + "0" * 32
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(block.operations))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert bitshares.rpc.calls == 1
+    assert all(r is results[0] for r in results)
+    assert results[0] == ({
+        "op": [1, {"fee": 1}], "block_num": 255, "trx_in_block": 0, "op_in_trx": 0
+    },)
+    assert block.witness == "1.6.1"
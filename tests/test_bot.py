@@ -0,0 +1,36 @@
+from stakemachine.bot import BotInfrastructure
+
+
+class Bot():
+    def __init__(self, events, reconcile_blocks=0):
+        self.events = set(events)
+        self.reconcile_blocks = reconcile_blocks
+
+    def wants(self, events):
+        return bool(self.events & events)
+
+
+def infrastructure(**bots):
+    infra = BotInfrastructure.__new__(BotInfrastructure)
+    infra.block_bots = ()
+    infra.memory = None
+    infra.paper = None
+    infra.backfill = None
+    infra.bots = bots
+    return infra
+
+
+def test_no_blocks_without_consumers():
+    assert not infrastructure(bot=Bot({"onFill"})).needs_blocks()
+
+
+def test_backfill_needs_blocks_if_there_is_something_to_replay():
+    infra = infrastructure(bot=Bot({"onFill"}))
+    infra.backfill = object()
+    assert infra.needs_blocks()
+    infra.bots = {"bot": Bot(set())}
+    assert not infra.needs_blocks()
+
+
+def test_reconcile_needs_blocks():
+    assert infrastructure(bot=Bot(set(), reconcile_blocks=10)).needs_blocks()
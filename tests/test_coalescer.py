@@ -0,0 +1,59 @@
+from stakemachine.coalescer import Coalescer
+
+
+class RPC():
+    def __init__(self):
+        self.calls = []
+
+    def get_objects(self, ids):
+        self.calls.append(("get_objects", list(ids)))
+        return [{"id": i} for i in ids]
+
+    def get_object(self, id):
+        return self.get_objects([id])[0]
+
+    def get_full_accounts(self, names, subscribe):
+        self.calls.append(("get_full_accounts", list(names)))
+        return [[n, {"account": {"name": n}}] for n in names]
+
+    def get_dynamic_global_properties(self):
+        self.calls.append(("get_dynamic_global_properties",))
+        return {"head_block_number": 1}
+
+
+def test_cheap_calls_prefetch_the_keys_of_the_previous_cycle():
+    rpc = RPC()
+    coalescer = Coalescer(rpc)
+    with coalescer.cycle():
+        coalescer.get_objects(["1.3.0"])
+        coalescer.get_objects(["1.3.1"])
+    rpc.calls.clear()
+    with coalescer.cycle():
+        coalescer.get_objects(["1.3.0"])
+        coalescer.get_objects(["1.3.1"])
+    assert len(rpc.calls) == 1
+    assert sorted(rpc.calls[0][1]) == ["1.3.0", "1.3.1"]
+
+
+def test_full_accounts_are_not_prefetched():
+    rpc = RPC()
+    coalescer = Coalescer(rpc)
+    with coalescer.cycle():
+        coalescer.get_full_accounts(["a"], False)
+        coalescer.get_full_accounts(["b"], False)
+    rpc.calls.clear()
+    with coalescer.cycle():
+        assert coalescer.get_full_accounts(["a"], False)[0][0] == "a"
+        coalescer.get_full_accounts(["a"], False)
+    assert rpc.calls == [("get_full_accounts", ["a"])]
+
+
+def test_answers_are_shared_not_copied():
+    rpc = RPC()
+    coalescer = Coalescer(rpc)
+    with coalescer.cycle():
+        first = coalescer.get_dynamic_global_properties()
+        assert coalescer.get_dynamic_global_properties() is first
+        obj = coalescer.get_objects(["1.3.0"])[0]
+        assert coalescer.get_object("1.3.0") is obj
+    assert len(rpc.calls) == 2
@@ -0,0 +1,77 @@
+import os
+import sys
+import datetime
+import pytest
+from stakemachine import config, storage
+from stakemachine.exceptions import InvalidConfigException
+
+CONFIG = """
+node: wss://node.example
+bots:
+  test:
+    module: strategy_under_test
+    bot: Strategy
+    account: maker
+    market: HERO:BTS
+    since: 2018-01-02
+    levels:
+      1: 0.5
+"""
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    module = tmp_path / "strategy_under_test.py"
+    module.write_text("class Strategy():\n    pass\n")
+    filename = tmp_path / "config.yml"
+    filename.write_text(CONFIG)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(storage, "data_dir", str(tmp_path / "data"))
+    monkeypatch.setattr(config, "_cache", dict())
+    calls = []
+    validate = config.validate
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return validate(*args, **kwargs)
+    monkeypatch.setattr(config, "validate", counting)
+    yield str(filename), calls
+    sys.modules.pop("strategy_under_test", None)
+
+
+def test_config_is_validated_once_and_keeps_types(env):
+    filename, calls = env
+    first = config.load_config(filename)
+    first["bots"]["test"]["levels"][2] = 1
+    second = config.load_config(filename)
+    assert len(calls) == 1
+    assert second["bots"]["test"]["since"] == datetime.date(2018, 1, 2)
+    assert second["bots"]["test"]["levels"] == {1: 0.5}
+
+
+def test_nothing_is_cached_on_disk(env):
+    filename, calls = env
+    config.load_config(filename)
+    assert not os.path.exists(storage.data_dir)
+    config._cache.clear()
+    config.load_config(filename)
+    assert len(calls) == 2
+
+
+def test_changed_file_is_validated_again(env):
+    filename, calls = env
+    config.load_config(filename)
+    with open(filename, "a") as f:
+        f.write("    threshold: 5\n")
+    assert config.load_config(filename)["bots"]["test"]["threshold"] == 5
+    assert len(calls) == 2
+
+
+def test_invalid_config_is_not_cached(env):
+    filename, calls = env
+    with open(filename, "w") as f:
+        f.write("bots: {}\n")
+    for _ in range(2):
+        with pytest.raises(InvalidConfigException):
+            config.load_config(filename)
+    assert len(calls) == 2
@@ -0,0 +1,68 @@
+import types
+from stakemachine.ledger import Ledger
+from stakemachine.timeseries import TimeSeries
+
+
+class Amount(dict):
+    def __init__(self, amount, asset):
+        super().__init__(asset={"id": asset})
+        self.amount = amount
+
+    def __float__(self):
+        return self.amount
+
+
+class Strategy():
+    def __init__(self, path):
+        self.path = path
+        self._timeseries = dict()
+        self.headers = []
+
+        def get_block_header(num):
+            self.headers.append(num)
+            return {"timestamp": "2018-01-01T00:00:%02d" % num}
+        self.bitshares = types.SimpleNamespace(
+            rpc=types.SimpleNamespace(get_block_header=get_block_header))
+
+    def timeseries(self, name, columns):
+        if name not in self._timeseries:
+            self._timeseries[name] = TimeSeries(
+                "bot", name, columns, path=str(self.path / name))
+        return self._timeseries[name]
+
+
+def fill(block, operation):
+    return {
+        "base": Amount(1.0, "1.3.1"),
+        "quote": Amount(2.0, "1.3.0"),
+        "block_num": block,
+        "operation_id": "1.11.%d" % operation,
+    }
+
+
+def test_fills_carry_the_block_time(tmp_path):
+    strategy = Strategy(tmp_path)
+    ledger = Ledger(strategy, [["1.3.0", "1.3.1"]])
+    assert ledger.onFill(fill(10, 1))
+    assert ledger.onFill(fill(5, 2))
+    series = strategy._timeseries["fills"]
+    assert list(series.column("block")) == [10, 10]
+    # 2018-01-01 00:00:10 UTC, replayed fills keep the order
+    assert list(series.column("time")) == [1514764810.0, 1514764810.0]
+    assert not ledger.onFill(fill(10, 1))
+
+
+def test_fills_are_flushed_on_a_timer(tmp_path, monkeypatch):
+    strategy = Strategy(tmp_path)
+    ledger = Ledger(strategy, [["1.3.0", "1.3.1"]], flush_interval=60)
+    flushes = []
+    ledger.onFill(fill(1, 1))
+    series = strategy._timeseries["fills"]
+    monkeypatch.setattr(series, "flush", lambda: flushes.append(1))
+    ledger.onFill(fill(2, 2))
+    assert not flushes
+    ledger._flushed -= 60
+    ledger.onFill(fill(3, 3))
+    assert flushes == [1]
+    ledger.flush()
+    assert flushes == [1, 1]
@@ -0,0 +1,63 @@
+from stakemachine.memory import MemoryWatchdog, retained_size, handler_count
+
+
+class Slot():
+    def __init__(self, targets):
+        self.targets = targets
+
+
+class Bot():
+    __events__ = ["ontick", "onFill", "onAccount"]
+
+    def __init__(self, shared, size):
+        self.shared = shared
+        self.backend = shared
+        self.data = bytearray(size)
+        self.ontick = Slot([print, print])
+        self.onFill = print
+
+
+class Infrastructure():
+    def __init__(self, **sizes):
+        self.config = {}
+        self.bitshares = object()
+        self.paper = None
+        shared = bytearray(10 ** 6)
+        self.bots = {name: Bot(shared, size) for name, size in sizes.items()}
+        self.restarted = []
+
+    def restart_bot(self, botname):
+        self.restarted.append(botname)
+
+
+def watchdog(infrastructure):
+    memory = MemoryWatchdog.__new__(MemoryWatchdog)
+    memory.infrastructure = infrastructure
+    return memory
+
+
+def test_retained_size_excludes_shared_objects():
+    shared = bytearray(10 ** 6)
+    own = {"a": bytearray(1000), "shared": shared}
+    assert retained_size(own, exclude=[shared]) < 10 ** 4
+    assert retained_size(own) > 10 ** 6
+
+
+def test_memory_is_attributed_per_bot():
+    infra = Infrastructure(small=1000, large=10 ** 5)
+    per_bot = watchdog(infra).by_bot()
+    assert per_bot["small"] < 10 ** 4
+    assert 10 ** 5 < per_bot["large"] < 2 * 10 ** 5
+
+
+def test_only_the_worst_offender_is_restarted():
+    infra = Infrastructure(a=1000, b=10 ** 5, c=10 ** 4)
+    memory = watchdog(infra)
+    memory.restart(memory.by_bot())
+    assert infra.restarted == ["b"]
+
+
+def test_handler_count_does_not_create_handlers():
+    bot = Bot(None, 0)
+    assert handler_count(bot) == 3
+    assert "onAccount" not in vars(bot)
@@ -0,0 +1,100 @@
+from stakemachine.bot import BotInfrastructure
+
+
+class RPC():
+    """ Account history of a single account with ``total`` operations
+    """
+    def __init__(self, total):
+        self.total = total
+        self.calls = []
+
+    def entry(self, sequence):
+        return {"id": "1.11.%d" % (1000 + sequence), "sequence": sequence}
+
+    def get_relative_account_history(self, account_id, stop, limit, start, api=None):
+        self.calls.append((stop, limit, start))
+        assert limit <= 100
+        start = min(start or self.total, self.total)
+        return [self.entry(s) for s in range(start, max(stop, 1) - 1, -1)][:limit]
+
+    def get_objects(self, ids):
+        assert all(isinstance(i, str) and i.startswith("2.6.") for i in ids)
+        return [{"id": i, "total_ops": self.total} for i in ids]
+
+
+class Bot():
+    # Like ``Account(full=True)``, which replaces the statistics id by
+    # the object
+    account = {
+        "id": "1.2.1",
+        "statistics": {"id": "2.6.1", "owner": "1.2.1", "total_ops": 1},
+    }
+
+
+class Subscriptions():
+    account_id_index = {"1.2.1": ("bot",)}
+
+
+class BitShares():
+    def __init__(self, rpc):
+        self.rpc = rpc
+
+
+def infrastructure(total):
+    infra = BotInfrastructure.__new__(BotInfrastructure)
+    infra.bitshares = BitShares(RPC(total))
+    infra.subscriptions = Subscriptions()
+    infra.bots = {"bot": Bot()}
+    infra._total_ops = dict()
+    return infra
+
+
+def update(total):
+    return {"owner": "1.2.1", "total_ops": total}
+
+
+def sequences(entries):
+    return [e["sequence"] for e in entries]
+
+
+def test_seeded_at_subscription():
+    infra = infrastructure(50)
+    infra.seed_operations()
+    assert infra._total_ops == {"1.2.1": 50}
+    infra.bitshares.rpc.total = 53
+    assert sequences(infra.new_operations(update(53))) == [51, 52, 53]
+    assert infra.new_operations(update(53)) == []
+
+
+def test_unseeded_account_delivers_latest_operation():
+    infra = infrastructure(50)
+    assert sequences(infra.new_operations(update(50))) == [50]
+
+
+def test_history_is_paginated():
+    infra = infrastructure(1000)
+    infra._total_ops["1.2.1"] = 750
+    entries = infra.new_operations(update(1000))
+    assert sequences(entries) == list(range(751, 1001))
+    assert infra.bitshares.rpc.calls == [
+        (751, 100, 1000), (751, 100, 900), (751, 50, 800)]
+
+
+def test_later_operations_are_not_delivered_early():
+    infra = infrastructure(50)
+    infra.seed_operations()
+    # Two more operations have happened by the time the update is handled
+    infra.bitshares.rpc.total = 55
+    assert sequences(infra.new_operations(update(53))) == [51, 52, 53]
+    assert sequences(infra.new_operations(update(55))) == [54, 55]
+
+
+def test_counter_is_updated_without_fetching():
+    infra = infrastructure(50)
+    infra.seed_operations()
+    assert infra.count_operations(update(52)) == 2
+    assert infra.bitshares.rpc.calls == []
+    assert infra._total_ops["1.2.1"] == 52
+    # Stale updates do not move the counter back
+    assert infra.count_operations(update(51)) == 0
+    assert infra._total_ops["1.2.1"] == 52
@@ -0,0 +1,68 @@
+from stakemachine.paper import PaperEngine
+
+
+class BitShares():
+    bundle = False
+
+
+class FakeMarket(dict):
+    def __init__(self):
+        super().__init__(
+            base={"id": "1.3.0", "symbol": "BTS"},
+            quote={"id": "1.3.1", "symbol": "GOLD"})
+        self.asks = []
+
+    def orderbook(self, limit=25):
+        return {
+            "asks": [{"price": p, "quote": q} for p, q in self.asks],
+            "bids": [],
+        }
+
+
+def engine(**kwargs):
+    paper = PaperEngine(bitshares_instance=BitShares(), **kwargs)
+    paper.wallets["alice"] = {"BTS": 1000.0, "GOLD": 0.0}
+    return paper
+
+
+def filled(paper):
+    return sum(f["amount"] for f in paper.fills)
+
+
+def test_book_liquidity_is_consumed_once():
+    paper, market = engine(), FakeMarket()
+    market.asks = [(2.0, 10.0)]
+    paper.place(market, "buy", 2.0, 6, "alice")
+    paper.place(market, "buy", 2.0, 6, "alice")
+    assert filled(paper) == 10
+    assert len(paper.orders) == 1
+
+
+def test_consumption_is_forgotten_when_the_level_leaves_the_book():
+    paper, market = engine(), FakeMarket()
+    market.asks = [(2.0, 10.0)]
+    paper.place(market, "buy", 2.0, 10, "alice")
+    market.asks = [(3.0, 1.0)]
+    paper.place(market, "buy", 1.0, 1, "alice", killfill=True)
+    assert not paper._consumed
+    market.asks = [(2.0, 4.0)]
+    paper.place(market, "buy", 2.0, 4, "alice")
+    assert filled(paper) == 14
+
+
+def test_consumption_is_capped_to_the_level():
+    paper, market = engine(), FakeMarket()
+    market.asks = [(2.0, 10.0)]
+    paper.place(market, "buy", 2.0, 8, "alice")
+    market.asks = [(2.0, 5.0)]
+    paper.place(market, "buy", 2.0, 1, "alice", killfill=True)
+    assert filled(paper) == 8
+    assert paper._consumed[("1.3.0", "1.3.1", "asks", 2.0)][0] == 5
+
+
+def test_consumption_expires():
+    paper, market = engine(consumed_ttl=-1), FakeMarket()
+    market.asks = [(2.0, 10.0)]
+    paper.place(market, "buy", 2.0, 10, "alice")
+    paper.place(market, "buy", 2.0, 10, "alice")
+    assert filled(paper) == 20
@@ -0,0 +1,60 @@
+import types
+from stakemachine.pool import Node, NodePool
+from stakemachine.bot import BotInfrastructure
+
+
+class Socket():
+    def __init__(self):
+        self.closed = False
+        self.keep_running = True
+
+    def close(self):
+        self.closed = True
+
+
+class Connection():
+    """ Takes every unknown attribute as API call like the real one
+    """
+    def __init__(self):
+        self.ws = Socket()
+
+    def __getattr__(self, name):
+        raise AssertionError("API call %s" % name)
+
+
+def test_failed_node_closes_its_connection():
+    rpc = Connection()
+    node = Node("wss://a", rpc)
+    node.failed(5)
+    assert rpc.ws.closed
+    assert node.rpc is None
+    assert not node.up
+    # Nothing left to close
+    node.failed(5)
+
+
+def test_failing_call_closes_the_connection():
+    pool = NodePool(["wss://a"])
+    rpc = Connection()
+    pool.nodes[0].rpc = rpc
+    unhealthy = []
+    pool.on_unhealthy += unhealthy.append
+    try:
+        pool.call("get_objects", ["2.8.0"])
+    except AssertionError:
+        pass
+    assert rpc.ws.closed
+    assert unhealthy == ["wss://a"]
+
+
+def test_unhealthy_node_leaves_closing_to_the_notify_thread():
+    socket = Socket()
+    infra = BotInfrastructure.__new__(BotInfrastructure)
+    infra.notify = types.SimpleNamespace(
+        websocket=types.SimpleNamespace(url="wss://a", ws=socket))
+    infra.bitshares = types.SimpleNamespace(rpc=types.SimpleNamespace(url="wss://b"))
+    infra.on_unhealthy_node("wss://b")
+    assert socket.keep_running
+    infra.on_unhealthy_node("wss://a")
+    assert not socket.keep_running
+    assert not socket.closed
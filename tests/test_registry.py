@@ -0,0 +1,45 @@
+from stakemachine.registry import OrderRegistry
+
+
+class Storage(dict):
+    def __getitem__(self, key):
+        return self.get(key)
+
+
+def order(order_id, sold, received, for_sale):
+    return {
+        "id": order_id,
+        "base": {"asset": {"id": sold}},
+        "quote": {"asset": {"id": received}},
+        "for_sale": for_sale,
+    }
+
+
+def registry():
+    return OrderRegistry(Storage(), "1.2.1", [["1.3.0", "1.3.1"]])
+
+
+def test_reconcile_takes_the_amounts_from_the_chain():
+    r = registry()
+    r.add("1.7.1", "1.3.0", "1.3.1", 10.0)
+    r.add("1.7.2", "1.3.0", "1.3.1", 5.0)
+    added, removed = r.reconcile([
+        order("1.7.1", "1.3.0", "1.3.1", 4.0),
+        order("1.7.3", "1.3.1", "1.3.0", 2.0),
+    ])
+    assert added == {"1.7.3"}
+    assert removed == {"1.7.2"}
+    assert r.orders["1.7.1"]["for_sale"] == 4.0
+    assert r.orders["1.7.3"] == {"asset_id": "1.3.1", "receive_id": "1.3.0", "for_sale": 2.0}
+    assert r.storage["__orders__"] == r.orders
+
+
+def test_fills_and_cancels():
+    r = registry()
+    r.add("1.7.1", "1.3.0", "1.3.1", 10.0)
+    r.add("1.7.2", "1.3.0", "1.3.1", 5.0)
+    r.filled("1.7.1", "1.3.0", 4.0)
+    assert r.orders["1.7.1"]["for_sale"] == 6.0
+    r.filled("1.7.1", "1.3.0", 6.0)
+    r.onOrderCancelled({"order_id": "1.7.2"})
+    assert r.ids == []
@@ -0,0 +1,65 @@
+import threading
+import types
+from stakemachine.scheduler import Scheduler
+from stakemachine.bot import BotInfrastructure
+from bitshares.price import FilledOrder
+
+
+def run_all(scheduler):
+    while scheduler.run_next(timeout=0):
+        pass
+
+
+def test_full_queue_sheds_the_oldest_ticks():
+    scheduler = Scheduler(max_queue=2)
+    done = []
+    scheduler.submit("tick", done.append, "tick 1")
+    scheduler.submit("tick", done.append, "tick 2")
+    scheduler.submit("fill", done.append, "fill")
+    scheduler.submit("tick", done.append, "tick 3")
+    run_all(scheduler)
+    assert done == ["fill", "tick 3"]
+    assert scheduler.stats["tick"]["dropped"] == 2
+
+
+def test_full_queue_drops_new_ticks_behind_more_important_work():
+    scheduler = Scheduler(max_queue=1)
+    done = []
+    scheduler.submit("fill", done.append, "fill")
+    scheduler.submit("tick", done.append, "tick")
+    run_all(scheduler)
+    assert done == ["fill"]
+    assert scheduler.stats["tick"]["dropped"] == 1
+
+
+def test_full_queue_makes_submitters_wait():
+    scheduler = Scheduler(max_queue=1)
+    scheduler._running = True
+    done = []
+    scheduler.submit("fill", done.append, 1)
+    submitter = threading.Thread(target=scheduler.submit, args=("fill", done.append, 2))
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive()
+    scheduler.run_next(timeout=0)
+    submitter.join(2)
+    assert not submitter.is_alive()
+    run_all(scheduler)
+    assert done == [1, 2]
+
+
+class Fill(FilledOrder):
+    """ A ``FilledOrder`` without the asset lookups of its constructor
+    """
+    def __init__(self, account_id):
+        dict.__init__(self, account_id=account_id)
+
+
+def test_only_fills_of_the_bots_are_urgent():
+    infra = BotInfrastructure.__new__(BotInfrastructure)
+    infra.subscriptions = types.SimpleNamespace(account_ids={"1.2.1"})
+    handled = []
+    infra.handle = lambda cls, func, data: handled.append(cls)
+    for data in (Fill("1.2.1"), Fill("1.2.2"), {"id": "1.7.1"}):
+        infra.on_market(data)
+    assert handled == ["fill", "market", "market"]
@@ -0,0 +1,223 @@
+import time
+from sqlalchemy.orm import sessionmaker
+from stakemachine.codec import Codec, _satoshis
+from stakemachine.storage import (
+    Storage, MemoryBackend, SQLiteBackend, StorageWriter, Base,
+    create_sqlite_engine
+)
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def get(self, category, key):
+        self.reads += 1
+        return super().get(category, key)
+
+
+def test_reads_are_cached():
+    backend = CountingBackend()
+    storage = Storage("bot", backend=backend)
+    storage["price"] = 0.5
+    assert storage["price"] == 0.5
+    assert storage["price"] == 0.5
+    assert backend.reads == 0
+
+
+class CountingCodec(Codec):
+    def __init__(self):
+        super().__init__()
+        self.decoded = 0
+
+    def decode(self, data):
+        self.decoded += 1
+        return super().decode(data)
+
+
+def test_mutable_values_are_decoded_once():
+    codec = CountingCodec()
+    storage = Storage("bot", backend=MemoryBackend(), codec=codec)
+    value = {"base": {"amount": 1}, "quote": {"amount": 2}}
+    storage["feed_price"] = value
+    value["base"] = None
+    for _ in range(3):
+        assert storage["feed_price"] == {"base": {"amount": 1}, "quote": {"amount": 2}}
+    assert codec.decoded == 1
+    storage.clear_cache()
+    storage["feed_price"]
+    storage["feed_price"]
+    assert codec.decoded == 2
+
+
+def test_mutable_values_are_not_shared():
+    storage = Storage("bot", backend=MemoryBackend())
+    storage["orders"] = ["1.7.1"]
+    orders = storage["orders"]
+    orders.append("1.7.2")
+    assert storage["orders"] == ["1.7.1"]
+    assert storage["orders"] is not storage["orders"]
+
+
+def test_cache_is_shared_per_backend_and_category():
+    backend = CountingBackend()
+    first = Storage("bot", backend=backend)
+    second = Storage("bot", backend=backend)
+    other = Storage("other", backend=backend)
+    first["x"] = 1
+    assert second["x"] == 1
+    second["x"] = 2
+    assert first["x"] == 2
+    del second["x"]
+    assert first["x"] is None
+    assert other["x"] is None
+    assert "x" not in first
+
+
+def test_sqlite_backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "test.sqlite"))
+    storage = Storage("bot", backend=backend)
+    storage["a"] = {"b": [1, 2]}
+    backend.flush()
+    storage.clear_cache()
+    assert storage["a"] == {"b": [1, 2]}
+    assert storage.items() == [("a", {"b": [1, 2]})]
+    backend.close()
+
+
+def test_satoshis_are_exact():
+    amount = {"amount": 89174383.8809069, "asset": {"precision": 8}}
+    assert _satoshis(amount) == 8917438388090690
+    assert _satoshis({"amount": 0.29, "asset": {"precision": 5}}) == 29000
+
+
+def test_codec_roundtrip():
+    codec = Codec()
+    value = {"a": [1, 2.5, "x", None, True], "b": {"c": b"\x01"}}
+    assert codec.decode(codec.encode(value)) == value
+    assert codec.decode('{"legacy": 1}') == {"legacy": 1}
+
+
+class Recorder():
+    def __init__(self):
+        self.written = []
+
+    def _written(self, writes):
+        self.written.append(dict(writes))
+
+
+def failing_sessions(filename, failures):
+    engine = create_sqlite_engine(filename)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    def factory():
+        session = Session()
+        commit = session.commit
+
+        def failing_commit():
+            if failures[0]:
+                failures[0] -= 1
+                raise RuntimeError("disk I/O error")
+            commit()
+        session.commit = failing_commit
+        return session
+    return factory
+
+
+def test_writer_retries_failed_commits(tmp_path):
+    backend = Recorder()
+    failures = [2]
+    writer = StorageWriter(
+        failing_sessions(str(tmp_path / "w.sqlite"), failures), backend, backoff=0.01)
+    writer.start()
+    writer.queue.put((1, "bot", "key", b"value"))
+    writer.queue.join()
+    assert failures == [0]
+    assert backend.written == [{("bot", "key"): (1, b"value")}]
+
+
+def test_writer_keeps_writes_pending_until_committed(tmp_path):
+    backend = Recorder()
+    failures = [4]
+    writer = StorageWriter(
+        failing_sessions(str(tmp_path / "w.sqlite"), failures), backend,
+        retries=2, backoff=0.01, max_backoff=0.05)
+    writer.start()
+    writer.queue.put((1, "bot", "key", b"old"))
+    writer.queue.join()
+    assert backend.written == []
+    assert writer.failed == {("bot", "key"): (1, b"old")}
+
+    writer.queue.put((2, "bot", "other", b"new"))
+    writer.queue.join()
+    deadline = time.time() + 5
+    while not backend.written and time.time() < deadline:
+        time.sleep(0.01)
+    assert backend.written == [{
+        ("bot", "key"): (1, b"old"),
+        ("bot", "other"): (2, b"new"),
+    }]
+    assert writer.failed == {}
+
+
+def test_sqlite_reads_pending_values_while_commit_fails(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "test.sqlite"))
+    backend.writer.retries = 1
+    backend.writer.max_backoff = 0.05
+
+    def fail(session, writes):
+        return False
+    commit = backend.writer.commit
+    backend.writer.commit = fail
+    backend.set("bot", "key", b"value")
+    backend.flush()
+    assert backend.get("bot", "key") == b"value"
+    backend.writer.commit = commit
+    deadline = time.time() + 5
+    while backend._pending and time.time() < deadline:
+        time.sleep(0.01)
+    assert not backend._pending
+    assert backend.items("bot") == [("key", b"value")]
+
+
+def test_dbm_snapshot_tells_missing_from_locked(tmp_path, monkeypatch):
+    import dbm
+    from stakemachine import storage
+    filename = str(tmp_path / "stakemachine.dbm")
+    assert storage.dbm_snapshot(filename=filename) == {}
+    backend = storage.DBMBackend(filename)
+    backend.set("bot", "key", b"value")
+    backend.set(storage.metaCategory, "bot", b"meta")
+    backend.close()
+    snapshot = storage.dbm_snapshot(["bot"], filename=filename)
+    assert snapshot["bot"]["keys"] == 1
+    assert snapshot[storage.metaCategory]["values"] == {"bot": b"meta"}
+
+    def locked(*args):
+        raise dbm.error[0]("locked")
+    monkeypatch.setattr(dbm, "open", locked)
+    assert storage.dbm_snapshot(filename=filename) is None
+
+
+def test_benchmark_reads_hit_the_backend():
+    from stakemachine.benchmark import walls_pattern
+    backend = CountingBackend()
+    walls_pattern(Storage("__benchmark__", backend=backend), rounds=20)
+    assert backend.reads == 3 * 20
+
+
+def test_migrate_meta_moves_legacy_keys():
+    from stakemachine import storage
+    backend = MemoryBackend()
+    codec = Codec()
+    backend.set("bot", "__state__", codec.encode("running"))
+    backend.set("bot", "__last_event__", codec.encode({"event": "ontick", "time": 1.0}))
+    backend.set("bot", "feed_price", codec.encode(0.5))
+    backend.set("other", "feed_price", codec.encode(0.5))
+    assert storage.migrate_meta(backend) == 1
+    assert Storage("bot", backend=backend).items() == [("feed_price", 0.5)]
+    assert Storage(storage.metaCategory, backend=backend)["bot"] == {
+        "state": "running", "last_event": {"event": "ontick", "time": 1.0}}
+    assert storage.migrate_meta(backend) == 0
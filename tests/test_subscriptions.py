@@ -0,0 +1,76 @@
+import logging
+from types import SimpleNamespace
+from stakemachine.subscriptions import renew_subscriptions, SubscriptionManager
+
+
+class Slot(list):
+    pass
+
+
+class Websocket():
+    __events__ = ["on_tx", "on_object", "on_block", "on_account", "on_market"]
+
+    def __init__(self, connected):
+        self.subscription_accounts = []
+        self.subscription_markets = []
+        self.on_tx = Slot()
+        self.on_object = Slot()
+        self.on_block = Slot(["x"])
+        self.calls = []
+        self.ws = type("App", (), {
+            "sock": type("Sock", (), {"connected": connected})()
+        })()
+
+    def __getattr__(self, name):
+        def method(*args):
+            self.calls.append((name, args))
+        return method
+
+
+class Notify():
+    def __init__(self, connected):
+        self.websocket = Websocket(connected)
+
+
+def test_renew_before_connect_only_sets_subscriptions():
+    notify = Notify(connected=False)
+    renew_subscriptions(notify, ["a"], ["X:Y"], [["1.3.0", "1.3.1"]])
+    assert notify.websocket.subscription_accounts == ["a"]
+    assert notify.websocket.subscription_markets == [["1.3.0", "1.3.1"]]
+    assert notify.websocket.calls == []
+
+
+def test_renew_connected_resubscribes():
+    notify = Notify(connected=True)
+    renew_subscriptions(notify, ["a"], ["X:Y"], [["1.3.0", "1.3.1"]])
+    names = [name for name, _ in notify.websocket.calls]
+    assert names[0] == "cancel_all_subscriptions"
+    assert ("get_full_accounts", (["a"], True)) in notify.websocket.calls
+    assert ("subscribe_to_market", (4, "1.3.0", "1.3.1")) in notify.websocket.calls
+    assert "set_block_applied_callback" in names
+
+
+def test_renew_uses_public_api():
+    calls = []
+
+    class NewNotify():
+        def reset_subscriptions(self, accounts, markets):
+            calls.append((accounts, markets))
+
+    renew_subscriptions(NewNotify(), ["a"], ["X:Y"], [["1.3.0", "1.3.1"]])
+    assert calls == [(["a"], ["X:Y"])]
+
+
+def test_disabling_a_bot_is_logged_once_per_interval(caplog):
+    bot = SimpleNamespace(disabled=False, wants=lambda events: False)
+    manager = SubscriptionManager(
+        Notify(connected=False), {"bot": bot}, {"bots": {"bot": {}}},
+        bitshares_instance=object(), log_interval=60)
+    manager.update()
+    with caplog.at_level(logging.WARNING, logger="stakemachine.subscriptions"):
+        for _ in range(2):
+            bot.disabled = True
+            manager.update()
+            bot.disabled = False
+            manager.update()
+    assert [r.getMessage() for r in caplog.records] == ["The bot bot has been disabled"]
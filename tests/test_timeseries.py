@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from stakemachine.timeseries import TimeSeries
+
+
+@pytest.fixture
+def series(tmp_path):
+    return TimeSeries("test", "feed", columns=("price",), chunk=4, path=str(tmp_path))
+
+
+def test_append_and_reopen(series, tmp_path):
+    series.extend(range(10), np.arange(10) * 3.0, price=np.arange(10) / 10)
+    series.flush()
+    again = TimeSeries("test", "feed", path=str(tmp_path))
+    assert again.columns == ["price"]
+    assert len(again) == 10
+    assert list(again.range(2, 4)["price"]) == [0.2, 0.3]
+    assert list(again.timerange(6, 12)["block"]) == [2, 3]
+
+
+def test_extend_rejects_unordered_batches(series):
+    series.extend([1, 2], [10.0, 20.0], price=[1, 2])
+    with pytest.raises(ValueError):
+        series.extend([3, 4], [30.0, 25.0], price=[3, 4])
+    with pytest.raises(ValueError):
+        series.extend([3, 4], [15.0, 30.0], price=[3, 4])
+    with pytest.raises(ValueError):
+        series.extend([5, 4], [30.0, 40.0], price=[3, 4])
+    assert len(series) == 2
+
+
+def test_downsample_aligns_to_step(series):
+    times = [3500.0, 3700.0, 7000.0, 7300.0, 11000.0]
+    series.extend(range(5), times, price=[1, 2, 3, 4, 5])
+    candles = series.downsample(3600, by="time", how="last")
+    assert list(candles["time"]) == [0, 3600, 7200, 10800]
+    assert list(candles["price"]) == [1, 3, 4, 5]
+    assert list(candles["count"]) == [1, 2, 1, 1]
@@ -0,0 +1,89 @@
+import time
+from collections import Counter
+from types import SimpleNamespace
+from stakemachine.basestrategy import BaseStrategy
+from stakemachine.strategies.walls import Walls
+
+
+class FakeWalls(dict):
+    tick = Walls.tick
+    test = Walls.test
+    requote = Walls.requote
+    debounced = Walls.debounced
+    head_block = BaseStrategy.head_block
+    count = Walls.count
+
+    def __init__(self, orders, interval=0):
+        super().__init__()
+        # The infrastructure's latest block, the node must not be asked
+        self.head = 100
+        self._head = lambda: self.head
+        self.bitshares = SimpleNamespace(rpc=None)
+        self._orders = orders
+        self.loaded = 0
+        self.sent = 0
+        self.test_blocks = 0
+        self.requote_interval = interval
+        self.threshold = 0.05
+        self.reset = 0.05
+        self.pending = False
+        self.recheck = False
+        self.requotes = Counter()
+        self._requotes_changed = False
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    @property
+    def orders(self):
+        self.loaded += 1
+        return self._orders
+
+    def updateorders(self):
+        self.sent += 1
+
+
+def test_orders_are_not_loaded_while_debounced():
+    walls = FakeWalls([], interval=60)
+    walls["last_requote"] = {"time": time.time(), "block": 1}
+    walls.test()
+    walls.test()
+    assert walls.loaded == 0
+    assert walls.recheck
+    assert walls.requotes["interval"] == 2
+    walls["last_requote"]["time"] -= 60
+    walls.tick(None)
+    assert walls.loaded == 1
+    assert walls.sent == 1
+    assert not walls.recheck
+
+
+def test_suppressed_missing_wall_stays_pending():
+    walls = FakeWalls([])
+    walls["last_requote"] = {"time": 0, "block": 99}
+    walls.test()
+    assert walls.sent == 1
+    assert walls["last_requote"]["block"] == 100
+    # Same head block: held back, but not forgotten
+    walls.requote()
+    assert walls.pending
+    assert walls.requotes["block"] == 1
+    walls.head = 101
+    walls.tick(None)
+    assert walls.sent == 2
+    assert not walls.pending
+
+
+def test_head_block_is_used_not_the_last_tick():
+    walls = FakeWalls([])
+    walls.test()
+    # Ticks of the blocks in between were dropped
+    walls.head = 105
+    walls.test()
+    assert walls.sent == 2
+
+
+def test_head_block_falls_back_to_the_node():
+    s = SimpleNamespace(_head=lambda: 0, bitshares=SimpleNamespace(rpc=SimpleNamespace(
+        get_dynamic_global_properties=lambda: {"head_block_number": 7})))
+    assert BaseStrategy.head_block(s) == 7